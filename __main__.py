@@ -32,16 +32,18 @@ REQUIRED = [
         'keys': ['-1', '--treatment-fq1'],
         'properties': {
             'type': str,
-            'required': True,
-            'help': 'path to the treatment read 1 fastq(.gz) file',
+            'required': False,
+            'default': 'None',
+            'help': 'path to the treatment read 1 fastq(.gz) file, or comma-separated files of lanes, unless --sample-sheet is given',
         }
     },
     {
         'keys': ['-2', '--treatment-fq2'],
         'properties': {
             'type': str,
-            'required': True,
-            'help': 'path to the treatment read 2 fastq(.gz) file',
+            'required': False,
+            'default': 'None',
+            'help': 'path to the treatment read 2 fastq(.gz) file, or comma-separated files of lanes, unless --sample-sheet is given',
         }
     },
 ]
@@ -52,7 +54,7 @@ OPTIONAL = [
             'type': str,
             'required': False,
             'default': 'None',
-            'help': 'path to the control read 1 fastq(.gz) file (default: %(default)s)',
+            'help': 'path to the control read 1 fastq(.gz) file, or comma-separated files of lanes (default: %(default)s)',
         }
     },
     {
@@ -61,7 +63,16 @@ OPTIONAL = [
             'type': str,
             'required': False,
             'default': 'None',
-            'help': 'path to the control read 2 fastq(.gz) file (default: %(default)s)',
+            'help': 'path to the control read 2 fastq(.gz) file, or comma-separated files of lanes (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--sample-sheet'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'path to a tab-separated sample sheet with columns "sample_name", "treatment_fq1", "treatment_fq2", "control_fq1" and "control_fq2",\nto run all samples in one batch instead of -1 -2 -3 -4 (default: %(default)s)',
         }
     },
     {
@@ -82,6 +93,25 @@ OPTIONAL = [
             'help': 'minimum read length after trimming (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--trim-output'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['stream', 'uncompressed', 'gzip'],
+            'default': 'gzip',
+            'help': 'trimmed reads are written as gzip or uncompressed fastq files, or piped into the read aligner (stream),\nuncompressed if streamed reads are split by --alignment-chunks (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--trimming-chunks'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'split untrimmed reads into chunks that are trimmed as separate tasks and concatenated, with FastQC of the untrimmed reads as a task of its own,\nwhen trimmed reads are written to files (not streamed), 1 for no splitting (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--read-aligner'],
         'properties': {
@@ -111,6 +141,33 @@ OPTIONAL = [
             'help': 'bowtie2 preset mode (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--alignment-chunks'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'split trimmed reads into chunks that are aligned as separate tasks and merged, 1 for no splitting (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--index-cache-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'directory of a persistent read aligner index cache shared across runs, "None" to build the index in the workdir (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--index-cache-max-size'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 200.0,
+            'help': 'maximum size (GB) of the index cache, beyond which least recently used indexes are removed (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--discard-bam'],
         'properties': {
@@ -125,6 +182,57 @@ OPTIONAL = [
             'help': 'do not mark PCR duplicates',
         }
     },
+    {
+        'keys': ['--markdup-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['gatk', 'samtools'],
+            'default': 'gatk',
+            'help': 'duplicate marking engine: GATK MarkDuplicates, or samtools markdup (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--filter-bam'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'filter the deduplicated BAM once by --filter-* options, into the BAM that coverage, peak calling and HOMER read',
+        }
+    },
+    {
+        'keys': ['--filter-min-mapq'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 30,
+            'help': 'minimum mapping quality of both reads of pairs kept by --filter-bam (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--filter-keep-improper-pairs'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'keep reads that are not properly paired, which --filter-bam removes otherwise',
+        }
+    },
+    {
+        'keys': ['--filter-contigs'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'primary',
+            'help': 'contigs kept by --filter-bam: comma-separated names, "primary" for numbered chromosomes, X and Y (e.g. chr1, chrX, but not chrM or alt contigs), or "all" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--filter-blacklist'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'BED(.gz) file of regions (e.g. the ENCODE blacklist) whose overlapping fragments are removed by --filter-bam (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--macs-effective-genome-size'],
         'properties': {
@@ -143,6 +251,22 @@ OPTIONAL = [
             'help': 'MACS false discovery rate (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--macs-separate-calls'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'call MACS narrow and broad peaks by two full runs, instead of deriving broad peaks from the pileup of the narrow run',
+        }
+    },
+    {
+        'keys': ['--homer-chromosome-groups'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'split HOMER tag directories and peak calls into chromosome groups (from the reference .fai) that run concurrently, 1 for no split (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--genome-version'],
         'properties': {
@@ -152,6 +276,25 @@ OPTIONAL = [
             'help': 'genome version for HOMER\'s peak annotation and motif finding, e.g. "hg38", "hg19", "mm8" (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--peak-annotation-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['homer', 'native'],
+            'default': 'homer',
+            'help': 'peak annotation by HOMER annotatePeaks.pl of --genome-version, or by the built-in engine of --gene-annotation,\nwhich loads the annotation once for all peak files (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--gene-annotation'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'GTF(.gz) or UCSC genePred (e.g. refGene.txt) file of the reference genome, for --peak-annotation-engine native (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--skip-motif-finding'],
         'properties': {
@@ -164,8 +307,8 @@ OPTIONAL = [
         'properties': {
             'type': int,
             'required': False,
-            'default': 150,
-            'help': 'fragment size for HOMER\'s motif finding (default: %(default)s)',
+            'default': 0,
+            'help': 'fragment size for HOMER\'s motif finding, 0 for the size estimated from the treatment BAM (default: %(default)s)',
         }
     },
     {
@@ -186,6 +329,77 @@ OPTIONAL = [
             'help': 'number of CPU threads (default: %(default)s)',
         }
     },
+    {
+        'keys': ['-m', '--max-memory'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 0.0,
+            'help': 'memory (GB) shared by concurrent tools, 0 for MemAvailable in /proc/meminfo (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--executor'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['local', 'pool', 'slurm'],
+            'default': 'local',
+            'help': 'backend running external commands: "local" on this host, "pool" in a bounded pool of low-priority processes on this host,\nor "slurm" as batch jobs, for which the workdir and outdir must be on a filesystem shared with the compute nodes (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--executor-jobs'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'maximum number of concurrent commands of the "pool" executor, 0 for --threads (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--max-job-memory'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 0.0,
+            'help': 'virtual memory limit (GB) of each command of the "pool" executor, 0 for no limit (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--slurm-options'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'extra sbatch options of the "slurm" executor, e.g. "--partition=short --time=12:00:00" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--stub-tools'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'run with fake executables of all external tools, which spend time, CPU and memory per a cost model,\nto benchmark orchestration without the bioinformatics tools: "default" or path to a JSON cost model (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--resume'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'path to the workdir of a previous run, in which stages with unchanged inputs, parameters and tool versions are skipped,\nand which is kept at the end of the run (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--keep-workdir'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'keep the workdir at the end of the run, so that it can be resumed by --resume',
+        }
+    },
     {
         'keys': ['-d', '--debug'],
         'properties': {
@@ -240,6 +454,8 @@ class EntryPoint:
 
     def run(self):
         args = self.parser.parse_args()
+        self.check_fastq_arguments(args=args)
+        self.check_peak_annotation_arguments(args=args)
         print(f'Start running ChIP-seq pipeline version {__VERSION__}\n', flush=True)
         chip_seq_pipeline.main(
             ref_fa=args.ref_fa,
@@ -247,27 +463,64 @@ class EntryPoint:
             treatment_fq2=args.treatment_fq2,
             control_fq1=args.control_fq1,
             control_fq2=args.control_fq2,
+            sample_sheet=args.sample_sheet,
 
             base_quality_cutoff=args.base_quality_cutoff,
             min_read_length=args.min_read_length,
+            trim_output=args.trim_output,
+            trimming_chunks=args.trimming_chunks,
 
             read_aligner=args.read_aligner,
             bowtie2_mode=args.bowtie2_mode,
+            alignment_chunks=args.alignment_chunks,
+            index_cache_dir=args.index_cache_dir,
+            index_cache_max_gb=args.index_cache_max_size,
             discard_bam=args.discard_bam,
 
             skip_mark_duplicates=args.skip_mark_duplicates,
+            markdup_engine=args.markdup_engine,
+
+            filter_bam=args.filter_bam,
+            filter_min_mapq=args.filter_min_mapq,
+            filter_keep_improper_pairs=args.filter_keep_improper_pairs,
+            filter_contigs=args.filter_contigs,
+            filter_blacklist=args.filter_blacklist,
 
             macs_effective_genome_size=args.macs_effective_genome_size,
             macs_fdr=args.macs_fdr,
+            macs_separate_calls=args.macs_separate_calls,
+            homer_chromosome_groups=args.homer_chromosome_groups,
 
             genome_version=args.genome_version,
+            peak_annotation_engine=args.peak_annotation_engine,
+            gene_annotation=args.gene_annotation,
             skip_motif_finding=args.skip_motif_finding,
             motif_finding_fragment_size=args.motif_finding_fragment_size,
 
             outdir=args.outdir,
             threads=args.threads,
+            max_memory_gb=args.max_memory,
+            executor=args.executor,
+            executor_jobs=args.executor_jobs,
+            max_job_memory_gb=args.max_job_memory,
+            slurm_options=args.slurm_options,
+            stub_tools=args.stub_tools,
+            resume=args.resume,
+            keep_workdir=args.keep_workdir,
             debug=args.debug)
 
+    def check_fastq_arguments(self, args: argparse.Namespace):
+        fastqs = [args.treatment_fq1, args.treatment_fq2, args.control_fq1, args.control_fq2]
+        if args.sample_sheet.lower() != 'none':
+            if any(fq.lower() != 'none' for fq in fastqs):
+                self.parser.error('-1 -2 -3 -4 cannot be used with --sample-sheet')
+        elif 'none' in [args.treatment_fq1.lower(), args.treatment_fq2.lower()]:
+            self.parser.error('the following arguments are required: -1/--treatment-fq1, -2/--treatment-fq2 (or --sample-sheet)')
+
+    def check_peak_annotation_arguments(self, args: argparse.Namespace):
+        if args.peak_annotation_engine == 'native' and args.gene_annotation.lower() == 'none':
+            self.parser.error('--peak-annotation-engine native needs --gene-annotation')
+
 
 if __name__ == '__main__':
     EntryPoint().main()
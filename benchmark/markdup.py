@@ -0,0 +1,92 @@
+"""
+Compares duplicate-marking engines on the same coordinate-sorted BAM, for speed and agreement with GATK:
+
+python -m benchmark.markdup --bam sorted-treatment.bam --threads 8
+
+For each engine: wall time, peak memory, number of duplicate reads,
+and the Jaccard index between its duplicate read names and those of GATK
+"""
+import os
+import time
+import argparse
+import subprocess
+import pandas as pd
+from typing import Set, Dict, Any, List
+from chip_seq_pipeline.template import Settings
+from chip_seq_pipeline.tools import get_temp_path
+from chip_seq_pipeline.mark_duplicates import MarkBamDuplicates
+
+
+REFERENCE_ENGINE = 'gatk'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark duplicate-marking engines on one BAM file')
+    parser.add_argument('--bam', required=True, help='path to a coordinate-sorted BAM file')
+    parser.add_argument('--engines', default=','.join(MarkBamDuplicates.ENGINES), help='comma-separated engines (default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=4, help='number of CPU threads (default: %(default)s)')
+    parser.add_argument('--outdir', default='markdup_benchmark', help='output directory (default: %(default)s)')
+    args = parser.parse_args()
+
+    rows = run_engines(
+        bam=args.bam,
+        engines=args.engines.split(','),
+        threads=args.threads,
+        outdir=args.outdir)
+
+    df = pd.DataFrame(rows)
+    df.to_csv(f'{args.outdir}/markdup-benchmark.tsv', sep='\t', index=False)
+    print(df.to_string(index=False))
+
+
+def run_engines(bam: str, engines: List[str], threads: int, outdir: str) -> List[Dict[str, Any]]:
+    rows, duplicates = [], {}
+    for engine in engines:
+        settings = Settings(
+            workdir=get_temp_path(prefix=f'{outdir}/workdir_{engine}_'),
+            outdir=f'{outdir}/{engine}',
+            threads=threads,
+            max_memory_gb=None,
+            debug=False,
+            mock=False)
+        for d in [settings.workdir, settings.outdir]:
+            os.makedirs(d, exist_ok=True)
+
+        start = time.time()
+        out_bam = MarkBamDuplicates(settings).main(bam=bam, engine=engine)
+        wall_seconds = time.time() - start
+
+        duplicates[engine] = get_duplicate_read_names(bam=out_bam)
+        rows.append({
+            'engine': engine,
+            'wall_seconds': round(wall_seconds, 1),
+            'peak_rss_mb': max(r['peak_rss_mb'] for r in settings.profiler.records),
+            'duplicate_reads': len(duplicates[engine]),
+        })
+
+    if REFERENCE_ENGINE in duplicates:
+        for row in rows:
+            row[f'jaccard_vs_{REFERENCE_ENGINE}'] = round(jaccard(duplicates[row['engine']], duplicates[REFERENCE_ENGINE]), 4)
+    return rows
+
+
+def get_duplicate_read_names(bam: str) -> Set[str]:
+    """
+    Names with mate number of primary reads flagged as duplicates
+    """
+    cmd = f'samtools view -f 1024 -F 2304 {bam} | cut -f 1,2'
+    output = subprocess.check_output(['bash', '-o', 'pipefail', '-c', cmd]).decode()
+    names = set()
+    for line in output.splitlines():
+        name, flag = line.split('\t')
+        names.add(f'{name}/{1 if int(flag) & 64 else 2}')
+    return names
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    union = a | b
+    return 1. if len(union) == 0 else len(a & b) / len(union)
+
+
+if __name__ == '__main__':
+    main()
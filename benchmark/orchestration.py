@@ -0,0 +1,134 @@
+"""
+Benchmarks orchestration (scheduling, core and memory budgets, logging) of a batch of many samples,
+with the fake executables of chip_seq_pipeline/stub_tools.py instead of the bioinformatics tools:
+
+python -m benchmark.orchestration --samples 200 --samples-per-control 10 --threads 8
+
+Small reads are simulated once (benchmark/simulate.py) and shared by all samples,
+the run time of each tool is then set by the cost model (--cost-model, JSON overrides of the default)
+"""
+import os
+import time
+import shutil
+import argparse
+import pandas as pd
+import chip_seq_pipeline
+from .simulate import simulate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark orchestration of a batch run with stub tools')
+    parser.add_argument('--samples', type=int, default=100, help='number of samples (default: %(default)s)')
+    parser.add_argument('--samples-per-control', type=int, default=10, help='samples sharing one control, 0 for no control (default: %(default)s)')
+    parser.add_argument('--pairs', type=int, default=10_000, help='simulated read pairs (default: %(default)s)')
+    parser.add_argument('--threads', type=int, default=4, help='number of CPU threads (default: %(default)s)')
+    parser.add_argument('--max-memory', type=float, default=0., help='memory (GB) shared by concurrent tools, 0 for MemAvailable (default: %(default)s)')
+    parser.add_argument('--cost-model', default='default', help='"default" or path to a JSON cost model (default: %(default)s)')
+    parser.add_argument('--outdir', default='orchestration_benchmark', help='output directory (default: %(default)s)')
+    args = parser.parse_args()
+
+    wall_seconds = run(
+        samples=args.samples,
+        samples_per_control=args.samples_per_control,
+        pairs=args.pairs,
+        threads=args.threads,
+        max_memory_gb=args.max_memory,
+        cost_model=args.cost_model,
+        outdir=args.outdir)
+
+    print(f'{args.samples} samples on {args.threads} threads: {wall_seconds:.1f} seconds')
+    print(pd.read_csv(f'{args.outdir}/pipeline/summary.tsv', sep='\t')['status'].value_counts().to_string())
+
+
+def run(
+        samples: int,
+        samples_per_control: int,
+        pairs: int,
+        threads: int,
+        max_memory_gb: float,
+        cost_model: str,
+        outdir: str) -> float:
+
+    sim = simulate(outdir=f'{outdir}/simulation', pairs=pairs, chromosomes=1, chromosome_length=1_000_000, peaks=10)
+
+    # each group of samples has its own control fastq files, so that the control is shared within the group
+    rows = []
+    for i in range(samples):
+        row = {
+            'sample_name': f'sample-{i + 1:04}',
+            'treatment_fq1': sim.chip_fq1,
+            'treatment_fq2': sim.chip_fq2,
+        }
+        if samples_per_control > 0:
+            group = i // samples_per_control
+            row['control_fq1'], row['control_fq2'] = link_control(sim.input_fq1, sim.input_fq2, group=group)
+        rows.append(row)
+    sample_sheet = f'{outdir}/sample-sheet.tsv'
+    pd.DataFrame(rows).to_csv(sample_sheet, sep='\t', index=False)
+
+    start = time.time()
+    chip_seq_pipeline.main(
+        ref_fa=sim.genome_fa,
+        treatment_fq1='None',
+        treatment_fq2='None',
+        control_fq1='None',
+        control_fq2='None',
+        sample_sheet=sample_sheet,
+
+        base_quality_cutoff=20,
+        min_read_length=20,
+        trim_output='stream',
+        trimming_chunks=1,
+
+        read_aligner='bowtie2',
+        bowtie2_mode='sensitive',
+        alignment_chunks=1,
+        index_cache_dir='None',
+        index_cache_max_gb=200.,
+        discard_bam=True,
+
+        skip_mark_duplicates=False,
+        markdup_engine='samtools',
+
+        filter_bam=False,
+        filter_min_mapq=30,
+        filter_keep_improper_pairs=False,
+        filter_contigs='primary',
+        filter_blacklist='None',
+
+        macs_effective_genome_size=str(sim.genome_size),
+        macs_fdr=0.05,
+        macs_separate_calls=False,
+        homer_chromosome_groups=1,
+
+        genome_version='hg38',
+        peak_annotation_engine='homer',
+        gene_annotation='None',
+        skip_motif_finding=False,
+        motif_finding_fragment_size=0,
+
+        outdir=f'{outdir}/pipeline',
+        threads=threads,
+        max_memory_gb=max_memory_gb,
+        executor='local',
+        executor_jobs=0,
+        max_job_memory_gb=0.,
+        slurm_options='None',
+        stub_tools=cost_model,
+        resume='None',
+        keep_workdir=False,
+        debug=False)
+    return time.time() - start
+
+
+def link_control(fq1: str, fq2: str, group: int):
+    """
+    Controls are identified by their file paths, so each group gets its own copies of the input fastq files
+    """
+    ret = []
+    for fq in [fq1, fq2]:
+        dst = fq.replace('.fastq.gz', f'-control-{group + 1:03}.fastq.gz')
+        if not os.path.exists(dst):
+            shutil.copyfile(fq, dst)
+        ret.append(dst)
+    return ret
@@ -0,0 +1,251 @@
+"""
+Simulates a synthetic genome and paired-end ChIP-seq reads with planted enriched regions:
+
+python -m benchmark.simulate --outdir sim --pairs 1M --chromosomes 3 --chromosome-length 10000000
+
+Writes genome.fa, peaks.bed (the planted enriched regions), and fastq.gz pairs (BGZF) of
+the ChIP sample (a fraction of fragments drawn from the enriched regions) and the input (uniform fragments),
+and genes.gtf (random transcripts) for the native peak annotation engine
+"""
+import os
+import argparse
+import numpy as np
+from typing import List, Tuple, Dict
+from chip_seq_pipeline.bgzf import open_bgzf
+
+
+BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+COMPLEMENT = np.zeros(256, dtype=np.uint8)
+for a, b in zip(b'ACGTN', b'TGCAN'):
+    COMPLEMENT[a] = b
+
+BATCH_PAIRS = 100_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a genome and paired-end ChIP-seq reads with planted peaks')
+    parser.add_argument('--outdir', required=True, help='output directory')
+    parser.add_argument('--pairs', default='1M', help='number of read pairs of each sample, e.g. 1M, 10M, 50M (default: %(default)s)')
+    parser.add_argument('--chromosomes', type=int, default=3, help='number of chromosomes (default: %(default)s)')
+    parser.add_argument('--chromosome-length', type=int, default=10_000_000, help='length of each chromosome (default: %(default)s)')
+    parser.add_argument('--peaks', type=int, default=1000, help='number of planted enriched regions (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    args = parser.parse_args()
+
+    simulate(
+        outdir=args.outdir,
+        pairs=parse_count(args.pairs),
+        chromosomes=args.chromosomes,
+        chromosome_length=args.chromosome_length,
+        peaks=args.peaks,
+        seed=args.seed)
+
+
+def parse_count(s: str) -> int:
+    """
+    '1M' -> 1000000, '500k' -> 500000, '2000' -> 2000
+    """
+    s = s.strip().upper()
+    for suffix, factor in [('K', 10 ** 3), ('M', 10 ** 6), ('G', 10 ** 9)]:
+        if s.endswith(suffix):
+            return int(float(s[:-1]) * factor)
+    return int(s)
+
+
+class Simulation:
+
+    genome_size: int
+    genome_fa: str
+    peaks_bed: str
+    genes_gtf: str
+    chip_fq1: str
+    chip_fq2: str
+    input_fq1: str
+    input_fq2: str
+
+    def __init__(self, outdir: str, genome_size: int):
+        self.genome_size = genome_size
+        self.genome_fa = f'{outdir}/genome.fa'
+        self.peaks_bed = f'{outdir}/peaks.bed'
+        self.genes_gtf = f'{outdir}/genes.gtf'
+        self.chip_fq1 = f'{outdir}/chip_R1.fastq.gz'
+        self.chip_fq2 = f'{outdir}/chip_R2.fastq.gz'
+        self.input_fq1 = f'{outdir}/input_R1.fastq.gz'
+        self.input_fq2 = f'{outdir}/input_R2.fastq.gz'
+
+
+def simulate(
+        outdir: str,
+        pairs: int,
+        chromosomes: int = 3,
+        chromosome_length: int = 10_000_000,
+        peaks: int = 1000,
+        genes: int = 1000,
+        seed: int = 1,
+        enrichment: float = 0.2,
+        peak_width: int = 500,
+        fragment_mean: int = 200,
+        fragment_sd: int = 30,
+        read_length: int = 75,
+        error_rate: float = 0.005) -> Simulation:
+    """
+    enrichment: fraction of ChIP fragments drawn from the planted peaks, the rest are uniform like the input
+    """
+    os.makedirs(outdir, exist_ok=True)
+    sim = Simulation(outdir=outdir, genome_size=chromosomes * chromosome_length)
+    rng = np.random.default_rng(seed)
+
+    genome = {f'chr{i + 1}': BASES[rng.integers(0, 4, size=chromosome_length)] for i in range(chromosomes)}
+    write_fasta(genome=genome, path=sim.genome_fa)
+
+    planted = plant_peaks(genome=genome, n=peaks, width=peak_width, rng=rng)
+    with open(sim.peaks_bed, 'w') as fh:
+        for chrom, start, end in planted:
+            fh.write(f'{chrom}\t{start}\t{end}\n')
+
+    kwargs = dict(
+        genome=genome,
+        pairs=pairs,
+        fragment_mean=fragment_mean,
+        fragment_sd=fragment_sd,
+        read_length=read_length,
+        error_rate=error_rate,
+        rng=rng)
+    write_read_pairs(fq1=sim.chip_fq1, fq2=sim.chip_fq2, name='chip', peaks=planted, enrichment=enrichment, **kwargs)
+    write_read_pairs(fq1=sim.input_fq1, fq2=sim.input_fq2, name='input', peaks=[], enrichment=0., **kwargs)
+    write_genes(genome=genome, n=genes, path=sim.genes_gtf, rng=rng)  # after the reads, which are as without genes
+    return sim
+
+
+def write_fasta(genome: Dict[str, np.ndarray], path: str, line_width: int = 60):
+    with open(path, 'wb') as fh:
+        for chrom, seq in genome.items():
+            fh.write(f'>{chrom}\n'.encode())
+            data = seq.tobytes()
+            for i in range(0, len(data), line_width):
+                fh.write(data[i:i + line_width] + b'\n')
+
+
+def plant_peaks(genome: Dict[str, np.ndarray], n: int, width: int, rng: np.random.Generator) -> List[Tuple[str, int, int]]:
+    chroms = list(genome.keys())
+    sizes = np.array([len(genome[c]) for c in chroms])
+    peaks = []
+    for i in rng.choice(len(chroms), size=n, p=sizes / sizes.sum()):
+        start = int(rng.integers(width, sizes[i] - 2 * width))
+        peaks.append((chroms[i], start, start + width))
+    return sorted(peaks)
+
+
+def write_genes(genome: Dict[str, np.ndarray], n: int, path: str, rng: np.random.Generator):
+    """
+    Transcripts of 1 to 10 exons, 4 in 5 of them coding, with the CDS from the middle of the first exon
+    to the middle of the last exon
+    """
+    chroms = list(genome.keys())
+    sizes = np.array([len(genome[c]) for c in chroms])
+    with open(path, 'w') as fh:
+        for g, i in enumerate(rng.choice(len(chroms), size=n, p=sizes / sizes.sum())):
+            exon_lengths = rng.integers(100, 500, size=rng.integers(1, 11))
+            intron_lengths = rng.integers(500, 5000, size=len(exon_lengths) - 1)
+            start = int(rng.integers(1, sizes[i] - exon_lengths.sum() - intron_lengths.sum()))
+            strand = '+' if rng.random() < 0.5 else '-'
+            coding = rng.random() < 0.8
+            attributes = f'gene_id "gene{g + 1}"; transcript_id "tx{g + 1}"; gene_name "GENE{g + 1}"; ' \
+                         f'gene_type "{"protein_coding" if coding else "lncRNA"}";'
+            exons = []
+            for j, length in enumerate(exon_lengths):
+                exons.append((start, start + int(length) - 1))  # 1-based, inclusive
+                start += int(length) + (int(intron_lengths[j]) if j < len(intron_lengths) else 0)
+            for s, e in exons:
+                fh.write(f'{chroms[i]}\tsimulate\texon\t{s}\t{e}\t.\t{strand}\t.\t{attributes}\n')
+            if coding:
+                cds_start = (exons[0][0] + exons[0][1]) // 2
+                cds_end = (exons[-1][0] + exons[-1][1]) // 2
+                for s, e in exons:
+                    if max(s, cds_start) <= min(e, cds_end):
+                        fh.write(f'{chroms[i]}\tsimulate\tCDS\t{max(s, cds_start)}\t{min(e, cds_end)}\t.\t{strand}\t0\t{attributes}\n')
+
+
+def write_read_pairs(
+        fq1: str,
+        fq2: str,
+        name: str,
+        genome: Dict[str, np.ndarray],
+        peaks: List[Tuple[str, int, int]],
+        enrichment: float,
+        pairs: int,
+        fragment_mean: int,
+        fragment_sd: int,
+        read_length: int,
+        error_rate: float,
+        rng: np.random.Generator):
+    """
+    Fragments are sampled in batches with numpy, read 1 from the forward and read 2 from the reverse strand
+    """
+    chroms = list(genome.keys())
+    sizes = np.array([len(genome[c]) for c in chroms])
+    quality = b'I' * read_length
+
+    with open_bgzf(fq1, 'wb', level=1) as fh1, open_bgzf(fq2, 'wb', level=1) as fh2:
+        for batch_start in range(0, pairs, BATCH_PAIRS):
+            n = min(BATCH_PAIRS, pairs - batch_start)
+            lengths = np.clip(
+                rng.normal(fragment_mean, fragment_sd, size=n).astype(int), read_length, 2 * fragment_mean)
+            chrom_idx, starts = sample_fragment_starts(
+                chroms=chroms, sizes=sizes, peaks=peaks, enrichment=enrichment, lengths=lengths, rng=rng)
+
+            for i, chrom in enumerate(chroms):
+                mask = chrom_idx == i
+                if not mask.any():
+                    continue
+                r1_starts = starts[mask]
+                r2_starts = r1_starts + lengths[mask] - read_length
+                offsets = np.arange(read_length)
+                seq = genome[chrom]
+                r1 = add_errors(seq[r1_starts[:, None] + offsets], error_rate=error_rate, rng=rng)
+                r2 = add_errors(COMPLEMENT[seq[r2_starts[:, None] + offsets]][:, ::-1], error_rate=error_rate, rng=rng)
+
+                ids = np.flatnonzero(mask) + batch_start
+                lines1, lines2 = [], []
+                for read_id, s1, s2 in zip(ids, r1, r2):
+                    header = f'@{name}_{read_id}'.encode()
+                    lines1.append(b'%s/1\n%s\n+\n%s\n' % (header, s1.tobytes(), quality))
+                    lines2.append(b'%s/2\n%s\n+\n%s\n' % (header, s2.tobytes(), quality))
+                fh1.write(b''.join(lines1))
+                fh2.write(b''.join(lines2))
+
+
+def sample_fragment_starts(
+        chroms: List[str],
+        sizes: np.ndarray,
+        peaks: List[Tuple[str, int, int]],
+        enrichment: float,
+        lengths: np.ndarray,
+        rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+
+    n = len(lengths)
+    chrom_idx = rng.choice(len(chroms), size=n, p=sizes / sizes.sum())
+    starts = (rng.random(n) * (sizes[chrom_idx] - lengths)).astype(int)
+
+    enriched = rng.random(n) < enrichment if peaks else np.zeros(n, dtype=bool)
+    if enriched.any():
+        picks = rng.integers(0, len(peaks), size=enriched.sum())
+        peak_chrom = np.array([chroms.index(peaks[p][0]) for p in picks])
+        peak_start = np.array([peaks[p][1] for p in picks])
+        peak_width = np.array([peaks[p][2] - peaks[p][1] for p in picks])
+        centers = peak_start + (rng.random(len(picks)) * peak_width).astype(int)
+        chrom_idx[enriched] = peak_chrom
+        starts[enriched] = np.clip(
+            centers - lengths[enriched] // 2, 0, sizes[peak_chrom] - lengths[enriched])
+    return chrom_idx, starts
+
+
+def add_errors(reads: np.ndarray, error_rate: float, rng: np.random.Generator) -> np.ndarray:
+    reads = reads.copy()
+    errors = rng.random(reads.shape) < error_rate
+    reads[errors] = BASES[rng.integers(0, 4, size=errors.sum())]
+    return reads
+
+
+if __name__ == '__main__':
+    main()
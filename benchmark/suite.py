@@ -0,0 +1,224 @@
+"""
+Benchmarks each stage of the pipeline on simulated reads, and compares stage timings between commits:
+
+python -m benchmark.suite run --depths 1M,10M,50M --threads 8 --history benchmark-history.tsv
+python -m benchmark.suite compare --history benchmark-history.tsv --base <commit> --head <commit> --threshold 10
+
+`run` simulates a genome and ChIP/input read pairs (benchmark/simulate.py) at each depth, runs the stages one by one,
+and appends wall time, CPU time and peak memory of each stage to the history file, with the current git commit.
+
+`compare` flags each stage and metric whose mean at `head` exceeds that at `base` by more than `threshold` percent,
+and exits with status 1 if there is any regression
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import pandas as pd
+from datetime import datetime
+from typing import List, Dict, Any, Callable
+from chip_seq_pipeline.template import Settings
+from chip_seq_pipeline.tools import get_temp_path
+from chip_seq_pipeline.trimming import Trimming
+from chip_seq_pipeline.mapping import Mapping
+from chip_seq_pipeline.bam2bigwig import Bam2BigWig
+from chip_seq_pipeline.chipseeker import ChIPseeker
+from chip_seq_pipeline.peak_calling import PeakCalling
+from chip_seq_pipeline.mark_duplicates import MarkDuplicates
+from chip_seq_pipeline.peak_annotation import PeakAnnotation
+from .simulate import simulate, parse_count
+
+
+METRICS = ['wall_seconds', 'cpu_seconds', 'peak_rss_mb']
+KEYS = ['depth', 'threads', 'stage']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on simulated reads')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='simulate reads, run each stage and append timings to the history')
+    run_parser.add_argument('--depths', default='1M', help='comma-separated read pairs per sample, e.g. 1M,10M,50M (default: %(default)s)')
+    run_parser.add_argument('--threads', type=int, default=4, help='number of CPU threads (default: %(default)s)')
+    run_parser.add_argument('--outdir', default='stage_benchmark', help='output directory (default: %(default)s)')
+    run_parser.add_argument('--history', default='benchmark-history.tsv', help='history file to append to (default: %(default)s)')
+    run_parser.add_argument('--genome-version', default='hg38', help='genome version for peak annotation (default: %(default)s)')
+    run_parser.add_argument('--seed', type=int, default=1, help='random seed of the simulation (default: %(default)s)')
+
+    compare_parser = subparsers.add_parser('compare', help='flag stage regressions between two commits')
+    compare_parser.add_argument('--history', default='benchmark-history.tsv', help='history file (default: %(default)s)')
+    compare_parser.add_argument('--base', required=True, help='base commit (hash prefix)')
+    compare_parser.add_argument('--head', required=True, help='commit to compare with the base (hash prefix)')
+    compare_parser.add_argument('--threshold', type=float, default=10., help='regression threshold in percent (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        rows = []
+        for depth in args.depths.split(','):
+            rows += run_stages(
+                depth=depth,
+                threads=args.threads,
+                outdir=args.outdir,
+                genome_version=args.genome_version,
+                seed=args.seed)
+        append_history(rows=rows, history=args.history)
+        print(pd.DataFrame(rows)[KEYS + METRICS].to_string(index=False))
+    else:
+        df = compare(
+            history=pd.read_csv(args.history, sep='\t', dtype={'commit': str}),
+            base=args.base,
+            head=args.head,
+            threshold=args.threshold)
+        print(df.to_string(index=False))
+        sys.exit(1 if df['regression'].any() else 0)
+
+
+def run_stages(
+        depth: str,
+        threads: int,
+        outdir: str,
+        genome_version: str,
+        seed: int) -> List[Dict[str, Any]]:
+
+    sim = simulate(outdir=f'{outdir}/simulation-{depth}', pairs=parse_count(depth), seed=seed)
+
+    settings = Settings(
+        workdir=get_temp_path(prefix=f'{outdir}/workdir_{depth}_'),
+        outdir=get_temp_path(prefix=f'{outdir}/outdir_{depth}_'),
+        threads=threads,
+        max_memory_gb=None,
+        debug=False,
+        mock=False)
+    for d in [settings.workdir, settings.outdir]:
+        os.makedirs(d, exist_ok=True)
+
+    stages = StageRunner(settings=settings, depth=depth)
+
+    t1, t2, c1, c2 = stages.run('Trimming', lambda: Trimming(settings).main(
+        treatment_fq1=sim.chip_fq1,
+        treatment_fq2=sim.chip_fq2,
+        control_fq1=sim.input_fq1,
+        control_fq2=sim.input_fq2,
+        base_quality_cutoff=20,
+        min_read_length=20))
+
+    treatment_bam, control_bam = stages.run('Mapping', lambda: Mapping(settings).main(
+        ref_fa=sim.genome_fa,
+        treatment_fq1=t1,
+        treatment_fq2=t2,
+        control_fq1=c1,
+        control_fq2=c2,
+        read_aligner='bowtie2',
+        bowtie2_mode='sensitive',
+        index_cache_dir=None,
+        index_cache_max_gb=200.))
+
+    treatment_bam, control_bam = stages.run('MarkDuplicates', lambda: MarkDuplicates(settings).main(
+        treatment_bam=treatment_bam,
+        control_bam=control_bam))
+
+    stages.run('Bam2BigWig', lambda: Bam2BigWig(settings).main(
+        treatment_bam=treatment_bam,
+        control_bam=control_bam))
+
+    peak_files = stages.run('PeakCalling', lambda: PeakCalling(settings).main(
+        treatment_bam=treatment_bam,
+        control_bam=control_bam,
+        macs_effective_genome_size=str(sim.genome_size),
+        macs_fdr=0.05))
+
+    stages.run('PeakAnnotation', lambda: PeakAnnotation(settings).main(
+        peak_files=peak_files,
+        genome_version=genome_version))
+
+    stages.run('PeakAnnotation (native)', lambda: PeakAnnotation(settings).main(
+        peak_files=peak_files,
+        genome_version=genome_version,
+        engine='native',
+        gene_annotation=sim.genes_gtf))
+
+    stages.run('ChIPseeker', lambda: ChIPseeker(settings).main(
+        peak_files=peak_files))
+
+    return stages.rows
+
+
+class StageRunner:
+    """
+    Runs stages one at a time, with the wall time measured around the stage,
+    and CPU time and peak memory summed up from the profiler records added during the stage
+    """
+
+    settings: Settings
+    depth: str
+    rows: List[Dict[str, Any]]
+
+    def __init__(self, settings: Settings, depth: str):
+        self.settings = settings
+        self.depth = depth
+        self.rows = []
+
+    def run(self, stage: str, function: Callable) -> Any:
+        first_record = len(self.settings.profiler.records)
+        start = time.time()
+        result = function()
+        wall_seconds = time.time() - start
+
+        records = self.settings.profiler.records[first_record:]
+        self.rows.append({
+            'stage': stage,
+            'depth': self.depth,
+            'threads': self.settings.threads,
+            'wall_seconds': round(wall_seconds, 3),
+            'cpu_seconds': round(sum(r['user_seconds'] + r['sys_seconds'] for r in records), 3),
+            'peak_rss_mb': max([r['peak_rss_mb'] for r in records], default=0.),
+        })
+        return result
+
+
+def append_history(rows: List[Dict[str, Any]], history: str):
+    df = pd.DataFrame(rows)
+    df.insert(0, 'commit', get_git_commit())
+    df.insert(1, 'date', str(datetime.now()))
+    df.insert(2, 'host', socket.gethostname())
+    df.to_csv(history, sep='\t', index=False, mode='a', header=not os.path.exists(history))
+
+
+def get_git_commit() -> str:
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    p = subprocess.run(['git', '-C', repo, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return p.stdout.decode().strip() if p.returncode == 0 else 'unknown'
+
+
+def compare(history: pd.DataFrame, base: str, head: str, threshold: float) -> pd.DataFrame:
+    """
+    Means of repeated runs of the same commit, depth, threads and stage are compared,
+    one row per stage and metric present at both commits
+    """
+    means = {}
+    for name, prefix in [('base', base), ('head', head)]:
+        runs = history[history['commit'].str.startswith(prefix)]
+        assert len(runs) > 0, f'No benchmark runs of commit "{prefix}" in the history'
+        means[name] = runs.groupby(KEYS)[METRICS].mean()
+
+    rows = []
+    for key in means['base'].index.intersection(means['head'].index):
+        for metric in METRICS:
+            b, h = means['base'].loc[key, metric], means['head'].loc[key, metric]
+            change = 0. if b == 0 else (h - b) / b * 100
+            rows.append({
+                **dict(zip(KEYS, key)),
+                'metric': metric,
+                'base': b,
+                'head': h,
+                'change_percent': round(change, 1),
+                'regression': change > threshold,
+            })
+    return pd.DataFrame(rows, columns=KEYS + ['metric', 'base', 'head', 'change_percent', 'regression'])
+
+
+if __name__ == '__main__':
+    main()
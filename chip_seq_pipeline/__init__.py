@@ -1,6 +1,9 @@
 import os
 from .template import Settings
 from .tools import get_temp_path
+from .executor import get_executor
+from .stub_tools import install_stub_tools
+from .batch_pipeline import BatchPipeline
 from .chip_seq_pipeline import ChipSeqPipeline
 
 
@@ -10,37 +13,115 @@ def main(
         treatment_fq2: str,
         control_fq1: str,
         control_fq2: str,
+        sample_sheet: str,
 
         base_quality_cutoff: int,
         min_read_length: int,
+        trim_output: str,
+        trimming_chunks: int,
 
         read_aligner: str,
         bowtie2_mode: str,
+        alignment_chunks: int,
+        index_cache_dir: str,
+        index_cache_max_gb: float,
         discard_bam: bool,
 
         skip_mark_duplicates: bool,
+        markdup_engine: str,
+
+        filter_bam: bool,
+        filter_min_mapq: int,
+        filter_keep_improper_pairs: bool,
+        filter_contigs: str,
+        filter_blacklist: str,
 
         macs_effective_genome_size: str,
         macs_fdr: float,
+        macs_separate_calls: bool,
+        homer_chromosome_groups: int,
 
         genome_version: str,
+        peak_annotation_engine: str,
+        gene_annotation: str,
         skip_motif_finding: bool,
         motif_finding_fragment_size: int,
 
         outdir: str,
         threads: int,
+        max_memory_gb: float,
+        executor: str,
+        executor_jobs: int,
+        max_job_memory_gb: float,
+        slurm_options: str,
+        stub_tools: str,
+        resume: str,
+        keep_workdir: bool,
         debug: bool):
 
     settings = Settings(
-        workdir=get_temp_path(prefix='./chip_seq_workdir_'),
+        workdir=get_temp_path(prefix='./chip_seq_workdir_') if resume.lower() == 'none' else resume,
         outdir=outdir,
         threads=threads,
+        max_memory_gb=None if max_memory_gb == 0 else max_memory_gb,
         debug=debug,
-        mock=False)
+        mock=False,
+        executor=get_executor(
+            name=executor,
+            threads=threads,
+            max_jobs=executor_jobs,
+            max_job_memory_gb=None if max_job_memory_gb == 0 else max_job_memory_gb,
+            jobdir=f'{outdir}/batch-jobs',
+            slurm_options='' if slurm_options.lower() == 'none' else slurm_options),
+        keep_workdir=keep_workdir or resume.lower() != 'none')  # a resumed workdir can be resumed again
 
     for d in [settings.workdir, settings.outdir]:
         os.makedirs(d, exist_ok=True)
 
+    if stub_tools.lower() != 'none':
+        bindir = install_stub_tools(
+            bindir=f'{settings.workdir}/stub-tools',
+            cost_model_json=None if stub_tools.lower() == 'default' else stub_tools)
+        os.environ['PATH'] = f'{bindir}{os.pathsep}{os.environ["PATH"]}'
+
+    if sample_sheet.lower() != 'none':
+        BatchPipeline(settings=settings).main(
+            sample_sheet=sample_sheet,
+            ref_fa=ref_fa,
+
+            base_quality_cutoff=base_quality_cutoff,
+            min_read_length=min_read_length,
+            trim_output=trim_output,
+            trimming_chunks=trimming_chunks,
+
+            read_aligner=read_aligner,
+            bowtie2_mode=bowtie2_mode,
+            alignment_chunks=alignment_chunks,
+            index_cache_dir=None if index_cache_dir.lower() == 'none' else index_cache_dir,
+            index_cache_max_gb=index_cache_max_gb,
+            discard_bam=discard_bam,
+
+            skip_mark_duplicates=skip_mark_duplicates,
+            markdup_engine=markdup_engine,
+
+            filter_bam=filter_bam,
+            filter_min_mapq=filter_min_mapq,
+            filter_keep_improper_pairs=filter_keep_improper_pairs,
+            filter_contigs=filter_contigs,
+            filter_blacklist=None if filter_blacklist.lower() == 'none' else filter_blacklist,
+
+            macs_effective_genome_size=macs_effective_genome_size,
+            macs_fdr=macs_fdr,
+            macs_separate_calls=macs_separate_calls,
+            homer_chromosome_groups=homer_chromosome_groups,
+
+            genome_version=genome_version,
+            peak_annotation_engine=peak_annotation_engine,
+            gene_annotation=None if gene_annotation.lower() == 'none' else gene_annotation,
+            skip_motif_finding=skip_motif_finding,
+            motif_finding_fragment_size=motif_finding_fragment_size)
+        return
+
     ChipSeqPipeline(settings=settings).main(
         ref_fa=ref_fa,
         treatment_fq1=treatment_fq1,
@@ -50,16 +131,32 @@ def main(
 
         base_quality_cutoff=base_quality_cutoff,
         min_read_length=min_read_length,
+        trim_output=trim_output,
+        trimming_chunks=trimming_chunks,
 
         read_aligner=read_aligner,
         bowtie2_mode=bowtie2_mode,
+        alignment_chunks=alignment_chunks,
+        index_cache_dir=None if index_cache_dir.lower() == 'none' else index_cache_dir,
+        index_cache_max_gb=index_cache_max_gb,
         discard_bam=discard_bam,
 
         skip_mark_duplicates=skip_mark_duplicates,
+        markdup_engine=markdup_engine,
+
+        filter_bam=filter_bam,
+        filter_min_mapq=filter_min_mapq,
+        filter_keep_improper_pairs=filter_keep_improper_pairs,
+        filter_contigs=filter_contigs,
+        filter_blacklist=None if filter_blacklist.lower() == 'none' else filter_blacklist,
 
         macs_effective_genome_size=macs_effective_genome_size,
         macs_fdr=macs_fdr,
+        macs_separate_calls=macs_separate_calls,
+        homer_chromosome_groups=homer_chromosome_groups,
 
         genome_version=genome_version,
+        peak_annotation_engine=peak_annotation_engine,
+        gene_annotation=None if gene_annotation.lower() == 'none' else gene_annotation,
         skip_motif_finding=skip_motif_finding,
         motif_finding_fragment_size=motif_finding_fragment_size)
@@ -13,17 +13,6 @@ class Bam2BigWig(Processor):
         self.control_bam = control_bam
         self.treatment_bam = treatment_bam
 
-        self.index_bam()
-        self.bam_coverage()
-
-    def index_bam(self):
-        for bam in [self.treatment_bam, self.control_bam]:
-            if bam is not None:
-                bai = f'{bam}.bai'
-                if not exists(bai):
-                    self.call(f'samtools index {bam}')
-
-    def bam_coverage(self):
         for bam in [self.treatment_bam, self.control_bam]:
             if bam is not None:
                 BamCoverage(self.settings).main(bam=bam)
@@ -34,28 +23,49 @@ class BamCoverage(Processor):
     BIN_SIZE = 10
 
     bam: str
+    fragment_size: Optional[int]
 
     bigwig: str
 
-    def main(self, bam: str) -> str:
+    def main(self, bam: str, fragment_size: Optional[int] = None) -> str:
+        """
+        fragment_size: estimated from the BAM, to extend reads whose mate is not properly paired,
+            as deepTools takes fragments of proper pairs from the mates
+        """
 
         self.bam = bam
+        self.fragment_size = fragment_size
 
-        log = f'{self.outdir}/bamCoverage-[{basename(self.bam)}].log'
-        self.bigwig = f'{self.outdir}/{basename(self.bam).replace(".bam", ".bw")}'
-        args = [
-            'bamCoverage',
-            f'--bam {self.bam}',
-            f'--outFileName {self.bigwig}',
-            f'--numberOfProcessors {self.threads}',
-            f'--binSize {self.BIN_SIZE}',
-            '--outFileFormat bigwig',
-            '--normalizeUsing None',
-            '--ignoreDuplicates',
-            '--centerReads',
-            f'1> {log}',
-            f'2> {log}'
-        ]
-        self.call(self.CMD_LINEBREAK.join(args))
+        self.index_bam()
+        self.bam_coverage()
 
         return self.bigwig
+
+    def index_bam(self):
+        """
+        BAM files from mapping and duplicate marking are indexed as they are written,
+        e.g. sorted.bam.bai by samtools or sorted.bai by GATK, so only other BAM files are indexed here
+        """
+        bais = [f'{self.bam}.bai', f'{self.bam[:-len(".bam")]}.bai']
+        if not any(exists(bai) for bai in bais):
+            self.call(f'samtools index {self.bam}')
+
+    def bam_coverage(self):
+        log = f'{self.outdir}/bamCoverage-[{basename(self.bam)}].log'
+        self.bigwig = f'{self.outdir}/{basename(self.bam).replace(".bam", ".bw")}'
+        with self.reserve_cores(self.threads) as cores:
+            args = [
+                'bamCoverage',
+                f'--bam {self.bam}',
+                f'--outFileName {self.bigwig}',
+                f'--numberOfProcessors {cores}',
+                f'--binSize {self.BIN_SIZE}',
+                '--outFileFormat bigwig',
+                '--normalizeUsing None',
+                '--ignoreDuplicates',
+            ] + ([] if self.fragment_size is None else [f'--extendReads {self.fragment_size}']) + [
+                '--centerReads',
+                f'1> {log}',
+                f'2> {log}'
+            ]
+            self.call(self.CMD_LINEBREAK.join(args))
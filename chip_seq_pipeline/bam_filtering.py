@@ -0,0 +1,224 @@
+import re
+from bisect import bisect_left
+from typing import Optional, List, Tuple, Dict
+from .bgzf import open_bgzf
+from .tools import edit_fpath
+from .template import Processor
+
+
+CIGAR_PATTERN = re.compile(r'(\d+)([MIDNSHP=X])')  # e.g. '30M2I18M' -> ('30', 'M'), ('2', 'I'), ('18', 'M')
+
+
+class FilterBam(Processor):
+    """
+    Writes the analysis-ready BAM that coverage, peak calling and HOMER read,
+    in one multi-threaded samtools view pass over the (duplicate-marked) BAM, keeping pairs whose reads are:
+        mapped, primary, both with mapping quality >= min_mapq,
+        properly paired (unless keep_improper_pairs),
+        on the kept contigs, with the fragment outside blacklisted regions
+
+    Mates are filtered together, so that MACS (BAMPE) never builds a fragment from the template length of a lone mate:
+    the mapping quality of the mate is the MQ tag, which samtools fixmate -m adds when reads are mapped,
+    and pairs whose fragment overlaps a blacklisted region are excluded by name,
+    collected beforehand from the few reads near the blacklist
+
+    Contigs and the blacklist are also given to samtools as regions to keep (-L),
+    i.e. the kept contigs with blacklisted intervals cut out, so that the reads within them are skipped by the index
+    """
+
+    PRIMARY_CONTIG_PATTERN = re.compile(r'^(chr)?([1-9][0-9]*|X|Y)$')  # e.g. chr1, chr22, chrX, 1, Y, but not chrM or chr1_KI270706v1_random
+    EXCLUDED_FLAGS = 0x4 | 0x8 | 0x100 | 0x800  # unmapped, mate unmapped, secondary, supplementary
+    PROPER_PAIR_FLAG = 0x2
+    MAX_FRAGMENT_SIZE = 2000  # reads this far upstream of a blacklisted region are checked for their fragment overlapping it
+
+    bam: str
+    min_mapq: int
+    keep_improper_pairs: bool
+    contigs: str
+    blacklist: Optional[str]
+
+    contig_sizes: List[Tuple[str, int]]
+    regions_bed: str
+    excluded_names_txt: Optional[str]
+    out_bam: str
+
+    def main(
+            self,
+            bam: str,
+            min_mapq: int,
+            keep_improper_pairs: bool,
+            contigs: str,
+            blacklist: Optional[str]) -> str:
+        """
+        contigs: comma-separated contigs to keep, 'primary' for numbered chromosomes, X and Y, or 'all'
+        blacklist: BED(.gz) file of regions whose reads are removed, e.g. the ENCODE blacklist
+        """
+
+        self.bam = bam
+        self.min_mapq = min_mapq
+        self.keep_improper_pairs = keep_improper_pairs
+        self.contigs = contigs
+        self.blacklist = blacklist
+
+        self.set_contig_sizes()
+        self.write_regions_bed()
+        self.write_excluded_names()
+        self.filter_bam()
+
+        return self.out_bam
+
+    def set_contig_sizes(self):
+        header = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-header.sam', dstdir=self.workdir)
+        self.call(f'samtools view -H {self.bam} > {header}')
+        self.contig_sizes = []
+        with open(header) as fh:
+            for line in fh:
+                if line.startswith('@SQ'):
+                    fields = dict(f.split(':', 1) for f in line.rstrip('\n').split('\t')[1:])
+                    self.contig_sizes.append((fields['SN'], int(fields['LN'])))
+
+    def write_regions_bed(self):
+        kept = [(c, n) for c, n in self.contig_sizes if self.is_kept_contig(c)]
+        assert len(kept) > 0, f'None of the contigs of "{self.bam}" is kept by "{self.contigs}"'
+
+        blacklisted = {} if self.blacklist is None else read_bed(self.blacklist)
+
+        self.regions_bed = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-filter-regions.bed', dstdir=self.workdir)
+        with self.profile(), open(self.regions_bed, 'w') as fh:
+            for contig, size in kept:
+                for start, end in subtract_intervals(size=size, intervals=blacklisted.get(contig, [])):
+                    fh.write(f'{contig}\t{start}\t{end}\n')
+
+    def is_kept_contig(self, contig: str) -> bool:
+        if self.contigs.lower() == 'all':
+            return True
+        if self.contigs.lower() == 'primary':
+            return self.PRIMARY_CONTIG_PATTERN.match(contig) is not None
+        return contig in self.contigs.split(',')
+
+    def write_excluded_names(self):
+        """
+        Names of pairs whose fragment overlaps a blacklisted region, from the reads within MAX_FRAGMENT_SIZE
+        upstream of or in the region, as the leftmost mate of such a fragment is, unless the pair is improper
+        """
+        self.excluded_names_txt = None
+        if self.blacklist is None:
+            return
+
+        blacklisted = {c: v for c, v in read_bed(self.blacklist).items() if self.is_kept_contig(c)}
+        if len(blacklisted) == 0:
+            return
+
+        near_bed = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-near-blacklist.bed', dstdir=self.workdir)
+        with open(near_bed, 'w') as fh:
+            for contig, intervals in blacklisted.items():
+                for start, end in intervals:
+                    fh.write(f'{contig}\t{max(0, start - self.MAX_FRAGMENT_SIZE)}\t{end}\n')
+
+        reads_txt = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-near-blacklist.txt', dstdir=self.workdir)
+        view = [
+            'samtools view',
+            f'-F {self.EXCLUDED_FLAGS}',
+            f'-L {near_bed}',
+            self.bam,
+        ]
+        self.call(' | '.join([self.CMD_LINEBREAK.join(view), f'cut -f 1,3,4,6,9 > {reads_txt}']))
+
+        names = set()
+        with self.profile(), open(reads_txt) as fh:
+            for line in fh:
+                name, contig, pos, cigar, tlen = line.rstrip('\n').split('\t')
+                start, end = fragment_span(pos=int(pos), cigar=cigar, tlen=int(tlen))
+                if overlaps(intervals=blacklisted.get(contig, []), start=start, end=end):
+                    names.add(name)
+
+        self.excluded_names_txt = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-blacklisted-names.txt', dstdir=self.workdir)
+        with open(self.excluded_names_txt, 'w') as fh:
+            fh.writelines(f'{name}\n' for name in sorted(names))
+
+    def filter_bam(self):
+        self.out_bam = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-filtered.bam', dstdir=self.workdir)
+        log = f'{self.outdir}/samtools-view-filter.log'
+        with self.reserve_cores(self.threads) as cores:
+            args = [
+                'samtools view',
+                '-b',
+                f'-@ {cores}',
+                f'-F {self.EXCLUDED_FLAGS}',
+                f"-e 'mapq >= {self.min_mapq} && [MQ] >= {self.min_mapq}'",  # the read and its mate
+            ]
+            if not self.keep_improper_pairs:
+                args.append(f'-f {self.PROPER_PAIR_FLAG}')
+            if self.excluded_names_txt is not None:
+                args.append(f'-N ^{self.excluded_names_txt}')
+            args += [
+                f'-L {self.regions_bed}',
+                '--write-index',
+                f'-o {self.out_bam}##idx##{self.out_bam}.bai',
+                self.bam,
+                f'2>> {log}',
+            ]
+            self.call(self.CMD_LINEBREAK.join(args))
+
+
+def read_bed(bed: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Returns contig -> sorted and merged (start, end) intervals, 0-based half-open as BED
+    """
+    intervals = {}
+    with open_bgzf(bed, 'rt') as fh:
+        for line in fh:
+            if line.startswith(('#', 'track', 'browser')) or line.strip() == '':
+                continue
+            contig, start, end = line.split('\t')[:3]
+            intervals.setdefault(contig, []).append((int(start), int(end)))
+
+    ret = {}
+    for contig, items in intervals.items():
+        merged = []
+        for start, end in sorted(items):
+            if len(merged) > 0 and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        ret[contig] = merged
+    return ret
+
+
+def subtract_intervals(size: int, intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Intervals of [0, size) not covered by the sorted and merged intervals
+    """
+    ret, position = [], 0
+    for start, end in intervals:
+        if start > position:
+            ret.append((position, min(start, size)))
+        position = max(position, end)
+        if position >= size:
+            break
+    if position < size:
+        ret.append((position, size))
+    return [(s, e) for s, e in ret if s < e]
+
+
+def fragment_span(pos: int, cigar: str, tlen: int) -> Tuple[int, int]:
+    """
+    0-based half-open span of the fragment of a read, given its 1-based leftmost position (POS),
+    CIGAR and template length (TLEN), which is positive for the leftmost mate,
+    or the span of the read itself if the template length is unknown (0), e.g. mates on different contigs
+    """
+    start = pos - 1
+    if tlen > 0:
+        return start, start + tlen
+    read_end = start + sum(int(n) for n, op in CIGAR_PATTERN.findall(cigar) if op in 'MDN=X')
+    if tlen < 0:
+        return read_end + tlen, read_end
+    return start, read_end
+
+
+def overlaps(intervals: List[Tuple[int, int]], start: int, end: int) -> bool:
+    """
+    Whether [start, end) overlaps any of the sorted and merged intervals
+    """
+    i = bisect_left(intervals, (end,))  # intervals starting before end
+    return i > 0 and intervals[i - 1][1] > start
@@ -0,0 +1,293 @@
+import os
+import pandas as pd
+from typing import Optional, List, Dict, Any
+from .template import Processor, Settings
+from .fastq import split_paths
+from .chip_seq_pipeline import ChipSeqPipeline, CleanUp
+
+
+class Sample:
+
+    name: str
+    treatment_fq1: str
+    treatment_fq2: str
+    control_fq1: Optional[str]
+    control_fq2: Optional[str]
+
+    def __init__(
+            self,
+            name: str,
+            treatment_fq1: str,
+            treatment_fq2: str,
+            control_fq1: Optional[str],
+            control_fq2: Optional[str]):
+
+        self.name = name
+        self.treatment_fq1 = treatment_fq1
+        self.treatment_fq2 = treatment_fq2
+        self.control_fq1 = control_fq1
+        self.control_fq2 = control_fq2
+
+
+class ReadSampleSheet(Processor):
+    """
+    A tab-separated sample sheet with a header line:
+
+    sample_name  treatment_fq1  treatment_fq2  control_fq1  control_fq2
+    KEAP1-0h     t0_R1.fq.gz    t0_R2.fq.gz    in_R1.fq.gz  in_R2.fq.gz
+    KEAP1-6h     t6_R1.fq.gz    t6_R2.fq.gz
+
+    The control columns are optional, and can be left empty (or "None") for samples without control.
+    Fastq files of many lanes are comma-separated, e.g. "t0_L001_R1.fq.gz,t0_L002_R1.fq.gz"
+    """
+
+    REQUIRED_COLUMNS = ['sample_name', 'treatment_fq1', 'treatment_fq2']
+    CONTROL_COLUMNS = ['control_fq1', 'control_fq2']
+
+    sample_sheet: str
+
+    df: pd.DataFrame
+    samples: List[Sample]
+
+    def main(self, sample_sheet: str) -> List[Sample]:
+        self.sample_sheet = sample_sheet
+
+        self.read_table()
+        self.check_columns()
+        self.set_samples()
+        self.check_samples()
+
+        return self.samples
+
+    def read_table(self):
+        self.df = pd.read_csv(self.sample_sheet, sep='\t', dtype=str, comment='#').fillna('None')
+        self.df.columns = [c.strip() for c in self.df.columns]
+
+    def check_columns(self):
+        missing = [c for c in self.REQUIRED_COLUMNS if c not in self.df.columns]
+        assert len(missing) == 0, f'Sample sheet "{self.sample_sheet}" misses columns: {", ".join(missing)}'
+        for c in self.CONTROL_COLUMNS:
+            if c not in self.df.columns:
+                self.df[c] = 'None'
+
+    def set_samples(self):
+        self.samples = []
+        for _, row in self.df.iterrows():
+            values = {c: row[c].strip() for c in self.REQUIRED_COLUMNS + self.CONTROL_COLUMNS}
+            self.samples.append(Sample(
+                name=values['sample_name'],
+                treatment_fq1=values['treatment_fq1'],
+                treatment_fq2=values['treatment_fq2'],
+                control_fq1=None if values['control_fq1'].lower() == 'none' else values['control_fq1'],
+                control_fq2=None if values['control_fq2'].lower() == 'none' else values['control_fq2']))
+
+    def check_samples(self):
+        assert len(self.samples) > 0, f'No sample in "{self.sample_sheet}"'
+        names = [s.name for s in self.samples]
+        duplicated = sorted(set(n for n in names if names.count(n) > 1))
+        assert len(duplicated) == 0, f'Duplicated sample names: {", ".join(duplicated)}'
+        for s in self.samples:
+            invalid = s.name in ['', '.', '..', BatchPipeline.CONTROLS_DIRNAME] or '/' in s.name
+            assert not invalid, f'Invalid sample name: "{s.name}"'
+            assert (s.control_fq1 is None) == (s.control_fq2 is None), \
+                f'Sample "{s.name}" should have both or none of control_fq1 and control_fq2'
+            for fqs in [s.treatment_fq1, s.treatment_fq2, s.control_fq1, s.control_fq2]:
+                for fq in [] if fqs is None else split_paths(fqs):
+                    assert os.path.exists(fq), f'Fastq file of sample "{s.name}" not found: "{fq}"'
+
+
+class BatchPipeline(ChipSeqPipeline):
+    """
+    Runs all samples of a sample sheet in one scheduler, sharing the read aligner index and the core budget
+
+    Each sample gets its own subdirectory in the workdir and the outdir, and its tasks are a core reservation group,
+    so that concurrent samples get a fair share of cores.
+    A failed sample does not stop the others, and the status of each sample is written to summary.tsv
+
+    Samples sharing a control (same fastq files) reuse one set of control tasks,
+    whose outputs are in 'controls/<control key>' of the workdir and the outdir
+    """
+
+    CONTROLS_DIRNAME = 'controls'
+
+    sample_sheet: str
+
+    samples: List[Sample]
+    sample_control_keys: Dict[str, Optional[str]]
+
+    def main(
+            self,
+            sample_sheet: str,
+            ref_fa: str,
+
+            base_quality_cutoff: int,
+            min_read_length: int,
+            trim_output: str,
+            trimming_chunks: int,
+
+            read_aligner: str,
+            bowtie2_mode: str,
+            alignment_chunks: int,
+            index_cache_dir: Optional[str],
+            index_cache_max_gb: float,
+            discard_bam: bool,
+
+            skip_mark_duplicates: bool,
+            markdup_engine: str,
+
+            filter_bam: bool,
+            filter_min_mapq: int,
+            filter_keep_improper_pairs: bool,
+            filter_contigs: str,
+            filter_blacklist: Optional[str],
+
+            macs_effective_genome_size: str,
+            macs_fdr: float,
+            macs_separate_calls: bool,
+            homer_chromosome_groups: int,
+
+            genome_version: str,
+            peak_annotation_engine: str,
+            gene_annotation: Optional[str],
+            skip_motif_finding: bool,
+            motif_finding_fragment_size: int):
+
+        self.sample_sheet = sample_sheet
+        self.ref_fa = ref_fa
+
+        self.base_quality_cutoff = base_quality_cutoff
+        self.min_read_length = min_read_length
+        self.trim_output = trim_output
+        self.trimming_chunks = trimming_chunks
+
+        self.read_aligner = read_aligner
+        self.bowtie2_mode = bowtie2_mode
+        self.alignment_chunks = alignment_chunks
+        self.index_cache_dir = index_cache_dir
+        self.index_cache_max_gb = index_cache_max_gb
+        self.discard_bam = discard_bam
+
+        self.skip_mark_duplicates = skip_mark_duplicates
+        self.markdup_engine = markdup_engine
+
+        self.filter_bam = filter_bam
+        self.filter_min_mapq = filter_min_mapq
+        self.filter_keep_improper_pairs = filter_keep_improper_pairs
+        self.filter_contigs = filter_contigs
+        self.filter_blacklist = filter_blacklist
+
+        self.macs_effective_genome_size = macs_effective_genome_size
+        self.macs_fdr = macs_fdr
+        self.macs_separate_calls = macs_separate_calls
+        self.homer_chromosome_groups = homer_chromosome_groups
+
+        self.genome_version = genome_version
+        self.peak_annotation_engine = peak_annotation_engine
+        self.gene_annotation = gene_annotation
+        self.skip_motif_finding = skip_motif_finding
+        self.motif_finding_fragment_size = motif_finding_fragment_size
+
+        self.samples = ReadSampleSheet(self.settings).main(sample_sheet=self.sample_sheet)
+
+        self.set_scheduler()
+        self.add_index_task()
+        self.add_chromosome_groups_task()
+        self.sample_control_keys = {}
+        for sample in self.samples:
+            self.add_chip_seq_tasks(
+                settings=self.get_sample_settings(sample_name=sample.name),
+                task_prefix=f'{sample.name}/',
+                treatment_fq1=sample.treatment_fq1,
+                treatment_fq2=sample.treatment_fq2,
+                control_fq1=sample.control_fq1,
+                control_fq2=sample.control_fq2,
+                clean_up_control=False)
+            self.sample_control_keys[sample.name] = None if sample.control_fq1 is None else \
+                self.get_control_key(fq1=sample.control_fq1, fq2=sample.control_fq2)
+        self.add_control_clean_up_tasks()
+        self.add_release_index_task()
+        try:
+            self.scheduler.run()
+        finally:
+            self.index_builder.release()
+            self.write_summary()
+            self.write_profile()
+        self.remove_workdir()
+
+    def get_sample_settings(self, sample_name: str) -> Settings:
+        settings = self.settings.derive(
+            workdir=f'{self.workdir}/{sample_name}',
+            outdir=f'{self.outdir}/{sample_name}',
+            group=sample_name)
+        for d in [settings.workdir, settings.outdir]:
+            os.makedirs(d, exist_ok=True)
+        return settings
+
+    def get_control_settings(self, key: str) -> Settings:
+        settings = self.settings.derive(
+            workdir=f'{self.workdir}/{self.CONTROLS_DIRNAME}/{key}',
+            outdir=f'{self.outdir}/{self.CONTROLS_DIRNAME}/{key}',
+            group=f'{self.CONTROLS_DIRNAME}/{key}')
+        for d in [settings.workdir, settings.outdir]:
+            os.makedirs(d, exist_ok=True)
+        return settings
+
+    def get_control_task_prefix(self, key: str) -> str:
+        return f'{self.CONTROLS_DIRNAME}/{key}/'
+
+    def add_control_clean_up_tasks(self):
+        for key, control_tasks in self.control_tasks.items():
+            prefix = self.get_control_task_prefix(key=key)
+            tasks = [t for t in self.scheduler.tasks.keys() if t.startswith(prefix)]
+            users = [
+                name for name, task in self.scheduler.tasks.items()
+                if not name.startswith(prefix) and set(task.upstream()) & set(tasks)
+            ]
+            self.scheduler.add(
+                name=f'{prefix}clean-up',
+                function=self.clean_up_control,
+                inputs=dict(bam=control_tasks['bam']),
+                params=dict(key=key, discard_bam=self.discard_bam),
+                dependencies=tasks + users,  # runs after all treatments are done with the control
+                resumable=False)
+
+    def clean_up_control(self, bam: str, key: str, discard_bam: bool):
+        CleanUp(self.get_control_settings(key=key)).main(
+            bams=[bam],
+            discard_bam=discard_bam)
+
+    def write_summary(self):
+        rows = [self.get_summary_row(sample=s) for s in self.samples]
+        df = pd.DataFrame(rows).convert_dtypes()  # peak counts stay integers with missing values
+        df.to_csv(f'{self.outdir}/summary.tsv', sep='\t', index=False)
+
+    def get_summary_row(self, sample: Sample) -> Dict[str, Any]:
+        key = self.sample_control_keys[sample.name]
+        prefixes = [f'{sample.name}/'] if key is None else [f'{sample.name}/', self.get_control_task_prefix(key=key)]
+        tasks = [t for t in self.scheduler.tasks.keys() if t.startswith(tuple(prefixes))]
+        failed = [t for t in [self.index_task] + tasks if self.scheduler.status(t) == 'failed']
+
+        row = {
+            'sample_name': sample.name,
+            'status': 'done' if all(self.scheduler.status(t) == 'done' for t in tasks) else 'failed',
+            'failed_tasks': ','.join(failed),
+            'outdir': f'{self.outdir}/{sample.name}',
+            'control': '' if key is None else f'{self.outdir}/{self.get_control_task_prefix(key=key).rstrip("/")}',
+        }
+
+        peak_calling = f'{sample.name}/peak-calling'
+        if self.scheduler.status(peak_calling) == 'done':
+            for peak_file in self.scheduler.result(peak_calling):
+                row[f'{os.path.basename(peak_file)} peaks'] = count_peaks(peak_file)
+        return row
+
+    def remove_workdir(self):
+        if not (self.debug or self.settings.keep_workdir):
+            self.call(f'rm -r {self.workdir}')
+
+
+def count_peaks(peak_file: str) -> Optional[int]:
+    if not os.path.exists(peak_file):  # e.g. moved or removed
+        return None
+    with open(peak_file) as fh:
+        return sum(1 for line in fh if line.strip() != '' and not line.startswith('#'))
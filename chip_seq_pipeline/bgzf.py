@@ -0,0 +1,323 @@
+"""
+Block-parallel gzip for compressed intermediates (fastq chunks, BED files, ...), with zlib in a thread pool,
+which runs in parallel as zlib releases the GIL
+
+Files are written as BGZF, i.e. gzip members of up to 64 KB of data each, with the size of each member
+in its header, the same as bgzip and htslib write, so they are valid gzip files for any reader,
+and can be split at member boundaries to be read in parallel
+
+Reading handles BGZF, whose blocks are decompressed in parallel, plain (possibly multi-member) gzip,
+which is decompressed ahead of the reader in a background thread, and uncompressed files as is
+
+with open_bgzf('reads.fq.gz', 'wt', threads=4) as fh:
+    fh.write('@read1\\nACGT\\n+\\nIIII\\n')
+"""
+import io
+import zlib
+import queue
+import struct
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import IO, Optional, Deque, List, Iterator, Tuple
+
+
+BLOCK_SIZE = 0xff00  # data bytes per BGZF block, as htslib, so that a block of incompressible data still fits in 64 KB
+BLOCKS_PER_TASK = 16  # blocks compressed or decompressed by one task of the thread pool
+GZIP_MAGIC = b'\x1f\x8b'
+HEADER = struct.Struct('<4BI2BH2BHH')  # ID1 ID2 CM FLG MTIME XFL OS XLEN SI1 SI2 SLEN BSIZE
+EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+READ_AHEAD_CHUNKS = 4  # decompressed chunks buffered ahead of the reader of a plain gzip file
+
+
+def compress_block(data: bytes, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # raw deflate, the gzip header is written here
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = HEADER.size + len(deflated) + 8
+    header = HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+    return header + deflated + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def compress_blocks(data: bytes, level: int) -> bytes:
+    return b''.join(compress_block(data[i:i + BLOCK_SIZE], level) for i in range(0, len(data), BLOCK_SIZE))
+
+
+def decompress_blocks(blocks: List[bytes]) -> bytes:
+    return b''.join(zlib.decompress(block, 31) for block in blocks)  # 31: gzip header and CRC check
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Buffers written bytes into tasks of BLOCKS_PER_TASK blocks, which are compressed by the thread pool,
+    and written to the file in order as they complete, with at most two tasks per thread in flight
+    """
+
+    fh: IO[bytes]
+    level: int
+    pool: Optional[ThreadPoolExecutor]
+    own_pool: bool
+    max_pending: int
+    buffer: bytearray
+    pending: Deque[Future]
+
+    def __init__(
+            self,
+            path: str,
+            level: int = 6,
+            threads: int = 1,
+            pool: Optional[ThreadPoolExecutor] = None):
+        """
+        threads: workers of the pool, either the given one or one made for this writer
+        pool: shared by many writers (e.g. chunks of a fastq file), instead of one pool of `threads` per writer
+        """
+        super().__init__()
+        self.fh = open(path, 'wb')
+        self.level = level
+        self.own_pool = pool is None and threads > 1
+        self.pool = ThreadPoolExecutor(max_workers=threads) if self.own_pool else pool
+        self.max_pending = 2 * threads
+        self.buffer = bytearray()
+        self.pending = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.buffer += b
+        task_bytes = BLOCK_SIZE * BLOCKS_PER_TASK
+        if len(self.buffer) >= task_bytes:
+            n = len(self.buffer) // task_bytes * task_bytes
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            for i in range(0, n, task_bytes):
+                self.submit(data[i:i + task_bytes])
+        return len(b)
+
+    def submit(self, data: bytes):
+        if self.pool is None:
+            self.fh.write(compress_blocks(data, self.level))
+            return
+        self.pending.append(self.pool.submit(compress_blocks, data, self.level))
+        while len(self.pending) > self.max_pending:
+            self.fh.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if len(self.buffer) > 0:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while len(self.pending) > 0:
+                self.fh.write(self.pending.popleft().result())
+            self.fh.write(EOF_BLOCK)
+        finally:
+            self.fh.close()
+            if self.own_pool:
+                self.pool.shutdown()
+            super().close()
+
+
+class GzipReader(io.RawIOBase):
+    """
+    Decompressed bytes of a BGZF or plain gzip file, from an iterator of decompressed chunks in order
+    """
+
+    fh: IO[bytes]
+    pool: Optional[ThreadPoolExecutor]
+    own_pool: bool
+    max_pending: int
+    chunks: Iterator[bytes]
+    chunk: memoryview
+    stop: threading.Event
+
+    def __init__(
+            self,
+            path: str,
+            threads: int = 1,
+            pool: Optional[ThreadPoolExecutor] = None):
+        """
+        threads: workers of the pool, either the given one or one made for this reader
+        """
+        super().__init__()
+        self.fh = open(path, 'rb')
+        self.own_pool = pool is None and threads > 1
+        self.pool = ThreadPoolExecutor(max_workers=threads) if self.own_pool else pool
+        self.max_pending = 2 * threads
+        self.chunk = memoryview(b'')
+        self.stop = threading.Event()
+        self.chunks = self.bgzf_chunks() if is_bgzf(path) else self.gzip_chunks()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self.chunk) == 0:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def bgzf_chunks(self) -> Iterator[bytes]:
+        """
+        Blocks are read in groups of BLOCKS_PER_TASK, which are decompressed in parallel and yielded in order
+        """
+        pending = deque()
+        while True:
+            blocks = list(filter(None, (read_bgzf_block(self.fh) for _ in range(BLOCKS_PER_TASK))))
+            if len(blocks) > 0:
+                if self.pool is None:
+                    yield decompress_blocks(blocks)
+                else:
+                    pending.append(self.pool.submit(decompress_blocks, blocks))
+            while len(pending) > 0 and (len(pending) > self.max_pending or len(blocks) < BLOCKS_PER_TASK):
+                yield pending.popleft().result()
+            if len(blocks) < BLOCKS_PER_TASK:
+                return
+
+    def gzip_chunks(self) -> Iterator[bytes]:
+        """
+        A plain gzip stream can only be decompressed in order, so it is decompressed in a background thread,
+        ahead of the reader, with members decompressed one after another
+        """
+        q = queue.Queue(maxsize=READ_AHEAD_CHUNKS)
+        thread = threading.Thread(target=self.decompress_gzip, args=(q,), daemon=True)
+        thread.start()
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        thread.join()
+
+    def decompress_gzip(self, q: queue.Queue):
+        try:
+            decompressor = zlib.decompressobj(31)
+            in_member = False
+            data = b''
+            while not self.stop.is_set():
+                if len(data) == 0:
+                    data = self.fh.read(BLOCK_SIZE * BLOCKS_PER_TASK)
+                    if len(data) == 0:
+                        break
+                out = decompressor.decompress(data)
+                in_member = True
+                if len(out) > 0:
+                    put(q, out, self.stop)
+                if decompressor.eof:  # the rest is the next gzip member, if any
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(31)
+                    in_member = False
+                else:
+                    data = b''
+            if in_member:
+                raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+            put(q, None, self.stop)
+        except Exception as e:
+            put(q, e, self.stop)
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop.set()
+        self.fh.close()
+        if self.own_pool:
+            self.pool.shutdown()
+        super().close()
+
+
+def put(q: queue.Queue, item, stop: threading.Event):
+    """
+    Puts an item into a bounded queue, unless the reader is closed before reading everything
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def read_bgzf_block(fh: IO[bytes]) -> Optional[bytes]:
+    """
+    Returns the whole gzip member of one BGZF block, or None at the end of file
+    """
+    header = fh.read(12)
+    if len(header) == 0:
+        return None
+    assert len(header) == 12 and header[:2] == GZIP_MAGIC, 'Truncated or invalid BGZF block'
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = fh.read(xlen)
+    block_size = bgzf_block_size(extra)
+    assert block_size is not None, 'Not a BGZF block: no BC subfield in the gzip header'
+    rest = fh.read(block_size - 12 - xlen)
+    assert len(rest) == block_size - 12 - xlen, 'Truncated BGZF block'
+    return header + extra + rest
+
+
+def bgzf_block_size(extra: bytes) -> Optional[int]:
+    i = 0
+    while i + 4 <= len(extra):
+        si1, si2, slen = extra[i], extra[i + 1], struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if (si1, si2, slen) == (66, 67, 2):
+            return struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+        i += 4 + slen
+    return None
+
+
+def is_gzip(path: str) -> bool:
+    with open(path, 'rb') as fh:
+        return fh.read(2) == GZIP_MAGIC
+
+
+def is_bgzf(path: str) -> bool:
+    with open(path, 'rb') as fh:
+        header = fh.read(12)
+        if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4:  # FLG.FEXTRA
+            return False
+        return bgzf_block_size(fh.read(struct.unpack('<H', header[10:12])[0])) is not None
+
+
+def open_bgzf(
+        path: str,
+        mode: str = 'rb',
+        threads: int = 1,
+        level: int = 6,
+        pool: Optional[ThreadPoolExecutor] = None) -> IO:
+    """
+    mode: 'rb' or 'rt' to read a BGZF, gzip or uncompressed file, 'wb' or 'wt' to write a BGZF file
+    threads: workers of the thread pool, either the given pool or one made for this file
+    level: zlib compression level of writing, 1 (fastest) to 9
+    """
+    assert mode in ['rb', 'rt', 'wb', 'wt'], f'Invalid mode "{mode}"'
+    if mode[0] == 'w':
+        raw = BgzfWriter(path=path, level=level, threads=threads, pool=pool)
+        buffered = io.BufferedWriter(raw, buffer_size=BLOCK_SIZE)
+    elif is_gzip(path):
+        raw = GzipReader(path=path, threads=threads, pool=pool)
+        buffered = io.BufferedReader(raw, buffer_size=BLOCK_SIZE)
+    else:
+        buffered = open(path, 'rb')
+    return buffered if mode[1] == 'b' else io.TextIOWrapper(buffered)
+
+
+def block_offsets(path: str) -> List[Tuple[int, int]]:
+    """
+    (compressed offset, data size) of each BGZF block, e.g. to split a file into ranges read in parallel
+    """
+    ret = []
+    with open(path, 'rb') as fh:
+        while True:
+            offset = fh.tell()
+            block = read_bgzf_block(fh)
+            if block is None:
+                return ret
+            size = struct.unpack('<I', block[-4:])[0]
+            if size > 0:  # not the EOF block
+                ret.append((offset, size))
@@ -1,17 +1,754 @@
 import os
-from typing import Optional, List
-from .mapping import Mapping
-from .trimming import Trimming
-from .template import Processor
-from .bam2bigwig import Bam2BigWig
+import shutil
+import hashlib
+from typing import Optional, List, Tuple, Dict
+from .template import Processor, Settings
+from .trimming import TrimGalore, TrimGaloreChunk, MergeTrimmedChunks, FastQC, TrimmingStream, STREAM, GZIP
 from .chipseeker import ChIPseeker
-from .peak_calling import PeakCalling
+from .bam2bigwig import BamCoverage
+from .manifest import file_fingerprint
+from .scheduler import DAGScheduler
 from .motif_finding import MotifFinding
 from .peak_annotation import PeakAnnotation
-from .mark_duplicates import MarkDuplicates
+from .fastq import SplitFastqPair, get_lanes, split_paths
+from .mapping import BuildIndex, MapReads, MergeBams
+from .bam_filtering import FilterBam
+from .mark_duplicates import MarkBamDuplicates
+from .fragment_size import EstimateFragmentSize
+from .peak_calling import PeakCalling, MakeTagDirectory, MakeGroupTagDirectories, ChromosomeGroups
+
+
+class ReadTasks(Processor):
+    """
+    Adds the tasks that turn a pair of fastq files into the final BAM, its fragment size, bigWig and HOMER tag directory,
+    and returns the names of the tasks producing the BAM, the fragment size and the tag directory
+
+    fq1 and fq2 can be comma-separated fastq files of lanes, which are trimmed and aligned as tasks of their own,
+    each lane with its read group, and merged into the sorted BAM of the sample before duplicate marking
+
+    With filter_bam, the duplicate-marked BAM is filtered once (FilterBam) into the final BAM, which all later tasks read
+    """
+
+    ALIGNER_VERSION_CMD = {
+        'bowtie2': 'bowtie2 --version',
+        'bwa': 'bwa',  # prints usage with version
+    }
+    SAMTOOLS_VERSION_CMD = 'samtools --version'
+    MARKDUP_VERSION_CMD = {
+        'gatk': 'gatk --version',
+        'samtools': SAMTOOLS_VERSION_CMD,
+    }
+
+    scheduler: DAGScheduler
+    index_task: str
+    task_prefix: str
+    sample_name: str
+    fq1: str
+    fq2: str
+
+    base_quality_cutoff: int
+    min_read_length: int
+    trim_output: str
+    trimming_chunks: int
+
+    read_aligner: str
+    bowtie2_mode: str
+    alignment_chunks: int
+
+    skip_mark_duplicates: bool
+    markdup_engine: str
+
+    filter_bam: bool
+    filter_min_mapq: int
+    filter_keep_improper_pairs: bool
+    filter_contigs: str
+    filter_blacklist: Optional[str]
+
+    chromosome_groups_task: Optional[str]
+
+    def main(
+            self,
+            scheduler: DAGScheduler,
+            index_task: str,
+            task_prefix: str,
+            sample_name: str,
+            fq1: str,
+            fq2: str,
+
+            base_quality_cutoff: int,
+            min_read_length: int,
+            trim_output: str,
+            trimming_chunks: int,
+
+            read_aligner: str,
+            bowtie2_mode: str,
+            alignment_chunks: int,
+
+            skip_mark_duplicates: bool,
+            markdup_engine: str,
+
+            filter_bam: bool,
+            filter_min_mapq: int,
+            filter_keep_improper_pairs: bool,
+            filter_contigs: str,
+            filter_blacklist: Optional[str],
+
+            chromosome_groups_task: Optional[str] = None) -> Dict[str, str]:
+        """
+        trim_output: 'stream' to pipe trimmed reads into the aligner, in the same task,
+            or 'uncompressed' or 'gzip' trimmed fastq files, which chunked alignment needs to split
+        trimming_chunks: split untrimmed reads into chunks trimmed as separate tasks, when trimmed reads are written
+        chromosome_groups_task: the task of chromosome groups (ChromosomeGroups), if HOMER tag directories are made by group
+        """
+
+        self.scheduler = scheduler
+        self.index_task = index_task
+        self.task_prefix = task_prefix
+        self.sample_name = sample_name
+        self.fq1 = fq1
+        self.fq2 = fq2
+
+        self.base_quality_cutoff = base_quality_cutoff
+        self.min_read_length = min_read_length
+        self.trim_output = trim_output
+        self.trimming_chunks = trimming_chunks
+
+        self.read_aligner = read_aligner
+        self.bowtie2_mode = bowtie2_mode
+        self.alignment_chunks = alignment_chunks
+
+        self.skip_mark_duplicates = skip_mark_duplicates
+        self.markdup_engine = markdup_engine
+
+        self.filter_bam = filter_bam
+        self.filter_min_mapq = filter_min_mapq
+        self.filter_keep_improper_pairs = filter_keep_improper_pairs
+        self.filter_contigs = filter_contigs
+        self.filter_blacklist = filter_blacklist
+
+        self.chromosome_groups_task = chromosome_groups_task
+
+        lanes = get_lanes(fq1=self.fq1, fq2=self.fq2)
+
+        # lanes and chunks of reads are aligned as tasks of their own, whose sorted BAMs are merged into one
+        merge_bams = len(lanes) > 1 or self.alignment_chunks > 1
+
+        # samtools duplicate marking is fused into the stream of alignments, unless BAMs are merged first
+        fuse_mark_duplicates = not self.skip_mark_duplicates \
+            and self.markdup_engine.lower() == 'samtools' \
+            and not merge_bams
+
+        if merge_bams:
+            bams = []
+            for lane, fq1, fq2 in lanes:
+                name = self.sample_name if len(lanes) == 1 else f'{self.sample_name}-{lane}'
+                read_group = None if len(lanes) == 1 else (name, self.sample_name)
+                bams += self.add_lane_tasks(name=name, fq1=fq1, fq2=fq2, read_group=read_group)
+            bam = self.scheduler.add(
+                name=f'{self.task_prefix}map-{self.sample_name}',
+                function=self.merge_chunks,
+                inputs=dict(chunk_bams=bams),
+                params=dict(sample_name=self.sample_name),
+                tools=[self.SAMTOOLS_VERSION_CMD])
+        else:
+            _, fq1, fq2 = lanes[0]
+            bam = self.add_map_task(
+                name=self.sample_name,
+                fq1=fq1,
+                fq2=fq2,
+                write_stats=True,
+                mark_duplicates=fuse_mark_duplicates,
+                read_group=None)
+
+        if not self.skip_mark_duplicates and not fuse_mark_duplicates:
+            bam = self.scheduler.add(
+                name=f'{self.task_prefix}markdup-{self.sample_name}',
+                function=MarkBamDuplicates(self.settings).main,
+                inputs=dict(bam=bam),
+                params=dict(engine=self.markdup_engine),
+                tools=[self.MARKDUP_VERSION_CMD[self.markdup_engine]])
+
+        if self.filter_bam:
+            bam = self.scheduler.add(
+                name=f'{self.task_prefix}filter-{self.sample_name}',
+                function=FilterBam(self.settings).main,
+                inputs=dict(bam=bam),
+                params=dict(
+                    min_mapq=self.filter_min_mapq,
+                    keep_improper_pairs=self.filter_keep_improper_pairs,
+                    contigs=self.filter_contigs,
+                    blacklist=self.filter_blacklist),
+                files=['blacklist'],
+                tools=[self.SAMTOOLS_VERSION_CMD])
+
+        fragment_size = self.scheduler.add(
+            name=f'{self.task_prefix}fragment-size-{self.sample_name}',
+            function=EstimateFragmentSize(self.settings).main,
+            inputs=dict(bam=bam),
+            params=dict(name=self.sample_name),
+            tools=[self.SAMTOOLS_VERSION_CMD])
+
+        self.scheduler.add(
+            name=f'{self.task_prefix}bigwig-{self.sample_name}',
+            function=BamCoverage(self.settings).main,
+            inputs=dict(bam=bam, fragment_size=fragment_size),
+            tools=['bamCoverage --version', self.SAMTOOLS_VERSION_CMD])
+
+        if self.chromosome_groups_task is None:
+            tag_dir = self.scheduler.add(
+                name=f'{self.task_prefix}homer-tag-{self.sample_name}',
+                function=MakeTagDirectory(self.settings).main,
+                inputs=dict(bam=bam),
+                params=dict(name=self.sample_name))
+        else:
+            tag_dir = self.scheduler.add(
+                name=f'{self.task_prefix}homer-tag-{self.sample_name}',
+                function=MakeGroupTagDirectories(self.settings).main,
+                inputs=dict(bam=bam, chromosome_groups=self.chromosome_groups_task),
+                params=dict(name=self.sample_name),
+                tools=[self.SAMTOOLS_VERSION_CMD])
+
+        return {'bam': bam, 'fragment_size': fragment_size, 'tag_dir': tag_dir}
+
+    def add_lane_tasks(
+            self,
+            name: str,
+            fq1: str,
+            fq2: str,
+            read_group: Optional[Tuple[str, str]]) -> List[str]:
+        """
+        Adds the tasks that turn a lane (or all reads) of the sample into sorted BAMs to be merged,
+        and returns their names
+
+        name: of the lane, e.g. 'treatment-L001', or the sample if it has only one lane
+        """
+        if self.alignment_chunks > 1:
+            return self.add_chunked_mapping_tasks(
+                name=name,
+                trim=self.add_trim_task(name=name, fq1=fq1, fq2=fq2),
+                read_group=read_group)
+        return [self.add_map_task(
+            name=name,
+            fq1=fq1,
+            fq2=fq2,
+            write_stats=False,
+            mark_duplicates=False,
+            read_group=read_group)]
+
+    def add_map_task(
+            self,
+            name: str,
+            fq1: str,
+            fq2: str,
+            write_stats: bool,
+            mark_duplicates: bool,
+            read_group: Optional[Tuple[str, str]]) -> str:
+        """
+        Trimming is fused into the stream of reads into the aligner, unless trimmed reads are written (trim_output)
+        """
+        if self.trim_output == STREAM:
+            return self.scheduler.add(
+                name=f'{self.task_prefix}map-{name}',
+                function=self.trim_and_map_reads,
+                inputs=dict(index=self.index_task),
+                params=dict(
+                    fq1=fq1,
+                    fq2=fq2,
+                    base_quality_cutoff=self.base_quality_cutoff,
+                    min_read_length=self.min_read_length,
+                    read_aligner=self.read_aligner,
+                    bowtie2_mode=self.bowtie2_mode,
+                    sample_name=name,
+                    write_stats=write_stats,
+                    mark_duplicates=mark_duplicates,
+                    read_group=read_group),
+                files=['fq1', 'fq2'],
+                tools=[
+                    'cutadapt --version',
+                    'fastqc --version',
+                    self.ALIGNER_VERSION_CMD[self.read_aligner],
+                    self.SAMTOOLS_VERSION_CMD,
+                ])
+        return self.scheduler.add(
+            name=f'{self.task_prefix}map-{name}',
+            function=self.map_reads,
+            inputs=dict(index=self.index_task, trimmed_fqs=self.add_trim_task(name=name, fq1=fq1, fq2=fq2)),
+            params=dict(
+                read_aligner=self.read_aligner,
+                bowtie2_mode=self.bowtie2_mode,
+                sample_name=name,
+                write_stats=write_stats,
+                mark_duplicates=mark_duplicates,
+                read_group=read_group),
+            tools=[self.ALIGNER_VERSION_CMD[self.read_aligner], self.SAMTOOLS_VERSION_CMD])
+
+    def add_trim_task(self, name: str, fq1: str, fq2: str) -> str:
+        if self.trimming_chunks > 1:
+            return self.add_chunked_trimming_tasks(name=name, fq1=fq1, fq2=fq2)
+        return self.scheduler.add(
+            name=f'{self.task_prefix}trim-{name}',
+            function=TrimGalore(self.settings).main,
+            params=dict(
+                fq1=fq1,
+                fq2=fq2,
+                base_quality_cutoff=self.base_quality_cutoff,
+                min_read_length=self.min_read_length,
+                compress=self.trim_output == GZIP),
+            files=['fq1', 'fq2'],
+            tools=['trim_galore --version', 'cutadapt --version'])
+
+    def add_chunked_trimming_tasks(self, name: str, fq1: str, fq2: str) -> str:
+        """
+        Scatter-gather: untrimmed reads are split into chunks, each chunk is trimmed as a task,
+        and the trimmed chunks are concatenated, with FastQC of the untrimmed reads as a concurrent task of its own
+        """
+        self.scheduler.add(
+            name=f'{self.task_prefix}fastqc-{name}',
+            function=FastQC(self.settings).main,
+            params=dict(fq1=fq1, fq2=fq2),
+            files=['fq1', 'fq2'],
+            tools=['fastqc --version'])
+
+        split = self.scheduler.add(
+            name=f'{self.task_prefix}split-untrimmed-{name}',
+            function=self.split_untrimmed_reads,
+            params=dict(
+                fq1=fq1,
+                fq2=fq2,
+                chunks=self.trimming_chunks,
+                sample_name=name),
+            files=['fq1', 'fq2'])
+
+        trimmed_chunks = []
+        for i in range(self.trimming_chunks):
+            trimmed_chunks.append(self.scheduler.add(
+                name=f'{self.task_prefix}trim-{name}-chunk-{i + 1}',
+                function=self.trim_chunk,
+                inputs=dict(chunk_fqs=split),
+                params=dict(
+                    chunk=i,
+                    chunks=self.trimming_chunks,
+                    base_quality_cutoff=self.base_quality_cutoff,
+                    min_read_length=self.min_read_length,
+                    compress=self.trim_output == GZIP),
+                tools=['trim_galore --version', 'cutadapt --version']))
+
+        return self.scheduler.add(
+            name=f'{self.task_prefix}trim-{name}',
+            function=MergeTrimmedChunks(self.settings).main,
+            inputs=dict(chunk_fqs=split, trimmed_chunk_fqs=trimmed_chunks),
+            params=dict(fq1=fq1, fq2=fq2))
+
+    def add_chunked_mapping_tasks(self, name: str, trim: str, read_group: Optional[Tuple[str, str]]) -> List[str]:
+        """
+        Scatter: trimmed reads are split into chunks, each chunk is aligned and sorted as a task,
+        and the names of the chunk tasks are returned, whose sorted BAMs are to be merged into one
+        """
+        split = self.scheduler.add(
+            name=f'{self.task_prefix}split-{name}',
+            function=self.split_reads,
+            inputs=dict(trimmed_fqs=trim),
+            params=dict(
+                chunks=self.alignment_chunks,
+                sample_name=name))
+
+        chunk_bams = []
+        for i in range(self.alignment_chunks):
+            chunk_bams.append(self.scheduler.add(
+                name=f'{self.task_prefix}map-{name}-chunk-{i + 1}',
+                function=self.map_chunk,
+                inputs=dict(index=self.index_task, chunk_fqs=split),
+                params=dict(
+                    chunk=i,
+                    read_aligner=self.read_aligner,
+                    bowtie2_mode=self.bowtie2_mode,
+                    sample_name=name,
+                    read_group=read_group),
+                tools=[self.ALIGNER_VERSION_CMD[self.read_aligner], self.SAMTOOLS_VERSION_CMD]))
+
+        return chunk_bams
+
+    def map_reads(
+            self,
+            index: str,
+            trimmed_fqs: Tuple[str, str],
+            read_aligner: str,
+            bowtie2_mode: str,
+            sample_name: str,
+            write_stats: bool,
+            mark_duplicates: bool,
+            read_group: Optional[Tuple[str, str]]) -> str:
+
+        fq1, fq2 = trimmed_fqs
+        return MapReads(self.settings).main(
+            index=index,
+            fq1=fq1,
+            fq2=fq2,
+            read_aligner=read_aligner,
+            bowtie2_mode=bowtie2_mode,
+            sample_name=sample_name,
+            write_stats=write_stats,
+            mark_duplicates=mark_duplicates,
+            read_group=read_group)
+
+    def trim_and_map_reads(
+            self,
+            index: str,
+            fq1: str,
+            fq2: str,
+            base_quality_cutoff: int,
+            min_read_length: int,
+            read_aligner: str,
+            bowtie2_mode: str,
+            sample_name: str,
+            write_stats: bool,
+            mark_duplicates: bool,
+            read_group: Optional[Tuple[str, str]]) -> str:
+
+        return MapReads(self.settings).main(
+            index=index,
+            fq1=fq1,
+            fq2=fq2,
+            read_aligner=read_aligner,
+            bowtie2_mode=bowtie2_mode,
+            sample_name=sample_name,
+            write_stats=write_stats,
+            mark_duplicates=mark_duplicates,
+            trimming=TrimmingStream(
+                fq1=fq1,
+                fq2=fq2,
+                base_quality_cutoff=base_quality_cutoff,
+                min_read_length=min_read_length),
+            read_group=read_group)
+
+    def split_untrimmed_reads(
+            self,
+            fq1: str,
+            fq2: str,
+            chunks: int,
+            sample_name: str) -> List[Optional[Tuple[str, str]]]:
+
+        return SplitFastqPair(self.settings).main(
+            fq1=fq1,
+            fq2=fq2,
+            chunks=chunks,
+            dstdir=f'{self.workdir}/untrimmed-chunks-{sample_name}')
+
+    def trim_chunk(
+            self,
+            chunk_fqs: List[Optional[Tuple[str, str]]],
+            chunk: int,
+            chunks: int,
+            base_quality_cutoff: int,
+            min_read_length: int,
+            compress: bool) -> Optional[Tuple[str, str]]:
+
+        if chunk_fqs[chunk] is None:  # no reads in the chunk
+            return None
+        fq1, fq2 = chunk_fqs[chunk]
+        return TrimGaloreChunk(self.settings).main(
+            fq1=fq1,
+            fq2=fq2,
+            base_quality_cutoff=base_quality_cutoff,
+            min_read_length=min_read_length,
+            compress=compress,
+            chunks=chunks)
+
+    def split_reads(
+            self,
+            trimmed_fqs: Tuple[str, str],
+            chunks: int,
+            sample_name: str) -> List[Optional[Tuple[str, str]]]:
+
+        fq1, fq2 = trimmed_fqs
+        return SplitFastqPair(self.settings).main(
+            fq1=fq1,
+            fq2=fq2,
+            chunks=chunks,
+            dstdir=f'{self.workdir}/chunks-{sample_name}')
+
+    def map_chunk(
+            self,
+            index: str,
+            chunk_fqs: List[Optional[Tuple[str, str]]],
+            chunk: int,
+            read_aligner: str,
+            bowtie2_mode: str,
+            sample_name: str,
+            read_group: Optional[Tuple[str, str]]) -> Optional[str]:
+
+        if chunk_fqs[chunk] is None:  # no reads in the chunk
+            return None
+        fq1, fq2 = chunk_fqs[chunk]
+        return MapReads(self.settings).main(
+            index=index,
+            fq1=fq1,
+            fq2=fq2,
+            read_aligner=read_aligner,
+            bowtie2_mode=bowtie2_mode,
+            sample_name=f'{sample_name}-chunk-{chunk + 1}',
+            write_stats=False,
+            read_group=read_group)
+
+    def merge_chunks(self, chunk_bams: List[Optional[str]], sample_name: str) -> str:
+        return MergeBams(self.settings).main(
+            bams=[b for b in chunk_bams if b is not None],
+            sample_name=sample_name)
+
+
+class ChipSeqTasks(Processor):
+    """
+    Adds the tasks of one treatment to a scheduler, from trimming to peak annotation,
+    given the tasks that build the read aligner index and process the control (if any)
+
+    Task names start with `task_prefix`, e.g. 'sample-1/', so that tasks of many samples share one scheduler
+    """
+
+    TREATMENT = 'treatment'
+
+    scheduler: DAGScheduler
+    index_task: str
+    chromosome_groups_task: Optional[str]
+    task_prefix: str
+
+    treatment_fq1: str
+    treatment_fq2: str
+    control_tasks: Optional[Dict[str, str]]
+    clean_up_control: bool
+
+    base_quality_cutoff: int
+    min_read_length: int
+    trim_output: str
+    trimming_chunks: int
+
+    read_aligner: str
+    bowtie2_mode: str
+    alignment_chunks: int
+    discard_bam: bool
+
+    skip_mark_duplicates: bool
+    markdup_engine: str
+
+    filter_bam: bool
+    filter_min_mapq: int
+    filter_keep_improper_pairs: bool
+    filter_contigs: str
+    filter_blacklist: Optional[str]
+
+    macs_effective_genome_size: str
+    macs_fdr: float
+    macs_separate_calls: bool
+
+    genome_version: str
+    peak_annotation_engine: str
+    gene_annotation: Optional[str]
+    skip_motif_finding: bool
+    motif_finding_fragment_size: int
+
+    treatment_tasks: Dict[str, str]
+
+    def main(
+            self,
+            scheduler: DAGScheduler,
+            index_task: str,
+            chromosome_groups_task: Optional[str],
+            task_prefix: str,
+
+            treatment_fq1: str,
+            treatment_fq2: str,
+            control_tasks: Optional[Dict[str, str]],
+            clean_up_control: bool,
+
+            base_quality_cutoff: int,
+            min_read_length: int,
+            trim_output: str,
+            trimming_chunks: int,
+
+            read_aligner: str,
+            bowtie2_mode: str,
+            alignment_chunks: int,
+            discard_bam: bool,
+
+            skip_mark_duplicates: bool,
+            markdup_engine: str,
+
+            filter_bam: bool,
+            filter_min_mapq: int,
+            filter_keep_improper_pairs: bool,
+            filter_contigs: str,
+            filter_blacklist: Optional[str],
+
+            macs_effective_genome_size: str,
+            macs_fdr: float,
+            macs_separate_calls: bool,
+
+            genome_version: str,
+            peak_annotation_engine: str,
+            gene_annotation: Optional[str],
+            skip_motif_finding: bool,
+            motif_finding_fragment_size: int):
+        """
+        chromosome_groups_task: the task of chromosome groups, if HOMER tag directories and peaks are by group
+        control_tasks: from ReadTasks, e.g. {'bam': 'markdup-control', 'fragment_size': ..., 'tag_dir': ...}
+        motif_finding_fragment_size: 0 for the fragment size estimated from the treatment BAM
+        clean_up_control: whether the control BAM is moved to the outdir along with the treatment BAM,
+            which is not the case for a control shared by other treatments
+        """
+
+        self.scheduler = scheduler
+        self.index_task = index_task
+        self.chromosome_groups_task = chromosome_groups_task
+        self.task_prefix = task_prefix
+
+        self.treatment_fq1 = treatment_fq1
+        self.treatment_fq2 = treatment_fq2
+        self.control_tasks = control_tasks
+        self.clean_up_control = clean_up_control
+
+        self.base_quality_cutoff = base_quality_cutoff
+        self.min_read_length = min_read_length
+        self.trim_output = trim_output
+        self.trimming_chunks = trimming_chunks
+
+        self.read_aligner = read_aligner
+        self.bowtie2_mode = bowtie2_mode
+        self.alignment_chunks = alignment_chunks
+        self.discard_bam = discard_bam
+
+        self.skip_mark_duplicates = skip_mark_duplicates
+        self.markdup_engine = markdup_engine
+
+        self.filter_bam = filter_bam
+        self.filter_min_mapq = filter_min_mapq
+        self.filter_keep_improper_pairs = filter_keep_improper_pairs
+        self.filter_contigs = filter_contigs
+        self.filter_blacklist = filter_blacklist
+
+        self.macs_effective_genome_size = macs_effective_genome_size
+        self.macs_fdr = macs_fdr
+        self.macs_separate_calls = macs_separate_calls
+
+        self.genome_version = genome_version
+        self.peak_annotation_engine = peak_annotation_engine
+        self.gene_annotation = gene_annotation
+        self.skip_motif_finding = skip_motif_finding
+        self.motif_finding_fragment_size = motif_finding_fragment_size
+
+        self.add_treatment_tasks()
+        self.add_peak_tasks()
+        self.add_clean_up_task()
+
+    def task_name(self, name: str) -> str:
+        return f'{self.task_prefix}{name}'
+
+    def add_treatment_tasks(self):
+        self.treatment_tasks = ReadTasks(self.settings).main(
+            scheduler=self.scheduler,
+            index_task=self.index_task,
+            task_prefix=self.task_prefix,
+            sample_name=self.TREATMENT,
+            fq1=self.treatment_fq1,
+            fq2=self.treatment_fq2,
+            base_quality_cutoff=self.base_quality_cutoff,
+            min_read_length=self.min_read_length,
+            trim_output=self.trim_output,
+            trimming_chunks=self.trimming_chunks,
+            read_aligner=self.read_aligner,
+            bowtie2_mode=self.bowtie2_mode,
+            alignment_chunks=self.alignment_chunks,
+            skip_mark_duplicates=self.skip_mark_duplicates,
+            markdup_engine=self.markdup_engine,
+            filter_bam=self.filter_bam,
+            filter_min_mapq=self.filter_min_mapq,
+            filter_keep_improper_pairs=self.filter_keep_improper_pairs,
+            filter_contigs=self.filter_contigs,
+            filter_blacklist=self.filter_blacklist,
+            chromosome_groups_task=self.chromosome_groups_task)
+
+    def add_peak_tasks(self):
+        inputs = dict(
+            treatment_bam=self.treatment_tasks['bam'],
+            treatment_tag_dir=self.treatment_tasks['tag_dir'])
+        params = dict(
+            macs_effective_genome_size=self.macs_effective_genome_size,
+            macs_fdr=self.macs_fdr,
+            macs_separate_calls=self.macs_separate_calls)
+        if self.control_tasks is not None:
+            inputs['control_bam'] = self.control_tasks['bam']
+            inputs['control_tag_dir'] = self.control_tasks['tag_dir']
+        else:
+            params['control_bam'] = None
+
+        peaks = self.scheduler.add(
+            name=self.task_name('peak-calling'),
+            function=PeakCalling(self.settings).main,
+            inputs=inputs,
+            params=params,
+            tools=['macs2 --version'])
+
+        self.scheduler.add(
+            name=self.task_name('peak-annotation'),
+            function=PeakAnnotation(self.settings).main,
+            inputs=dict(peak_files=peaks),
+            params=dict(
+                genome_version=self.genome_version,
+                engine=self.peak_annotation_engine,
+                gene_annotation=self.gene_annotation),
+            files=['gene_annotation'])
+
+        if not self.skip_motif_finding:
+            inputs = dict(peak_files=peaks)
+            params = dict(genome_version=self.genome_version)
+            if self.motif_finding_fragment_size == 0:
+                inputs['fragment_size'] = self.treatment_tasks['fragment_size']
+            else:
+                params['fragment_size'] = self.motif_finding_fragment_size
+            self.scheduler.add(
+                name=self.task_name('motif-finding'),
+                function=MotifFinding(self.settings).main,
+                inputs=inputs,
+                params=params)
+
+        self.scheduler.add(
+            name=self.task_name('chipseeker'),
+            function=ChIPseeker(self.settings).main,
+            inputs=dict(peak_files=peaks))
+
+    def add_clean_up_task(self):
+        inputs = dict(treatment_bam=self.treatment_tasks['bam'])
+        if self.control_tasks is not None and self.clean_up_control:
+            inputs['control_bam'] = self.control_tasks['bam']
+
+        self.scheduler.add(
+            name=self.task_name('clean-up'),
+            function=self.clean_up,
+            inputs=inputs,
+            params=dict(discard_bam=self.discard_bam),
+            dependencies=[t for t in self.scheduler.tasks.keys() if t.startswith(self.task_prefix)],  # runs last
+            resumable=False)
+
+    def clean_up(
+            self,
+            discard_bam: bool,
+            treatment_bam: str,
+            control_bam: Optional[str] = None):
+
+        CleanUp(self.settings).main(
+            bams=[treatment_bam, control_bam],
+            discard_bam=discard_bam)
 
 
 class ChipSeqPipeline(Processor):
+    """
+    The pipeline is described as a dependency graph of tasks, e.g. trim-treatment -> map-treatment,
+    so that treatment and control branches run concurrently and each task starts as soon as its inputs exist
+
+    Each task records a manifest in the workdir, so that a run resumed in the same workdir
+    only recomputes tasks whose inputs, parameters or tool versions have changed
+    """
+
+    CONTROL = 'control'
+    ALIGNER_VERSION_CMD = ReadTasks.ALIGNER_VERSION_CMD
 
     ref_fa: str
     treatment_fq1: str
@@ -21,23 +758,41 @@ class ChipSeqPipeline(Processor):
 
     base_quality_cutoff: int
     min_read_length: int
+    trim_output: str
+    trimming_chunks: int
 
     read_aligner: str
     bowtie2_mode: str
+    alignment_chunks: int
+    index_cache_dir: Optional[str]
+    index_cache_max_gb: float
     discard_bam: bool
 
     skip_mark_duplicates: bool
+    markdup_engine: str
+
+    filter_bam: bool
+    filter_min_mapq: int
+    filter_keep_improper_pairs: bool
+    filter_contigs: str
+    filter_blacklist: Optional[str]
 
     macs_effective_genome_size: str
     macs_fdr: float
+    macs_separate_calls: bool
+    homer_chromosome_groups: int
 
     genome_version: str
+    peak_annotation_engine: str
+    gene_annotation: Optional[str]
     skip_motif_finding: bool
     motif_finding_fragment_size: int
 
-    treatment_bam: str
-    control_bam: Optional[str]
-    peak_files: List[str]
+    scheduler: DAGScheduler
+    index_builder: BuildIndex
+    index_task: str
+    chromosome_groups_task: Optional[str]
+    control_tasks: Dict[str, Dict[str, str]]  # control key -> tasks producing the control BAM and tag directory
 
     def main(
             self,
@@ -49,19 +804,39 @@ class ChipSeqPipeline(Processor):
 
             base_quality_cutoff: int,
             min_read_length: int,
+            trim_output: str,
+            trimming_chunks: int,
 
             read_aligner: str,
             bowtie2_mode: str,
+            alignment_chunks: int,
+            index_cache_dir: Optional[str],
+            index_cache_max_gb: float,
             discard_bam: bool,
 
             skip_mark_duplicates: bool,
+            markdup_engine: str,
+
+            filter_bam: bool,
+            filter_min_mapq: int,
+            filter_keep_improper_pairs: bool,
+            filter_contigs: str,
+            filter_blacklist: Optional[str],
 
             macs_effective_genome_size: str,
             macs_fdr: float,
+            macs_separate_calls: bool,
+            homer_chromosome_groups: int,
 
             genome_version: str,
+            peak_annotation_engine: str,
+            gene_annotation: Optional[str],
             skip_motif_finding: bool,
             motif_finding_fragment_size: int):
+        """
+        homer_chromosome_groups: HOMER tag directories and peak calls are split into this many chromosome groups,
+            which run concurrently, 1 for one tag directory and peak call over the whole genome
+        """
 
         self.ref_fa = ref_fa
         self.treatment_fq1 = treatment_fq1
@@ -71,91 +846,220 @@ class ChipSeqPipeline(Processor):
 
         self.base_quality_cutoff = base_quality_cutoff
         self.min_read_length = min_read_length
+        self.trim_output = trim_output
+        self.trimming_chunks = trimming_chunks
 
         self.read_aligner = read_aligner
         self.bowtie2_mode = bowtie2_mode
+        self.alignment_chunks = alignment_chunks
+        self.index_cache_dir = index_cache_dir
+        self.index_cache_max_gb = index_cache_max_gb
         self.discard_bam = discard_bam
 
         self.skip_mark_duplicates = skip_mark_duplicates
+        self.markdup_engine = markdup_engine
+
+        self.filter_bam = filter_bam
+        self.filter_min_mapq = filter_min_mapq
+        self.filter_keep_improper_pairs = filter_keep_improper_pairs
+        self.filter_contigs = filter_contigs
+        self.filter_blacklist = filter_blacklist
 
         self.macs_effective_genome_size = macs_effective_genome_size
         self.macs_fdr = macs_fdr
+        self.macs_separate_calls = macs_separate_calls
+        self.homer_chromosome_groups = homer_chromosome_groups
 
         self.genome_version = genome_version
+        self.peak_annotation_engine = peak_annotation_engine
+        self.gene_annotation = gene_annotation
         self.skip_motif_finding = skip_motif_finding
         self.motif_finding_fragment_size = motif_finding_fragment_size
 
-        self.trimming()
-        self.mapping()
-        self.mark_duplicates()
-        self.bam2bigwig()
-        self.peak_calling()
-        self.peak_annotation()
-        self.motif_finding()
-        self.chipseeker()
-        self.clean_up()
-
-    def trimming(self):
-        self.treatment_fq1, self.treatment_fq2, self.control_fq1, self.control_fq2 = Trimming(self.settings).main(
+        self.set_scheduler()
+        self.add_index_task()
+        self.add_chromosome_groups_task()
+        self.add_chip_seq_tasks(
+            settings=self.settings,
+            task_prefix='',
             treatment_fq1=self.treatment_fq1,
             treatment_fq2=self.treatment_fq2,
             control_fq1=self.control_fq1,
             control_fq2=self.control_fq2,
+            clean_up_control=True)
+        self.add_release_index_task()
+        try:
+            self.scheduler.run()
+        finally:
+            self.index_builder.release()
+            self.write_profile()
+
+    def set_scheduler(self):
+        self.scheduler = DAGScheduler(
+            settings=self.settings,
+            max_workers=self.threads,
+            manifest_dir=f'{self.workdir}/manifests')
+        self.control_tasks = {}
+
+    def add_index_task(self):
+        self.index_builder = BuildIndex(self.settings)
+        self.index_task = self.scheduler.add(
+            name='index',
+            function=self.index_builder.main,
+            params=dict(
+                ref_fa=self.ref_fa,
+                read_aligner=self.read_aligner,
+                index_cache_dir=self.index_cache_dir,
+                index_cache_max_gb=self.index_cache_max_gb),
+            files=['ref_fa'],
+            tools=[self.ALIGNER_VERSION_CMD[self.read_aligner]],
+            prefix_result=True)
+
+    def add_release_index_task(self):
+        """
+        Releases a cached index, for other runs to evict, as soon as all reads are aligned,
+        or at the end of the run (finally), if an alignment task fails and the release task is cancelled
+        """
+        users = [name for name, task in self.scheduler.tasks.items() if self.index_task in task.upstream()]
+        self.scheduler.add(
+            name='release-index',
+            function=self.index_builder.release,
+            dependencies=users,
+            resumable=False)
+
+    def add_chromosome_groups_task(self):
+        if self.homer_chromosome_groups <= 1:
+            self.chromosome_groups_task = None
+            return
+        self.chromosome_groups_task = self.scheduler.add(
+            name='chromosome-groups',
+            function=ChromosomeGroups(self.settings).main,
+            params=dict(ref_fa=self.ref_fa, groups=self.homer_chromosome_groups),
+            files=['ref_fa'],
+            tools=[ReadTasks.SAMTOOLS_VERSION_CMD])
+
+    def add_chip_seq_tasks(
+            self,
+            settings: Settings,
+            task_prefix: str,
+            treatment_fq1: str,
+            treatment_fq2: str,
+            control_fq1: Optional[str],
+            control_fq2: Optional[str],
+            clean_up_control: bool):
+
+        ChipSeqTasks(settings).main(
+            scheduler=self.scheduler,
+            index_task=self.index_task,
+            chromosome_groups_task=self.chromosome_groups_task,
+            task_prefix=task_prefix,
+
+            treatment_fq1=treatment_fq1,
+            treatment_fq2=treatment_fq2,
+            control_tasks=None if control_fq1 is None else self.add_control_tasks(fq1=control_fq1, fq2=control_fq2),
+            clean_up_control=clean_up_control,
+
             base_quality_cutoff=self.base_quality_cutoff,
-            min_read_length=self.min_read_length)
+            min_read_length=self.min_read_length,
+            trim_output=self.trim_output,
+            trimming_chunks=self.trimming_chunks,
 
-    def mapping(self):
-        self.treatment_bam, self.control_bam = Mapping(self.settings).main(
-            ref_fa=self.ref_fa,
-            treatment_fq1=self.treatment_fq1,
-            treatment_fq2=self.treatment_fq2,
-            control_fq1=self.control_fq1,
-            control_fq2=self.control_fq2,
             read_aligner=self.read_aligner,
-            bowtie2_mode=self.bowtie2_mode)
-
-    def mark_duplicates(self):
-        if not self.skip_mark_duplicates:
-            self.treatment_bam, self.control_bam = MarkDuplicates(self.settings).main(
-                treatment_bam=self.treatment_bam,
-                control_bam=self.control_bam)
-
-    def bam2bigwig(self):
-        Bam2BigWig(self.settings).main(
-            treatment_bam=self.treatment_bam,
-            control_bam=self.control_bam)
-
-    def peak_calling(self):
-        self.peak_files = PeakCalling(self.settings).main(
-            treatment_bam=self.treatment_bam,
-            control_bam=self.control_bam,
-            macs_effective_genome_size=self.macs_effective_genome_size,
-            macs_fdr=self.macs_fdr)
+            bowtie2_mode=self.bowtie2_mode,
+            alignment_chunks=self.alignment_chunks,
+            discard_bam=self.discard_bam,
 
-    def peak_annotation(self):
-        PeakAnnotation(self.settings).main(
-            peak_files=self.peak_files,
-            genome_version=self.genome_version)
+            skip_mark_duplicates=self.skip_mark_duplicates,
+            markdup_engine=self.markdup_engine,
+
+            filter_bam=self.filter_bam,
+            filter_min_mapq=self.filter_min_mapq,
+            filter_keep_improper_pairs=self.filter_keep_improper_pairs,
+            filter_contigs=self.filter_contigs,
+            filter_blacklist=self.filter_blacklist,
+
+            macs_effective_genome_size=self.macs_effective_genome_size,
+            macs_fdr=self.macs_fdr,
+            macs_separate_calls=self.macs_separate_calls,
 
-    def motif_finding(self):
-        if self.skip_motif_finding:
-            return
-        MotifFinding(self.settings).main(
-            peak_files=self.peak_files,
             genome_version=self.genome_version,
-            fragment_size=self.motif_finding_fragment_size)
+            peak_annotation_engine=self.peak_annotation_engine,
+            gene_annotation=self.gene_annotation,
+            skip_motif_finding=self.skip_motif_finding,
+            motif_finding_fragment_size=self.motif_finding_fragment_size)
 
-    def chipseeker(self):
-        ChIPseeker(self.settings).main(
-            peak_files=self.peak_files)
+    def add_control_tasks(self, fq1: str, fq2: str) -> Dict[str, str]:
+        """
+        Controls are keyed by their fastq files and processing parameters,
+        so that a control shared by many treatments is processed only once
+        """
+        key = self.get_control_key(fq1=fq1, fq2=fq2)
+        if key not in self.control_tasks:
+            self.control_tasks[key] = ReadTasks(self.get_control_settings(key=key)).main(
+                scheduler=self.scheduler,
+                index_task=self.index_task,
+                task_prefix=self.get_control_task_prefix(key=key),
+                sample_name=self.CONTROL,
+                fq1=fq1,
+                fq2=fq2,
+                base_quality_cutoff=self.base_quality_cutoff,
+                min_read_length=self.min_read_length,
+                trim_output=self.trim_output,
+                trimming_chunks=self.trimming_chunks,
+                read_aligner=self.read_aligner,
+                bowtie2_mode=self.bowtie2_mode,
+                alignment_chunks=self.alignment_chunks,
+                skip_mark_duplicates=self.skip_mark_duplicates,
+                markdup_engine=self.markdup_engine,
+                filter_bam=self.filter_bam,
+                filter_min_mapq=self.filter_min_mapq,
+                filter_keep_improper_pairs=self.filter_keep_improper_pairs,
+                filter_contigs=self.filter_contigs,
+                filter_blacklist=self.filter_blacklist,
+                chromosome_groups_task=self.chromosome_groups_task)
+        return self.control_tasks[key]
 
-    def clean_up(self):
-        CleanUp(self.settings).main(
-            bams=[self.treatment_bam, self.control_bam],
-            discard_bam=self.discard_bam)
+    def get_control_key(self, fq1: str, fq2: str) -> str:
+        sha1 = hashlib.sha1()
+        for item in [fq1, fq2]:
+            for fq in split_paths(item):
+                sha1.update(f'{file_fingerprint(os.path.abspath(fq))}\n'.encode())
+        for item in [
+            self.ref_fa,
+            self.base_quality_cutoff,
+            self.min_read_length,
+            self.read_aligner,
+            self.bowtie2_mode,
+            self.skip_mark_duplicates,
+            self.markdup_engine,
+            self.filter_bam,
+            self.filter_min_mapq,
+            self.filter_keep_improper_pairs,
+            self.filter_contigs,
+            self.filter_blacklist,
+        ]:
+            sha1.update(f'{item}\n'.encode())
+        return sha1.hexdigest()[:12]
+
+    def get_control_settings(self, key: str) -> Settings:
+        return self.settings
+
+    def get_control_task_prefix(self, key: str) -> str:
+        return ''
+
+    def write_profile(self):
+        profiler = self.settings.profiler
+        profiler.write_json(f'{self.outdir}/profile.json')
+        self.logger.info(f'Resource usage by stage:\n{profiler.summary_table()}')
 
 
 class CleanUp(Processor):
+    """
+    Saves the BAMs and log files in the outdir, and removes the workdir unless it is kept (debug or keep_workdir)
+
+    BAMs are hardlinked (or copied across filesystems) rather than moved,
+    so that the manifests of a kept workdir still find them when the run is resumed
+    """
 
     bams: List[Optional[str]]
     discard_bam: bool
@@ -163,17 +1067,19 @@ class CleanUp(Processor):
     def main(self, bams: List[Optional[str]], discard_bam: bool):
         self.bams = bams
         self.discard_bam = discard_bam
-        self.move_if_keep_bams()
+        self.link_if_keep_bams()
         self.collect_log_files()
         self.remove_workdir()
 
-    def move_if_keep_bams(self):
+    def link_if_keep_bams(self):
         keep_bams = not self.discard_bam
         if keep_bams:
             for bam in self.bams:
-                if bam is not None:
-                    dst = f'{self.outdir}/{os.path.basename(bam)}'
-                    self.call(f'mv {bam} {dst}')
+                if bam is None:
+                    continue
+                for f in [bam, f'{bam}.bai', f'{bam[:-len(".bam")]}.bai']:  # along with the index, if any
+                    if f == bam or os.path.exists(f):
+                        link_or_copy(src=f, dst=f'{self.outdir}/{os.path.basename(f)}')
 
     def collect_log_files(self):
         os.makedirs(f'{self.outdir}/log', exist_ok=True)
@@ -181,5 +1087,14 @@ class CleanUp(Processor):
         self.call(cmd)
 
     def remove_workdir(self):
-        if not self.debug:
+        if not (self.debug or self.settings.keep_workdir):
             self.call(f'rm -r {self.workdir}')
+
+
+def link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)  # e.g. linked by a previous run
+    try:
+        os.link(src, dst)
+    except OSError:  # e.g. across filesystems
+        shutil.copy2(src, dst)
@@ -2,9 +2,10 @@ import time
 import random
 import pandas as pd
 from os.path import basename
-from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from typing import List, Dict, Union, Optional
 from .template import Processor
+from .bgzf import open_bgzf
 
 
 class ChIPseeker(Processor):
@@ -14,7 +15,7 @@ class ChIPseeker(Processor):
     def main(self, peak_files: List[str]):
         self.peak_files = peak_files
 
-        with Pool(self.threads) as p:
+        with ThreadPool(self.threads) as p:
             p.map(self.covplot, self.peak_files)
 
     def covplot(self, peak_file: str):
@@ -70,17 +71,18 @@ class WriteCleanBed(Processor):
 
         self.peak_file = peak_file
 
-        self.tell_if_is_homer_format()
-        self.parse_lines_and_set_data()
-        if len(self.data) == 0:
-            return None
-        self.write_clean_bed()
+        with self.profile():
+            self.tell_if_is_homer_format()
+            self.parse_lines_and_set_data()
+            if len(self.data) == 0:
+                return None
+            self.write_clean_bed()
 
         return self.clean_bed
 
     def tell_if_is_homer_format(self):
         self.is_homer_format = False
-        with open(self.peak_file) as fh:
+        with open_bgzf(self.peak_file, 'rt') as fh:
             for line in fh:
                 if line.startswith('#PeakID'):
                     self.is_homer_format = True
@@ -88,7 +90,7 @@ class WriteCleanBed(Processor):
 
     def parse_lines_and_set_data(self):
         self.data = []
-        with open(self.peak_file) as fh:
+        with open_bgzf(self.peak_file, 'rt') as fh:
             for line in fh:
                 self.__parse_one_(line)
 
@@ -133,6 +135,8 @@ class WriteCleanBed(Processor):
 
 class RunCovPlotRScript(Processor):
 
+    MEMORY_GB = 2.  # R with Bioconductor packages loaded
+
     peak_file: str
     clean_bed: str
 
@@ -173,7 +177,7 @@ class RunCovPlotRScript(Processor):
             f'1> {log}',
             f'2> {log}'
         ])
-        self.call(cmd)
+        self.call(cmd, memory_gb=self.MEMORY_GB)
 
 
 def get_filename(path: str, dirpath: bool, extension: bool):
@@ -0,0 +1,273 @@
+import os
+import re
+import time
+import threading
+import subprocess
+from datetime import datetime
+from typing import List, Optional
+from .profiling import read_proc_io
+
+
+class Execution:
+    """
+    Exit code and resource usage of an external command, as recorded by the profiler
+    """
+
+    returncode: int
+    start: str
+    wall_seconds: float
+    user_seconds: float
+    sys_seconds: float
+    peak_rss_mb: float
+    read_bytes: int
+    write_bytes: int
+
+    def __init__(
+            self,
+            returncode: int,
+            start: str,
+            wall_seconds: float,
+            user_seconds: float = 0.,
+            sys_seconds: float = 0.,
+            peak_rss_mb: float = 0.,
+            read_bytes: int = 0,
+            write_bytes: int = 0):
+
+        self.returncode = returncode
+        self.start = start
+        self.wall_seconds = wall_seconds
+        self.user_seconds = user_seconds
+        self.sys_seconds = sys_seconds
+        self.peak_rss_mb = peak_rss_mb
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+
+
+class Executor:
+    """
+    Backend that runs the shell commands of Processor.call
+
+    cores and memory_gb are what the caller has reserved for the command,
+    which a backend may use to limit or request resources
+    """
+
+    def run(self, cmd: str, cores: int, memory_gb: float) -> Execution:
+        pass
+
+
+class LocalExecutor(Executor):
+    """
+    Runs each command in bash on the current host, with pipefail so that a failing command
+    upstream of a pipe (e.g. aligner | samtools sort) is not masked
+    """
+
+    def run(self, cmd: str, cores: int, memory_gb: float) -> Execution:
+        start, t0 = datetime.now(), time.time()
+
+        p = subprocess.Popen(self.argv(cmd=cmd, memory_gb=memory_gb))
+
+        # wait without reaping, so that /proc/<pid>/io still exists and covers all reaped child processes
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        io = read_proc_io(f'/proc/{p.pid}/io')
+        _, status, rusage = os.wait4(p.pid, 0)  # rusage of the shell covers its child processes
+        p.returncode = os.waitstatus_to_exitcode(status)
+
+        return Execution(
+            returncode=p.returncode,
+            start=str(start),
+            wall_seconds=time.time() - t0,
+            user_seconds=rusage.ru_utime,
+            sys_seconds=rusage.ru_stime,
+            peak_rss_mb=rusage.ru_maxrss / 1024,
+            read_bytes=io.get('rchar', 0),
+            write_bytes=io.get('wchar', 0))
+
+    def argv(self, cmd: str, memory_gb: float) -> List[str]:
+        return ['bash', '-o', 'pipefail', '-c', cmd]
+
+
+class PoolExecutor(LocalExecutor):
+    """
+    Runs commands on the current host in a pool of at most `max_jobs` concurrent processes,
+    at a lower scheduling priority and, optionally, with a limit on the address space of each command
+
+    The address space limit (ulimit -v) is of virtual memory, which is well above the resident memory
+    of tools that map large indexes or reserve a JVM heap, so it is meant as a safeguard rather than a tight fit
+    """
+
+    NICE = 10
+
+    max_jobs: int
+    max_job_memory_gb: Optional[float]
+    semaphore: threading.Semaphore
+
+    def __init__(self, max_jobs: int, max_job_memory_gb: Optional[float]):
+        self.max_jobs = max(1, max_jobs)
+        self.max_job_memory_gb = max_job_memory_gb
+        self.semaphore = threading.Semaphore(self.max_jobs)
+
+    def run(self, cmd: str, cores: int, memory_gb: float) -> Execution:
+        with self.semaphore:
+            return super().run(cmd=cmd, cores=cores, memory_gb=memory_gb)
+
+    def argv(self, cmd: str, memory_gb: float) -> List[str]:
+        if self.max_job_memory_gb is not None:
+            cmd = f'ulimit -v {int(self.max_job_memory_gb * 1024 ** 2)}\n{cmd}'  # GB -> kB
+        return ['nice', '-n', str(self.NICE)] + super().argv(cmd=cmd, memory_gb=memory_gb)
+
+
+class BatchExecutor(Executor):
+    """
+    Submits each command as a job script to a batch scheduler (Slurm by default),
+    requesting the reserved cores and memory, and polls the queue until the job has left it
+
+    The job script writes its exit code to a file when the command is done,
+    so the workdir, outdir and `jobdir` must be on a filesystem shared with the compute nodes.
+    Commands run in the current working directory, since paths of the pipeline may be relative to it.
+
+    submit_cmd: prints the job ID, given the job script as the last argument
+    queue_cmd: prints the job while it is queued or running, with '{job_id}' to be filled in
+    cancel_cmd: cancels a job, with '{job_id}' to be filled in
+    """
+
+    SUBMIT_CMD = 'sbatch --parsable'
+    QUEUE_CMD = 'squeue --noheader --jobs {job_id}'
+    CANCEL_CMD = 'scancel {job_id}'
+    EXIT_CODE_TIMEOUT_SECONDS = 60.  # for the exit code file to show up on the shared filesystem
+
+    jobdir: str
+    options: str
+    poll_seconds: float
+    submit_cmd: str
+    queue_cmd: str
+    cancel_cmd: str
+
+    count: int
+    lock: threading.Lock
+
+    def __init__(
+            self,
+            jobdir: str,
+            options: str = '',
+            poll_seconds: float = 10.,
+            submit_cmd: str = SUBMIT_CMD,
+            queue_cmd: str = QUEUE_CMD,
+            cancel_cmd: str = CANCEL_CMD):
+
+        self.jobdir = jobdir
+        self.options = options
+        self.poll_seconds = poll_seconds
+        self.submit_cmd = submit_cmd
+        self.queue_cmd = queue_cmd
+        self.cancel_cmd = cancel_cmd
+
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def run(self, cmd: str, cores: int, memory_gb: float) -> Execution:
+        start, t0 = datetime.now(), time.time()
+
+        script = self.write_job_script(cmd=cmd, cores=cores, memory_gb=memory_gb)
+        job_id = self.submit(script=script)
+        try:
+            while self.is_queued(job_id=job_id):
+                time.sleep(self.poll_seconds)
+        except BaseException:  # e.g. KeyboardInterrupt, so that the job does not outlive the pipeline
+            subprocess.run(['bash', '-c', self.cancel_cmd.format(job_id=job_id)])
+            raise
+
+        user_seconds, sys_seconds = self.read_times(f'{script[:-len(".sh")]}.times')
+        return Execution(
+            returncode=self.read_exit_code(f'{script[:-len(".sh")]}.exitcode'),
+            start=str(start),
+            wall_seconds=time.time() - t0,
+            user_seconds=user_seconds,
+            sys_seconds=sys_seconds)
+
+    def write_job_script(self, cmd: str, cores: int, memory_gb: float) -> str:
+        os.makedirs(self.jobdir, exist_ok=True)
+        with self.lock:
+            self.count += 1
+            name = f'job-{self.count:04}'
+        prefix = f'{self.jobdir}/{name}'
+
+        for f in [f'{prefix}.exitcode', f'{prefix}.times']:  # left by a previous run in the same jobdir
+            if os.path.exists(f):
+                os.remove(f)
+
+        lines = [
+            '#!/bin/bash',
+            f'#SBATCH --job-name=chip-seq-{name}',
+            f'#SBATCH --cpus-per-task={cores}',
+            f'#SBATCH --mem={max(1, int(memory_gb * 1024))}M',
+            f'#SBATCH --output={prefix}.out',
+            'set -o pipefail',
+            f'cd {os.getcwd()}',
+            f'(\n{cmd}\n)',  # in a subshell, so that the exit code is written even if the command exits
+            'status=$?',
+            f'times > {prefix}.times',  # user and system time of the shell, then of its child processes
+            f'echo $status > {prefix}.exitcode.tmp && mv {prefix}.exitcode.tmp {prefix}.exitcode',
+        ]
+        with open(f'{prefix}.sh', 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+        return f'{prefix}.sh'
+
+    def submit(self, script: str) -> str:
+        p = subprocess.run(
+            ['bash', '-c', f'{self.submit_cmd} {self.options} {script}'],
+            stdout=subprocess.PIPE,
+            check=True)
+        return p.stdout.decode().strip().split(';')[0]  # sbatch --parsable prints '<job_id>[;<cluster>]'
+
+    def is_queued(self, job_id: str) -> bool:
+        p = subprocess.run(
+            ['bash', '-c', self.queue_cmd.format(job_id=job_id)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL)  # squeue fails for jobs that have left the queue long ago
+        return p.returncode == 0 and job_id in p.stdout.decode()
+
+    def read_exit_code(self, path: str) -> int:
+        """
+        A job that left the queue without an exit code, e.g. cancelled or out of memory, is a failure
+        """
+        t0 = time.time()
+        while not os.path.exists(path):
+            if time.time() - t0 > self.EXIT_CODE_TIMEOUT_SECONDS:
+                return 1
+            time.sleep(1)
+        with open(path) as fh:
+            return int(fh.read().strip())
+
+    def read_times(self, path: str) -> List[float]:
+        """
+        Child processes line of the bash builtin `times`, e.g. '1m2.500s 0m0.250s' -> [62.5, 0.25]
+        """
+        if not os.path.exists(path):
+            return [0., 0.]
+        with open(path) as fh:
+            lines = fh.read().strip().splitlines()
+        values = [int(m) * 60 + float(s) for m, s in re.findall(r'(\d+)m([\d.]+)s', lines[-1] if lines else '')]
+        return values if len(values) == 2 else [0., 0.]
+
+
+def get_executor(
+        name: str,
+        threads: int,
+        max_jobs: int,
+        max_job_memory_gb: Optional[float],
+        jobdir: str,
+        slurm_options: str) -> Executor:
+    """
+    name: 'local', 'pool' or 'slurm'
+    max_jobs: for 'pool', 0 for `threads`
+    """
+    name = name.lower()
+    assert name in ['local', 'pool', 'slurm']
+
+    if name == 'pool':
+        return PoolExecutor(
+            max_jobs=threads if max_jobs == 0 else max_jobs,
+            max_job_memory_gb=max_job_memory_gb)
+    if name == 'slurm':
+        return BatchExecutor(jobdir=jobdir, options=slurm_options)
+    return LocalExecutor()
@@ -0,0 +1,128 @@
+import os
+import re
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional, IO
+from .template import Processor
+from .bgzf import open_bgzf
+
+
+LANE_PATTERN = re.compile(r'_(L\d{3})_')
+
+
+class SplitFastqPair(Processor):
+    """
+    Splits a pair of fastq files into chunks by streaming, without loading the reads into memory
+
+    Blocks of read pairs are dealt to the chunks in turn, so that read 1 and read 2 files of a chunk stay paired.
+    A chunk that gets no reads (e.g. a small library split into many chunks) is None.
+
+    Chunks are written as BGZF, compressed by a thread pool shared by all chunk files.
+    """
+
+    READS_PER_BLOCK = 100_000
+    COMPRESS_LEVEL = 1  # chunks are intermediate files, faster compression matters more than size
+
+    fq1: str
+    fq2: str
+    chunks: int
+    dstdir: str
+
+    chunk_fqs: List[Tuple[str, str]]
+    chunk_reads: List[int]
+
+    def main(
+            self,
+            fq1: str,
+            fq2: str,
+            chunks: int,
+            dstdir: str) -> List[Optional[Tuple[str, str]]]:
+
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.chunks = chunks
+        self.dstdir = dstdir
+
+        self.set_chunk_fqs()
+        with self.reserve_cores(self.threads) as cores, self.profile():
+            self.split(cores=cores)
+
+        return [fqs if n > 0 else None for fqs, n in zip(self.chunk_fqs, self.chunk_reads)]
+
+    def set_chunk_fqs(self):
+        os.makedirs(self.dstdir, exist_ok=True)
+        self.chunk_fqs = [
+            (f'{self.dstdir}/chunk-{i + 1}_R1.fq.gz', f'{self.dstdir}/chunk-{i + 1}_R2.fq.gz')
+            for i in range(self.chunks)
+        ]
+
+    def split(self, cores: int):
+        self.chunk_reads = [0] * self.chunks
+        pool = ThreadPoolExecutor(max_workers=cores)
+        outs = [
+            (
+                open_bgzf(r1, 'wb', threads=cores, level=self.COMPRESS_LEVEL, pool=pool),
+                open_bgzf(r2, 'wb', threads=cores, level=self.COMPRESS_LEVEL, pool=pool)
+            )
+            for r1, r2 in self.chunk_fqs
+        ]
+        try:
+            with open_fastq(self.fq1, threads=cores, pool=pool) as in1, \
+                    open_fastq(self.fq2, threads=cores, pool=pool) as in2:
+                i = 0
+                while True:
+                    block1 = list(islice(in1, 4 * self.READS_PER_BLOCK))
+                    block2 = list(islice(in2, 4 * self.READS_PER_BLOCK))
+                    assert len(block1) == len(block2), \
+                        f'Different numbers of reads in "{self.fq1}" and "{self.fq2}"'
+                    if len(block1) == 0:
+                        break
+                    out1, out2 = outs[i % self.chunks]
+                    out1.writelines(block1)
+                    out2.writelines(block2)
+                    self.chunk_reads[i % self.chunks] += len(block1) // 4
+                    i += 1
+        finally:
+            for out1, out2 in outs:
+                out1.close()
+                out2.close()
+            pool.shutdown()
+
+
+def open_fastq(path: str, threads: int = 1, pool: Optional[ThreadPoolExecutor] = None) -> IO[bytes]:
+    """
+    Gzip (BGZF or plain) or uncompressed fastq, told apart by content rather than the file extension
+    """
+    return open_bgzf(path, 'rb', threads=threads, pool=pool)
+
+
+def split_paths(fqs: str) -> List[str]:
+    """
+    Comma-separated fastq files, e.g. lanes of one sample
+    """
+    return [fq.strip() for fq in fqs.split(',') if fq.strip() != '']
+
+
+def get_lanes(fq1: str, fq2: str) -> List[Tuple[str, str, str]]:
+    """
+    Pairs comma-separated read 1 and read 2 fastq files into lanes of (lane name, fq1, fq2), in the given order
+
+    Lanes are named by the Illumina lane number in the file name (e.g. "L001" of "S1_L001_R1_001.fastq.gz"),
+    or by their order ("lane-1", "lane-2", ...) if lane numbers are missing or not unique
+    """
+    fq1s, fq2s = split_paths(fq1), split_paths(fq2)
+    assert len(fq1s) == len(fq2s), \
+        f'Different numbers of read 1 ({len(fq1s)}) and read 2 ({len(fq2s)}) fastq files: "{fq1}", "{fq2}"'
+
+    basenames = [os.path.basename(fq) for fq in fq1s + fq2s]
+    assert len(set(basenames)) == len(basenames), \
+        f'Fastq files of different lanes should have different file names: "{fq1}", "{fq2}"'
+
+    names = []
+    for fq in fq1s:
+        match = LANE_PATTERN.search(os.path.basename(fq))
+        names.append(None if match is None else match.group(1))
+    if None in names or len(set(names)) < len(names):
+        names = [f'lane-{i + 1}' for i in range(len(fq1s))]
+
+    return list(zip(names, fq1s, fq2s))
@@ -0,0 +1,154 @@
+import json
+import math
+import random
+from collections import Counter
+from typing import List, Tuple, Dict, Any, Optional
+from .template import Processor
+from .tools import edit_fpath
+
+
+class EstimateFragmentSize(Processor):
+    """
+    Estimates the fragment (insert) size of a paired-end BAM from the template lengths of properly paired reads,
+    sampled from random regions through the BAM index rather than by reading the whole BAM
+
+    The median of the sampled fragment sizes is the estimate, which is written to the outdir along with
+    a summary (JSON) and the distribution (TSV), e.g. fragment-size-treatment.json and fragment-size-treatment.tsv
+    """
+
+    REGIONS = 100
+    REGION_SIZE = 100_000
+    MIN_PAIRS = 1000  # otherwise the whole BAM is subsampled instead of regions
+    MAX_PAIRS = 100_000  # pairs subsampled from the whole BAM
+    MIN_MAPQ = 10
+    MAX_FRAGMENT_SIZE = 2000  # longer ones are taken as artifacts, e.g. of structural variants
+    DEFAULT_FRAGMENT_SIZE = 150  # if no fragment is sampled
+    REQUIRED_FLAGS = 0x1 | 0x2 | 0x40  # paired, proper pair, read 1, so that each pair counts once
+    EXCLUDED_FLAGS = 0x4 | 0x8 | 0x100 | 0x200 | 0x400 | 0x800  # unmapped, secondary, QC fail, duplicate, ...
+    SEED = 0
+
+    bam: str
+    name: str
+
+    idxstats: List[Tuple[str, int, int]]
+    method: str
+    fragment_sizes: Counter
+    summary: Dict[str, Any]
+
+    def main(self, bam: str, name: str) -> int:
+        self.bam = bam
+        self.name = name
+
+        self.set_idxstats()
+        self.sample_regions()
+        if sum(self.fragment_sizes.values()) < self.MIN_PAIRS:
+            self.subsample_bam()
+        self.set_summary()
+        self.write_summary()
+
+        return self.summary['fragment_size']
+
+    def set_idxstats(self):
+        txt = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-idxstats.txt', dstdir=self.workdir)
+        self.call(f'samtools idxstats {self.bam} > {txt}')
+        self.idxstats = []
+        with open(txt) as fh:
+            for line in fh:
+                chrom, length, mapped, _ = line.rstrip('\n').split('\t')
+                if chrom != '*' and int(mapped) > 0:
+                    self.idxstats.append((chrom, int(length), int(mapped)))
+
+    def sample_regions(self):
+        """
+        Regions are drawn at random, with chromosomes weighted by their mapped reads,
+        and with a fixed seed so that the estimate of the same BAM is the same
+        """
+        rng = random.Random(self.SEED)
+        regions = []
+        if len(self.idxstats) > 0:
+            chroms = rng.choices(self.idxstats, weights=[m for _, _, m in self.idxstats], k=self.REGIONS)
+            for chrom, length, _ in chroms:
+                start = rng.randint(1, max(1, length - self.REGION_SIZE + 1))
+                end = min(length, start + self.REGION_SIZE - 1)
+                regions.append(f'{chrom}:{start}-{end}')
+        self.method = 'regions'
+        self.fragment_sizes = self.read_fragment_sizes(regions=sorted(set(regions)), subsample=None)
+
+    def subsample_bam(self):
+        """
+        Too few pairs in the regions, e.g. a small or sparse BAM, so a fraction of all reads is read instead
+        """
+        pairs = sum(m for _, _, m in self.idxstats) // 2
+        fraction = self.MAX_PAIRS / pairs if pairs > 0 else 1.
+        self.method = 'whole BAM' if fraction >= 1 else 'subsampled BAM'
+        self.fragment_sizes = self.read_fragment_sizes(regions=[], subsample=fraction if fraction < 1 else None)
+
+    def read_fragment_sizes(self, regions: List[str], subsample: Optional[float]) -> Counter:
+        txt = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-template-lengths.txt', dstdir=self.workdir)
+        args = [
+            'samtools view',
+            f'-f {self.REQUIRED_FLAGS}',
+            f'-F {self.EXCLUDED_FLAGS}',
+            f'-q {self.MIN_MAPQ}',
+        ]
+        if subsample is not None:
+            args.append(f'-s {self.SEED + subsample:.6f}')  # integer part: seed, fractional part: fraction
+        args += [self.bam] + regions
+        self.call(' | '.join([self.CMD_LINEBREAK.join(args), f'cut -f 9 > {txt}']))
+
+        ret = Counter()
+        with self.profile(), open(txt) as fh:
+            for line in fh:
+                size = abs(int(line))
+                if 0 < size <= self.MAX_FRAGMENT_SIZE:
+                    ret[size] += 1
+        return ret
+
+    def set_summary(self):
+        pairs = sum(self.fragment_sizes.values())
+        self.summary = {
+            'bam': self.bam,
+            'method': self.method,
+            'sampled_pairs': pairs,
+            'estimated': pairs > 0,
+            'fragment_size': self.DEFAULT_FRAGMENT_SIZE,
+        }
+        if pairs == 0:
+            self.logger.info(f'No properly paired reads sampled from "{self.bam}", '
+                             f'fragment size is the default {self.DEFAULT_FRAGMENT_SIZE}')
+            return
+
+        sizes = sorted(self.fragment_sizes.items())
+        mean = sum(s * n for s, n in sizes) / pairs
+        sd = math.sqrt(sum(n * (s - mean) ** 2 for s, n in sizes) / pairs)
+        median = percentile(sizes=sizes, pairs=pairs, q=0.5)
+        self.summary.update({
+            'fragment_size': median,
+            'median': median,
+            'mean': round(mean, 1),
+            'sd': round(sd, 1),
+            'mode': max(sizes, key=lambda x: (x[1], -x[0]))[0],
+            'percentile_5': percentile(sizes=sizes, pairs=pairs, q=0.05),
+            'percentile_95': percentile(sizes=sizes, pairs=pairs, q=0.95),
+        })
+
+    def write_summary(self):
+        with open(f'{self.outdir}/fragment-size-{self.name}.json', 'w') as fh:
+            json.dump(self.summary, fh, indent=2)
+        with open(f'{self.outdir}/fragment-size-{self.name}.tsv', 'w') as fh:
+            fh.write('fragment_size\tpairs\n')
+            for size, n in sorted(self.fragment_sizes.items()):
+                fh.write(f'{size}\t{n}\n')
+        self.logger.info(f'Fragment size of "{self.bam}": {self.summary["fragment_size"]}')
+
+
+def percentile(sizes: List[Tuple[int, int]], pairs: int, q: float) -> int:
+    """
+    sizes: sorted (fragment size, number of pairs)
+    """
+    rank = max(1, math.ceil(q * pairs))
+    cumulative = 0
+    for size, n in sizes:
+        cumulative += n
+        if cumulative >= rank:
+            return size
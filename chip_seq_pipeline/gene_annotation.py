@@ -0,0 +1,332 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import List, Dict, Tuple
+from .bgzf import open_bgzf
+
+
+PROMOTER = 'promoter-TSS'
+TTS = 'TTS'
+EXON = 'exon'
+UTR5 = "5' UTR"
+UTR3 = "3' UTR"
+NON_CODING = 'non-coding'
+INTRON = 'intron'
+INTERGENIC = 'Intergenic'
+
+CATEGORIES = [PROMOTER, TTS, EXON, UTR5, UTR3, NON_CODING, INTRON]  # in the order of priority of annotatePeaks.pl
+
+PROMOTER_UPSTREAM, PROMOTER_DOWNSTREAM = 1000, 100  # promoter-TSS from -1 kb to +100 bp of the TSS, as HOMER
+TTS_UPSTREAM, TTS_DOWNSTREAM = 100, 1000  # TTS from -100 bp to +1 kb of the transcription end site, as HOMER
+
+
+class IntervalIndex:
+    """
+    Intervals of one category (e.g. introns) by chromosome, as NumPy arrays sorted by start,
+    with the running maximum of ends and the interval that reaches it,
+    so that an interval covering each of many positions is found by one binary search (np.searchsorted)
+
+    Where several intervals cover a position, the one reaching furthest is found
+    """
+
+    starts: Dict[str, np.ndarray]
+    max_ends: Dict[str, np.ndarray]
+    max_end_rows: Dict[str, np.ndarray]
+
+    def __init__(self, chroms: List[str], starts: List[int], ends: List[int]):
+        """
+        Intervals are 0-based and half-open as BED, and are referred to by their row (order given)
+        """
+        self.starts, self.max_ends, self.max_end_rows = {}, {}, {}
+        chroms = np.array(chroms, dtype=object)
+        starts, ends = np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+        for chrom in set(chroms):
+            rows = np.flatnonzero(chroms == chrom)
+            rows = rows[np.argsort(starts[rows], kind='stable')]
+            chrom_ends = ends[rows]
+            max_ends = np.maximum.accumulate(chrom_ends)
+            max_end_at = np.maximum.accumulate(np.where(chrom_ends == max_ends, np.arange(len(rows)), 0))
+            self.starts[chrom] = starts[rows]
+            self.max_ends[chrom] = max_ends
+            self.max_end_rows[chrom] = rows[max_end_at]
+
+    def find(self, chrom: str, positions: np.ndarray) -> np.ndarray:
+        """
+        Rows of intervals covering the 0-based positions, -1 if none
+        """
+        if chrom not in self.starts:
+            return np.full(len(positions), -1, dtype=np.int64)
+        i = np.searchsorted(self.starts[chrom], positions, side='right') - 1
+        j = np.clip(i, 0, None)
+        covered = (i >= 0) & (self.max_ends[chrom][j] > positions)
+        return np.where(covered, self.max_end_rows[chrom][j], -1)
+
+
+class GeneAnnotation:
+    """
+    Transcripts of a GTF or UCSC genePred (e.g. refGene.txt) file, indexed for annotating peaks:
+    an IntervalIndex of each category of CATEGORIES, and the TSS of transcripts sorted by chromosome
+    """
+
+    transcript_ids: List[str]
+    gene_names: List[str]
+    gene_types: List[str]
+    strands: np.ndarray  # 1 or -1
+
+    indexes: Dict[str, IntervalIndex]
+    feature_transcripts: Dict[str, np.ndarray]  # category -> transcript of each interval
+    feature_numbers: Dict[str, np.ndarray]  # category -> e.g. 2 of 'exon 2 of 5'
+    feature_totals: Dict[str, np.ndarray]  # category -> e.g. 5 of 'exon 2 of 5'
+
+    tss: Dict[str, np.ndarray]  # chromosome -> sorted TSS
+    tss_transcripts: Dict[str, np.ndarray]
+
+    def __init__(self, transcripts: pd.DataFrame):
+        """
+        transcripts: columns chrom, strand, tx_start, tx_end, cds_start, cds_end, exons, transcript_id, gene_name, gene_type,
+            with 0-based half-open coordinates, exons as a sorted list of (start, end), and cds_start == cds_end if non-coding
+        """
+        self.transcript_ids = list(transcripts['transcript_id'])
+        self.gene_names = list(transcripts['gene_name'])
+        self.gene_types = list(transcripts['gene_type'])
+        self.strands = np.where(transcripts['strand'] == '-', -1, 1)
+        self.set_features(transcripts=transcripts)
+        self.set_tss(transcripts=transcripts)
+
+    def set_features(self, transcripts: pd.DataFrame):
+        features = {c: ([], [], [], [], [], []) for c in CATEGORIES}  # chroms, starts, ends, transcripts, numbers, totals
+
+        def add(category: str, chrom: str, start: int, end: int, transcript: int, number: int, total: int):
+            if end > start:
+                for values, value in zip(features[category], [chrom, max(0, start), end, transcript, number, total]):
+                    values.append(value)
+
+        for t, (chrom, strand, tx_start, tx_end, cds_start, cds_end, exons) in enumerate(zip(
+                transcripts['chrom'], transcripts['strand'], transcripts['tx_start'], transcripts['tx_end'],
+                transcripts['cds_start'], transcripts['cds_end'], transcripts['exons'])):
+            forward = strand != '-'
+            tss, tes = (tx_start, tx_end - 1) if forward else (tx_end - 1, tx_start)
+            if forward:
+                add(PROMOTER, chrom, tss - PROMOTER_UPSTREAM, tss + PROMOTER_DOWNSTREAM + 1, t, 0, 0)
+                add(TTS, chrom, tes - TTS_UPSTREAM, tes + TTS_DOWNSTREAM + 1, t, 0, 0)
+            else:
+                add(PROMOTER, chrom, tss - PROMOTER_DOWNSTREAM, tss + PROMOTER_UPSTREAM + 1, t, 0, 0)
+                add(TTS, chrom, tes - TTS_DOWNSTREAM, tes + TTS_UPSTREAM + 1, t, 0, 0)
+
+            n = len(exons)
+            coding = cds_start < cds_end
+            upstream_utr, downstream_utr = (UTR5, UTR3) if forward else (UTR3, UTR5)
+            for i, (start, end) in enumerate(exons):
+                number = i + 1 if forward else n - i
+                if not coding:
+                    add(NON_CODING, chrom, start, end, t, number, n)
+                    continue
+                add(upstream_utr, chrom, start, min(end, cds_start), t, number, n)
+                add(EXON, chrom, max(start, cds_start), min(end, cds_end), t, number, n)
+                add(downstream_utr, chrom, max(start, cds_end), end, t, number, n)
+
+            for i in range(n - 1):
+                number = i + 1 if forward else n - 1 - i
+                add(INTRON, chrom, exons[i][1], exons[i + 1][0], t, number, n - 1)
+
+        self.indexes, self.feature_transcripts, self.feature_numbers, self.feature_totals = {}, {}, {}, {}
+        for category, (chroms, starts, ends, transcripts_, numbers, totals) in features.items():
+            self.indexes[category] = IntervalIndex(chroms=chroms, starts=starts, ends=ends)
+            self.feature_transcripts[category] = np.array(transcripts_, dtype=np.int64)
+            self.feature_numbers[category] = np.array(numbers, dtype=np.int64)
+            self.feature_totals[category] = np.array(totals, dtype=np.int64)
+
+    def set_tss(self, transcripts: pd.DataFrame):
+        tss = np.where(self.strands == 1, transcripts['tx_start'], transcripts['tx_end'] - 1)
+        chroms = transcripts['chrom'].to_numpy()
+        self.tss, self.tss_transcripts = {}, {}
+        for chrom in set(chroms):
+            rows = np.flatnonzero(chroms == chrom)
+            rows = rows[np.argsort(tss[rows], kind='stable')]
+            self.tss[chrom] = tss[rows]
+            self.tss_transcripts[chrom] = rows
+
+    def nearest_tss(self, chrom: str, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Transcripts of the nearest TSS of the 0-based positions (-1 if none on the chromosome),
+        and the distances to them, negative upstream and positive downstream of the TSS, as annotatePeaks.pl
+        """
+        if chrom not in self.tss:
+            return np.full(len(positions), -1, dtype=np.int64), np.zeros(len(positions), dtype=np.int64)
+        tss = self.tss[chrom]
+        right = np.clip(np.searchsorted(tss, positions), 0, len(tss) - 1)
+        left = np.clip(right - 1, 0, None)
+        nearest = np.where(np.abs(positions - tss[left]) <= np.abs(tss[right] - positions), left, right)
+        transcripts = self.tss_transcripts[chrom][nearest]
+        distances = (positions - tss[nearest]) * self.strands[transcripts]
+        return transcripts, distances
+
+    def annotate(self, chrom: str, positions: np.ndarray) -> List[str]:
+        """
+        Annotations of the 0-based positions, e.g. 'intron (NM_001, intron 2 of 5)', by the category of first priority
+        """
+        ret = [INTERGENIC] * len(positions)
+        pending = np.arange(len(positions))
+        for category in CATEGORIES:
+            if len(pending) == 0:
+                break
+            rows = self.indexes[category].find(chrom=chrom, positions=positions[pending])
+            for p, row in zip(pending[rows >= 0], rows[rows >= 0]):
+                ret[p] = self.feature_label(category=category, row=row)
+            pending = pending[rows < 0]
+        return ret
+
+    def feature_label(self, category: str, row: int) -> str:
+        transcript_id = self.transcript_ids[self.feature_transcripts[category][row]]
+        if category in [PROMOTER, TTS]:
+            return f'{category} ({transcript_id})'
+        kind = INTRON if category == INTRON else EXON
+        number, total = self.feature_numbers[category][row], self.feature_totals[category][row]
+        return f'{category} ({transcript_id}, {kind} {number} of {total})'
+
+
+LOCK = threading.Lock()
+
+
+def load_gene_annotation(path: str) -> GeneAnnotation:
+    """
+    The gene annotation of a run is loaded and indexed once, and shared by all peak files (and samples) of the run
+    """
+    with LOCK:
+        return _load_gene_annotation(os.path.abspath(path), os.path.getmtime(path))
+
+
+@lru_cache(maxsize=1)
+def _load_gene_annotation(path: str, mtime: float) -> GeneAnnotation:
+    is_gtf = path.endswith(('.gtf', '.gtf.gz'))
+    transcripts = read_gtf(gtf=path) if is_gtf else read_gene_pred(gene_pred=path)
+    return GeneAnnotation(transcripts=transcripts)
+
+
+def read_gtf(gtf: str) -> pd.DataFrame:
+    """
+    Transcripts of the exon and CDS records of a GTF(.gz), e.g. of GENCODE or Ensembl
+    """
+    df = pd.read_csv(
+        gtf,
+        sep='\t',
+        comment='#',
+        header=None,
+        usecols=[0, 2, 3, 4, 6, 8],
+        names=['chrom', 'feature', 'start', 'end', 'strand', 'attributes'],
+        dtype={'chrom': str, 'feature': str, 'start': np.int64, 'end': np.int64, 'strand': str, 'attributes': str})
+    df = df[df['feature'].isin(['exon', 'CDS', 'stop_codon'])].copy()
+    df['start'] -= 1  # 1-based to 0-based
+    df['transcript_id'] = df['attributes'].str.extract(r'transcript_id "([^"]+)"', expand=False)
+    df = df.dropna(subset=['transcript_id'])
+
+    exons = df[df['feature'] == 'exon'].sort_values(['transcript_id', 'start'])
+    attributes = exons.groupby('transcript_id', sort=False)['attributes'].first()
+    gene_ids = attributes.str.extract(r'gene_id "([^"]+)"', expand=False)
+    gene_names = attributes.str.extract(r'gene_name "([^"]+)"', expand=False).fillna(gene_ids)
+    gene_types = attributes.str.extract(r'(?:gene_type|gene_biotype) "([^"]+)"', expand=False).fillna('')
+
+    transcripts = exons.groupby('transcript_id', sort=False).agg(
+        chrom=('chrom', 'first'), strand=('strand', 'first'), tx_start=('start', 'min'), tx_end=('end', 'max'))
+    ids = exons['transcript_id'].to_numpy()
+    boundaries = np.flatnonzero(ids[1:] != ids[:-1]) + 1  # exons are sorted by transcript, as the transcripts
+    transcripts['exons'] = [
+        list(zip(starts.tolist(), ends.tolist())) for starts, ends in zip(
+            np.split(exons['start'].to_numpy(), boundaries), np.split(exons['end'].to_numpy(), boundaries))]
+
+    cds = df[df['feature'] != 'exon'].groupby('transcript_id').agg(cds_start=('start', 'min'), cds_end=('end', 'max'))
+    transcripts = transcripts.join(cds)
+    transcripts['cds_start'] = transcripts['cds_start'].fillna(transcripts['tx_end']).astype(np.int64)
+    transcripts['cds_end'] = transcripts['cds_end'].fillna(transcripts['tx_end']).astype(np.int64)
+    transcripts['gene_name'] = gene_names
+    transcripts['gene_type'] = gene_types
+
+    return transcripts.reset_index()
+
+
+def read_gene_pred(gene_pred: str) -> pd.DataFrame:
+    """
+    Transcripts of a UCSC genePred(.gz) table, e.g. refGene.txt, with or without the leading bin column
+    """
+    rows = []
+    with open_bgzf(gene_pred, 'rt') as fh:
+        for line in fh:
+            if line.startswith('#') or line.strip() == '':
+                continue
+            items = line.rstrip('\n').split('\t')
+            if len(items) in [11, 16] and items[0].isdigit():  # bin column of UCSC tables
+                items = items[1:]
+            name, chrom, strand, tx_start, tx_end, cds_start, cds_end, _, exon_starts, exon_ends = items[:10]
+            starts = [int(s) for s in exon_starts.rstrip(',').split(',')]
+            ends = [int(e) for e in exon_ends.rstrip(',').split(',')]
+            coding = int(cds_start) < int(cds_end)
+            rows.append({
+                'transcript_id': name,
+                'chrom': chrom,
+                'strand': strand,
+                'tx_start': int(tx_start),
+                'tx_end': int(tx_end),
+                'cds_start': int(cds_start) if coding else int(tx_end),
+                'cds_end': int(cds_end) if coding else int(tx_end),
+                'exons': sorted(zip(starts, ends)),
+                'gene_name': items[11] if len(items) > 11 else name,
+                'gene_type': 'protein-coding' if coding else 'ncRNA',
+            })
+    return pd.DataFrame(rows, columns=[
+        'transcript_id', 'chrom', 'strand', 'tx_start', 'tx_end', 'cds_start', 'cds_end', 'exons', 'gene_name', 'gene_type'])
+
+
+def read_peaks(peak_file: str) -> pd.DataFrame:
+    """
+    Peaks of a HOMER peak file (#PeakID header) or a BED-like MACS2 file (narrowPeak, broadPeak),
+    with 1-based starts as annotatePeaks.pl writes them
+    """
+    rows = []
+    is_homer_format = False
+    with open_bgzf(peak_file, 'rt') as fh:
+        for line in fh:
+            if line.startswith('#PeakID'):
+                is_homer_format = True
+            if line.startswith(('#', 'track', 'browser')) or line.strip() == '':
+                continue
+            items = line.rstrip('\n').split('\t')
+            if is_homer_format:  # PeakID, chr, start, end, strand, Normalized Tag Count
+                peak_id, chrom, start, end, strand = items[0], items[1], int(items[2]), int(items[3]), items[4]
+                score = items[5] if len(items) > 5 else ''
+            else:  # chr, start, end, name, score, strand
+                chrom, start, end = items[0], int(items[1]) + 1, int(items[2])
+                peak_id = items[3] if len(items) > 3 else f'{chrom}-{start}'
+                score = items[4] if len(items) > 4 else ''
+                strand = items[5] if len(items) > 5 and items[5] in ['+', '-'] else '+'
+            rows.append({'PeakID': peak_id, 'Chr': chrom, 'Start': start, 'End': end, 'Strand': strand, 'Peak Score': score})
+    return pd.DataFrame(rows, columns=['PeakID', 'Chr', 'Start', 'End', 'Strand', 'Peak Score'])
+
+
+def annotate_peaks(peaks: pd.DataFrame, annotation: GeneAnnotation) -> pd.DataFrame:
+    """
+    Annotates peaks (of read_peaks) by their centers, chromosome by chromosome, in the columns of annotatePeaks.pl:
+    Annotation, Detailed Annotation, Distance to TSS, Nearest PromoterID, Gene Name, Gene Type
+    """
+    ret = peaks.copy()
+    annotations = [''] * len(peaks)
+    distances = np.zeros(len(peaks), dtype=np.int64)
+    nearest = np.full(len(peaks), -1, dtype=np.int64)
+
+    centers = ((peaks['Start'].to_numpy(dtype=np.int64) + peaks['End'].to_numpy(dtype=np.int64)) // 2) - 1  # 0-based
+    chroms = peaks['Chr'].to_numpy()
+    for chrom in pd.unique(chroms):
+        rows = np.flatnonzero(chroms == chrom)
+        for row, a in zip(rows, annotation.annotate(chrom=chrom, positions=centers[rows])):
+            annotations[row] = a
+        nearest[rows], distances[rows] = annotation.nearest_tss(chrom=chrom, positions=centers[rows])
+
+    found = nearest >= 0
+    ret['Annotation'] = annotations
+    ret['Detailed Annotation'] = annotations
+    ret['Distance to TSS'] = [str(d) if f else 'NA' for d, f in zip(distances, found)]
+    ret['Nearest PromoterID'] = [annotation.transcript_ids[t] if t >= 0 else '' for t in nearest]
+    ret['Gene Name'] = [annotation.gene_names[t] if t >= 0 else '' for t in nearest]
+    ret['Gene Type'] = [annotation.gene_types[t] if t >= 0 else '' for t in nearest]
+    return ret
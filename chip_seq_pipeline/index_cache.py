@@ -0,0 +1,202 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+from datetime import datetime
+from typing import Callable, Optional, IO
+from .template import Processor
+from .tools import UNKNOWN_VERSION
+
+
+class IndexCache(Processor):
+    """
+    A persistent, content-addressed cache of aligner indexes shared by many runs
+
+    Each entry lives in `{cache_dir}/{aligner}-{key}/`, where the key is derived from
+    the SHA-256 of the reference FASTA content plus the aligner name and version.
+    Entries are built in a temporary directory and renamed into place under an exclusive lock,
+    and least-recently-used entries are evicted when the cache grows over `max_gb`.
+
+    The entry returned by main() is held by a shared lock, which protects it from eviction by other runs,
+    until release() is called once the index is no longer used, e.g. after all reads are aligned
+    """
+
+    HASH_CHUNK_SIZE = 16 * 1024 * 1024
+    KEY_LENGTH = 16
+    INDEX_PREFIX = 'index'
+    COMPLETE_FLAG = 'COMPLETE'  # mtime of this file is the last time the entry was used
+    INFO_JSON = 'info.json'
+
+    ref_fa: str
+    aligner: str
+    version: str
+    build: Callable[[str], None]
+    cache_dir: str
+    max_gb: float
+
+    key: str
+    entry_dir: str
+    lock_file: str
+    held_lock: Optional[IO]
+
+    def main(
+            self,
+            ref_fa: str,
+            aligner: str,
+            version: str,
+            build: Callable[[str], None],
+            cache_dir: str,
+            max_gb: float) -> str:
+        """
+        version: of the aligner, which the key depends on, so it must be known
+        """
+
+        self.ref_fa = ref_fa
+        self.aligner = aligner
+        self.version = version
+        self.build = build
+        self.cache_dir = cache_dir
+        self.max_gb = max_gb
+        self.held_lock = None
+
+        assert version != UNKNOWN_VERSION, \
+            f'Version of {aligner} is unknown, which the index cache key depends on'
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.set_key()
+        self.use_or_build_entry()
+        self.evict_least_recently_used()
+
+        return f'{self.entry_dir}/{self.INDEX_PREFIX}'
+
+    def set_key(self):
+        sha256 = hashlib.sha256()
+        with open(self.ref_fa, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(self.HASH_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        fasta_hash = sha256.hexdigest()
+
+        key = f'{fasta_hash}\t{self.aligner}\t{self.version}'.encode()
+        self.key = hashlib.sha256(key).hexdigest()[:self.KEY_LENGTH]
+        self.entry_dir = f'{self.cache_dir}/{self.aligner}-{self.key}'
+        self.lock_file = f'{self.entry_dir}.lock'
+
+        self.logger.info(f'Index cache key of "{self.ref_fa}" for {self.aligner} {self.version}: {self.key}')
+
+    def use_or_build_entry(self):
+        fh = open_lock(path=self.lock_file, operation=fcntl.LOCK_SH)
+        try:
+            if not is_complete(entry_dir=self.entry_dir):
+                fh.close()
+                fh = open_lock(path=self.lock_file, operation=fcntl.LOCK_EX)  # wait for any other process building the same entry
+                if not is_complete(entry_dir=self.entry_dir):
+                    self.build_entry()
+                fcntl.flock(fh, fcntl.LOCK_SH)  # downgrade, so that other runs can use it too
+            else:
+                self.logger.info(f'Reuse cached index: {self.entry_dir}')
+
+            os.utime(f'{self.entry_dir}/{self.COMPLETE_FLAG}')
+        except BaseException:
+            fh.close()  # e.g. a failed build, so that other runs can build the entry
+            raise
+
+        self.held_lock = fh  # protects the entry from eviction while this run is using it
+
+    def release(self):
+        if self.held_lock is not None:
+            self.held_lock.close()
+            self.held_lock = None
+
+    def build_entry(self):
+        tmp_dir = f'{self.cache_dir}/.tmp-{self.aligner}-{self.key}-{os.getpid()}'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        if os.path.exists(self.entry_dir):  # incomplete leftover of a crashed build
+            shutil.rmtree(self.entry_dir)
+        os.makedirs(tmp_dir)
+
+        self.logger.info(f'Build index into cache: {self.entry_dir}')
+        try:
+            self.build(f'{tmp_dir}/{self.INDEX_PREFIX}')
+
+            with open(f'{tmp_dir}/{self.INFO_JSON}', 'w') as fh:
+                json.dump({
+                    'ref_fa': os.path.abspath(self.ref_fa),
+                    'aligner': self.aligner,
+                    'version': self.version,
+                    'created': str(datetime.now()),
+                }, fh, indent=2)
+            open(f'{tmp_dir}/{self.COMPLETE_FLAG}', 'w').close()
+
+            os.rename(tmp_dir, self.entry_dir)
+        finally:
+            if os.path.exists(tmp_dir):  # the build failed
+                shutil.rmtree(tmp_dir)
+
+    def evict_least_recently_used(self):
+        entries = [
+            f'{self.cache_dir}/{d}' for d in os.listdir(self.cache_dir)
+            if not d.startswith('.') and is_complete(entry_dir=f'{self.cache_dir}/{d}')
+        ]
+        entries = sorted(entries, key=lambda d: os.path.getmtime(f'{d}/{self.COMPLETE_FLAG}'))
+
+        total = sum(get_size(d) for d in entries)
+        max_bytes = self.max_gb * 1024 ** 3
+
+        for entry_dir in entries:
+            if total <= max_bytes:
+                break
+            if entry_dir == self.entry_dir:
+                continue
+            size = get_size(entry_dir)
+            if self.try_remove_entry(entry_dir=entry_dir):
+                total -= size
+
+    def try_remove_entry(self, entry_dir: str) -> bool:
+        lock_file = f'{entry_dir}.lock'
+        with open(lock_file, 'a') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # in use by another run
+            if not is_current(fh=fh, path=lock_file):
+                return False  # evicted by another run
+            self.logger.info(f'Evict least recently used index: {entry_dir}')
+            os.remove(f'{entry_dir}/{self.COMPLETE_FLAG}')  # invalidate first, then remove
+            shutil.rmtree(entry_dir)
+            os.remove(lock_file)
+            return True
+
+
+def open_lock(path: str, operation: int) -> IO:
+    """
+    Opens and locks a lock file, again if the file was removed (i.e. its entry evicted) while waiting for the lock,
+    so that the lock is always on the file that other processes open by the path
+    """
+    while True:
+        fh = open(path, 'a')
+        fcntl.flock(fh, operation)
+        if is_current(fh=fh, path=path):
+            return fh
+        fh.close()
+
+
+def is_current(fh: IO, path: str) -> bool:
+    try:
+        return os.fstat(fh.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def is_complete(entry_dir: str) -> bool:
+    return os.path.exists(f'{entry_dir}/{IndexCache.COMPLETE_FLAG}')
+
+
+def get_size(dirpath: str) -> int:
+    size = 0
+    for root, _, files in os.walk(dirpath):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+    return size
@@ -0,0 +1,89 @@
+import os
+import json
+import glob
+import hashlib
+from typing import Any, Dict, Optional
+
+
+class Manifest:
+    """
+    Records what a finished task was computed from, to tell whether it can be skipped when re-run
+
+    The signature of a task consists of its parameters (values), inputs (values and file fingerprints) and tool versions.
+    A task is up to date if its signature is unchanged and its output files still have the recorded fingerprints.
+    """
+
+    json_path: str
+    prefix: bool
+
+    def __init__(self, json_path: str, prefix: bool = False):
+        """
+        prefix: the result is a path prefix of the output files, e.g. an aligner index
+        """
+        self.json_path = json_path
+        self.prefix = prefix
+
+    def matches(self, signature: Dict[str, Any]) -> bool:
+        if not os.path.exists(self.json_path):
+            return False
+        with open(self.json_path) as fh:
+            recorded = json.load(fh)
+        return recorded['signature'] == normalize(signature) \
+            and recorded['outputs'] == normalize(fingerprint(recorded['result'], prefix=self.prefix))
+
+    def result(self) -> Any:
+        with open(self.json_path) as fh:
+            return json.load(fh)['result']
+
+    def write(self, signature: Dict[str, Any], result: Any):
+        os.makedirs(os.path.dirname(self.json_path), exist_ok=True)
+        tmp = f'{self.json_path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({
+                'signature': normalize(signature),
+                'result': normalize(result),
+                'outputs': normalize(fingerprint(result, prefix=self.prefix)),
+            }, fh, indent=2)
+        os.rename(tmp, self.json_path)  # a half-written manifest never matches
+
+
+def fingerprint(value: Any, prefix: bool = False) -> Any:
+    """
+    Replaces paths of files or directories in a (nested) value with their fingerprints, and other values with None
+
+    prefix: paths are prefixes of files, e.g. of an aligner index
+    """
+    if isinstance(value, str):
+        return file_fingerprint(path=value, prefix=prefix)
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(v, prefix=prefix) for v in value]
+    if isinstance(value, dict):
+        return {k: fingerprint(v, prefix=prefix) for k, v in value.items()}
+    return None
+
+
+def file_fingerprint(path: str, prefix: bool = False) -> Optional[str]:
+    """
+    Size and modification time of a file, of all files in a directory,
+    or of all files sharing a prefix (e.g. the bowtie2 index 'bowtie2-index' -> 'bowtie2-index.1.bt2', ...)
+    """
+    if os.path.isfile(path):
+        files = [path]
+    elif os.path.isdir(path):
+        files = [os.path.join(root, f) for root, _, fs in os.walk(path) for f in fs]
+    elif prefix:
+        files = glob.glob(f'{glob.escape(path)}.*')
+    else:
+        files = []
+    if len(files) == 0:
+        return None
+
+    sha1 = hashlib.sha1()
+    for f in sorted(files):
+        stat = os.stat(f)
+        sha1.update(f'{f}\t{stat.st_size}\t{stat.st_mtime_ns}\n'.encode())
+    return sha1.hexdigest()
+
+
+def normalize(value: Any) -> Any:
+    return json.loads(json.dumps(value))  # e.g. tuple -> list
@@ -1,6 +1,57 @@
-from os.path import basename
-from typing import Optional, Tuple
-from .template import Processor
+import os
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Iterator
+from .template import Processor, Settings
+from .index_cache import IndexCache
+from .trimming import TrimmingStream
+from .mark_duplicates import TemplateMarkDuplicates
+from .tools import get_tool_version, edit_fpath, named_pipe
+
+
+def compress_and_index_args(bam: str, threads: int) -> List[str]:
+    """
+    Compresses an uncompressed BAM stream from stdin, writing the .bai index along the way
+    """
+    return [
+        'samtools view',
+        '-b',
+        f'-@ {threads}',
+        '--write-index',
+        f'-o {bam}##idx##{bam}.bai',
+        '-',
+    ]
+
+
+def tee_samtools_stats(pipeline: str, fifo: str, stats_txt: str) -> str:
+    """
+    Combines a pipeline that tees the BAM stream into a named pipe (fifo) with samtools stats reading the fifo,
+    so that the stats are collected while the BAM is being written, rather than by reading the BAM once more
+
+    The fifo is opened as the stdin of samtools stats by the shell, before samtools runs,
+    so that the tee is never blocked on opening the fifo if samtools fails, but fails once samtools exits
+    """
+    return alongside(cmd=pipeline, background=f'samtools stats - < {fifo} > {stats_txt}', name='stats')
+
+
+def alongside(cmd: str, background: str, name: str) -> str:
+    """
+    Runs a background command alongside `cmd`, e.g. a reader of a named pipe that `cmd` writes into,
+    waiting for it if `cmd` succeeds, or killing it otherwise, as it may be blocked on opening the named pipe
+
+    The exit status is that of the failed command, without exiting the shell, so that calls can be nested
+    """
+    return '\n'.join([
+        f'{background} &',
+        f'{name}=$!',
+        f'{{ {cmd}\n}} && wait ${name} || {{ status=$?; kill ${name} 2> /dev/null; (exit $status); }}',
+    ])
+
+
+def fastqc_read_fifo(fifo: str, read: int) -> str:
+    """
+    e.g. 'sorted-treatment-fastqc.fifo' -> 'sorted-treatment-fastqc-1.fifo' for R1
+    """
+    return edit_fpath(fpath=fifo, old_suffix='.fifo', new_suffix=f'-{read}.fifo')
 
 
 class Mapping(Processor):
@@ -15,7 +66,10 @@ class Mapping(Processor):
     control_fq2: Optional[str]
     read_aligner: str
     bowtie2_mode: str
+    index_cache_dir: Optional[str]
+    index_cache_max_gb: float
 
+    index: str
     treatment_bam: str
     control_bam: Optional[str]
 
@@ -27,142 +81,432 @@ class Mapping(Processor):
             control_fq1: Optional[str],
             control_fq2: Optional[str],
             read_aligner: str,
-            bowtie2_mode: str) -> Tuple[str, Optional[str]]:
+            bowtie2_mode: str,
+            index_cache_dir: Optional[str],
+            index_cache_max_gb: float) -> Tuple[str, Optional[str]]:
 
         self.ref_fa = ref_fa
         self.treatment_fq1 = treatment_fq1
         self.treatment_fq2 = treatment_fq2
         self.control_fq1 = control_fq1
         self.control_fq2 = control_fq2
-        self.read_aligner = read_aligner.lower()
-        self.bowtie2_mode = bowtie2_mode.lower()
+        self.read_aligner = read_aligner
+        self.bowtie2_mode = bowtie2_mode
+        self.index_cache_dir = index_cache_dir
+        self.index_cache_max_gb = index_cache_max_gb
+
+        index_builder = BuildIndex(self.settings)
+        self.index = index_builder.main(
+            ref_fa=self.ref_fa,
+            read_aligner=self.read_aligner,
+            index_cache_dir=self.index_cache_dir,
+            index_cache_max_gb=self.index_cache_max_gb)
+        try:
+            self.treatment_bam = self.map_reads(
+                fq1=self.treatment_fq1,
+                fq2=self.treatment_fq2,
+                sample_name=self.TREATMENT)
+            self.control_bam = None if self.control_fq1 is None else self.map_reads(
+                fq1=self.control_fq1,
+                fq2=self.control_fq2,
+                sample_name=self.CONTROL)
+        finally:
+            index_builder.release()
 
-        assert self.read_aligner in ['bowtie2', 'bwa']
+        return self.treatment_bam, self.control_bam
 
-        if self.read_aligner == 'bowtie2':
-            self.run_bowtie2()
-        else:
-            self.run_bwa()
+    def map_reads(self, fq1: str, fq2: str, sample_name: str) -> str:
+        return MapReads(self.settings).main(
+            index=self.index,
+            fq1=fq1,
+            fq2=fq2,
+            read_aligner=self.read_aligner,
+            bowtie2_mode=self.bowtie2_mode,
+            sample_name=sample_name)
 
-        return self.treatment_bam, self.control_bam
 
-    def run_bowtie2(self):
-        index = Bowtie2Indexer(self.settings).main(ref_fa=self.ref_fa)
+class BuildIndex(Processor):
+    """
+    An index from the cache is held (protected from eviction) until release(), which is called once all reads are aligned
+    """
 
-        self.treatment_bam = Bowtie2Mapper(self.settings).main(
-            index=index,
-            fq1=self.treatment_fq1,
-            fq2=self.treatment_fq2,
-            mode=self.bowtie2_mode,
-            sample_name=self.TREATMENT)
+    indexer: Optional['TemplateIndexer']
 
-        if self.control_fq1 is None:
-            self.control_bam = None
-        else:
-            self.control_bam = Bowtie2Mapper(self.settings).main(
-                index=index,
-                fq1=self.control_fq1,
-                fq2=self.control_fq2,
-                mode=self.bowtie2_mode,
-                sample_name=self.CONTROL)
+    def __init__(self, settings: Settings):
+        super().__init__(settings=settings)
+        self.indexer = None
+
+    def main(
+            self,
+            ref_fa: str,
+            read_aligner: str,
+            index_cache_dir: Optional[str],
+            index_cache_max_gb: float) -> str:
+
+        read_aligner = read_aligner.lower()
+        assert read_aligner in ['bowtie2', 'bwa']
+
+        indexer = Bowtie2Indexer if read_aligner == 'bowtie2' else BWAIndexer
+        self.indexer = indexer(self.settings)
+        return self.indexer.main(
+            ref_fa=ref_fa,
+            cache_dir=index_cache_dir,
+            cache_max_gb=index_cache_max_gb)
 
-    def run_bwa(self):
-        index = BWAIndexer(self.settings).main(ref_fa=self.ref_fa)
+    def release(self):
+        if self.indexer is not None:
+            self.indexer.release()
 
-        self.treatment_bam = BWAMapper(self.settings).main(
-            index=index,
-            fq1=self.treatment_fq1,
-            fq2=self.treatment_fq2,
-            sample_name=self.TREATMENT)
 
-        if self.control_fq1 is None:
-            self.control_bam = None
+class MapReads(Processor):
+
+    def main(
+            self,
+            index: str,
+            fq1: str,
+            fq2: str,
+            read_aligner: str,
+            bowtie2_mode: str,
+            sample_name: str,
+            write_stats: bool = True,
+            mark_duplicates: bool = False,
+            trimming: Optional[TrimmingStream] = None,
+            read_group: Optional[Tuple[str, str]] = None) -> str:
+        """
+        write_stats: False for chunks or lanes of a sample, whose stats are written after merging
+        mark_duplicates: mark duplicates with samtools within the stream of alignments,
+            instead of rewriting the sorted BAM in a separate stage
+        trimming: trim the untrimmed fq1 and fq2 in a stream piped into the aligner,
+            instead of reading trimmed fastq files
+        read_group: (ID, SM) of the @RG header line and the RG tag of each read,
+            e.g. for lanes of a sample merged into one BAM
+        """
+
+        read_aligner = read_aligner.lower()
+        assert read_aligner in ['bowtie2', 'bwa']
+
+        if read_aligner == 'bowtie2':
+            return Bowtie2Mapper(self.settings).main(
+                index=index,
+                fq1=fq1,
+                fq2=fq2,
+                mode=bowtie2_mode.lower(),
+                sample_name=sample_name,
+                write_stats=write_stats,
+                mark_duplicates=mark_duplicates,
+                trimming=trimming,
+                read_group=read_group)
         else:
-            self.control_bam = BWAMapper(self.settings).main(
+            return BWAMapper(self.settings).main(
                 index=index,
-                fq1=self.control_fq1,
-                fq2=self.control_fq2,
-                sample_name=self.CONTROL)
+                fq1=fq1,
+                fq2=fq2,
+                sample_name=sample_name,
+                write_stats=write_stats,
+                mark_duplicates=mark_duplicates,
+                trimming=trimming,
+                read_group=read_group)
+
 
+class MergeBams(Processor):
+    """
+    Merges coordinate-sorted BAM files of chunks or lanes of a sample into one sorted and indexed BAM,
+    collecting its stats from the merged stream
 
-class Bowtie2Indexer(Processor):
+    @RG and @PG header lines with the same ID are combined, e.g. of chunks of one lane,
+    rather than made unique by suffixing their IDs
+    """
+
+    bams: List[str]
+    sample_name: str
+
+    sorted_bam: str
+    mapping_stats_txt: str
+
+    def main(self, bams: List[str], sample_name: str) -> str:
+        self.bams = bams
+        self.sample_name = sample_name
+
+        self.sorted_bam = f'{self.workdir}/sorted-{self.sample_name}.bam'
+        self.mapping_stats_txt = f'{self.outdir}/mapping-stats-{self.sample_name}.txt'
+
+        self.merge()
+
+        return self.sorted_bam
+
+    def merge(self):
+        fifo = edit_fpath(fpath=self.sorted_bam, old_suffix='.bam', new_suffix='-stats.fifo')
+        with self.reserve_cores(self.threads) as cores, named_pipe(fifo):
+            merge = [
+                'samtools merge',
+                f'-@ {cores}',
+                '-c',
+                '-p',
+                '-f',
+                '-u',
+                '-o -',
+            ] + self.bams
+            tee = ['tee', fifo]
+            compress = compress_and_index_args(bam=self.sorted_bam, threads=cores)
+            pipeline = ' | '.join(self.CMD_LINEBREAK.join(args) for args in [merge, tee, compress])
+            self.call(tee_samtools_stats(pipeline=pipeline, fifo=fifo, stats_txt=self.mapping_stats_txt))
+
+
+class TemplateIndexer(Processor):
+
+    ALIGNER: str
+    VERSION_CMD: str
 
     ref_fa: str
+    cache_dir: Optional[str]
+    cache_max_gb: float
+
     index: str
+    cache: Optional[IndexCache]
 
-    def main(self, ref_fa: str) -> str:
+    def main(
+            self,
+            ref_fa: str,
+            cache_dir: Optional[str],
+            cache_max_gb: float) -> str:
 
         self.ref_fa = ref_fa
+        self.cache_dir = cache_dir
+        self.cache_max_gb = cache_max_gb
 
-        self.index = f'{self.workdir}/bowtie2-index'
-        log = f'{self.outdir}/bowtie2-build.log'
-        self.call(f'bowtie2-build {self.ref_fa} {self.index} 1> {log} 2> {log}')
+        self.cache = None
+        if self.cache_dir is None:
+            self.index = f'{self.workdir}/{self.ALIGNER}-index'
+            self.build(index=self.index)
+        else:
+            self.cache = IndexCache(self.settings)
+            self.index = self.cache.main(
+                ref_fa=self.ref_fa,
+                aligner=self.ALIGNER,
+                version=get_tool_version(self.VERSION_CMD),
+                build=self.build,
+                cache_dir=self.cache_dir,
+                max_gb=self.cache_max_gb)
 
         return self.index
 
+    def build(self, index: str):
+        pass
 
-class BWAIndexer(Processor):
+    def release(self):
+        if self.cache is not None:
+            self.cache.release()
 
-    ref_fa: str
-    index: str
 
-    def main(self, ref_fa: str) -> str:
-        self.ref_fa = ref_fa
+class Bowtie2Indexer(TemplateIndexer):
+
+    ALIGNER = 'bowtie2'
+    VERSION_CMD = 'bowtie2-build --version'
+
+    def build(self, index: str):
+        log = f'{self.outdir}/bowtie2-build.log'
+        self.call(f'bowtie2-build {self.ref_fa} {index} 1> {log} 2> {log}')
+
+
+class BWAIndexer(TemplateIndexer):
+
+    ALIGNER = 'bwa'
+    VERSION_CMD = 'bwa'  # prints usage with version to stderr
 
-        self.index = f'{self.workdir}/bwa-index'
+    def build(self, index: str):
         log = f'{self.outdir}/bwa-index.log'
         cmd = self.CMD_LINEBREAK.join([
             'bwa index',
-            f'-p {self.index}',
+            f'-p {index}',
             self.ref_fa,
             f'2> {log}',
         ])
         self.call(cmd)
 
-        return self.index
-
 
 class TemplateMapper(Processor):
 
+    ALIGNER_MEMORY_GB: float
+    SORT_MEMORY_GB = 4.  # total memory budget of samtools sort, shared by all sorting threads
+    SORT_MIN_MEMORY_PER_THREAD_MB = 100
+    FASTQC_MEMORY_GB = 0.5
+    TRIM_CORES_DIVISOR = 4  # cutadapt is much lighter than the aligner
+
     index: str
     fq1: str
     fq2: str
     sample_name: str
+    write_stats: bool
+    mark_duplicates: bool
+    trimming: Optional[TrimmingStream]
+    read_group: Optional[Tuple[str, str]]
 
-    index: str
-    sam: str
-    bam: str
     sorted_bam: str
     mapping_stats_txt: str
+    metrics_txt: Optional[str]
+    out_bam: str
 
     def run_workflow(self):
+        assert self.write_stats or not self.mark_duplicates, 'duplicates of a chunk cannot be marked before merging'
         self.set_filenames()
-        self.mapping()
-        self.sam_to_bam()
-        self.sort_bam()
-        self.mapping_stats()
+        self.mapping_and_sorting()
 
     def set_filenames(self):
-        self.sam = f'{self.workdir}/mapped-{self.sample_name}.sam'
-        self.bam = f'{self.workdir}/mapped-{self.sample_name}.bam'
         self.sorted_bam = f'{self.workdir}/sorted-{self.sample_name}.bam'
         self.mapping_stats_txt = f'{self.outdir}/mapping-stats-{self.sample_name}.txt'
+        self.metrics_txt = None
+        self.out_bam = self.sorted_bam
+
+        if self.mark_duplicates:  # same file names as the separate MarkDuplicates stage
+            dstdir = f'{self.outdir}/{TemplateMarkDuplicates.METRICS_DIRNAME}'
+            os.makedirs(dstdir, exist_ok=True)
+            self.metrics_txt = edit_fpath(
+                fpath=self.sorted_bam,
+                old_suffix='.bam',
+                new_suffix='-duplicate-metrics.txt',
+                dstdir=dstdir)
+            self.out_bam = edit_fpath(
+                fpath=self.sorted_bam,
+                old_suffix='.bam',
+                new_suffix='-mark-duplicates.bam')
+
+    def mapping_and_sorting(self):
+        """
+        The aligner writes SAM to stdout, which is streamed into a multi-threaded samtools sort,
+        so that no intermediate SAM or unsorted BAM file is written to disk
+
+        With trimming, the aligner reads interleaved read pairs from cutadapt through stdin,
+        so that trimmed reads are not gzipped to disk and decompressed again
+
+        Except for chunks of a sample, the sorted stream is also teed into samtools stats,
+        and duplicates are marked in the stream (mark_duplicates), with the index written as the BAM is,
+        so that the final BAM is written once and not read again for its stats, duplicates or index
+
+        samtools fixmate adds the mate tags, e.g. MQ, by which FilterBam filters mates together,
+        and ms and MC for duplicate marking, to every BAM, as it needs reads grouped by name,
+        which is how the aligner writes them, so no collating is needed
+        """
+        fastqc_memory_gb = 0. if self.trimming is None else 2 * self.FASTQC_MEMORY_GB  # one FastQC per read
+        with self.reserve_cores(self.threads) as cores, \
+                self.reserve_memory(self.ALIGNER_MEMORY_GB + self.SORT_MEMORY_GB + fastqc_memory_gb) as memory_gb:
+            sort_memory_mb = (memory_gb - self.ALIGNER_MEMORY_GB - fastqc_memory_gb) * 1024
+            memory_per_thread = max(
+                self.SORT_MIN_MEMORY_PER_THREAD_MB,
+                int(sort_memory_mb / cores))
+            sort_args = [
+                'samtools sort',
+                f'-@ {cores}',
+                f'-m {memory_per_thread}M',
+            ]
+
+            fastqc_fifo = edit_fpath(fpath=self.sorted_bam, old_suffix='.bam', new_suffix='-fastqc.fifo')
+            with self.fastqc_pipes(fifo=fastqc_fifo):
+                stages = self.read_stages(threads=cores, fastqc_fifo=fastqc_fifo)
+                stages.append(self.fixmate_args(threads=cores))
+
+                if not self.write_stats:
+                    stages.append(sort_args + [f'-o {self.sorted_bam}', '-'])
+                    cmd = ' | '.join(self.CMD_LINEBREAK.join(args) for args in stages)
+                    self.call(self.with_fastqc(cmd=cmd, fifo=fastqc_fifo))
+                    return
+
+                tmp_prefix = edit_fpath(fpath=self.sorted_bam, old_suffix='.bam', new_suffix='-sort-tmp')
+                sort_args += [f'-T {tmp_prefix}', '-u', '-']
+                fifo = edit_fpath(fpath=self.sorted_bam, old_suffix='.bam', new_suffix='-stats.fifo')
+                with named_pipe(fifo):
+                    stages += [sort_args, ['tee', fifo]]
+                    if self.mark_duplicates:
+                        stages.append(self.markdup_args(threads=cores))
+                    else:
+                        stages.append(compress_and_index_args(bam=self.out_bam, threads=cores))
+                    cmd = tee_samtools_stats(
+                        pipeline=' | '.join(self.CMD_LINEBREAK.join(args) for args in stages),
+                        fifo=fifo,
+                        stats_txt=self.mapping_stats_txt)
+                    self.call(self.with_fastqc(cmd=cmd, fifo=fastqc_fifo))
+
+    def read_stages(self, threads: int, fastqc_fifo: str) -> List[List[str]]:
+        """
+        The aligner, preceded by cutadapt and a tee into the FastQC fifo when trimming in the stream
+        """
+        if self.trimming is None:
+            return [self.aligner_args(threads=threads)]
+        report_dir = f'{self.outdir}/fastqc'
+        os.makedirs(report_dir, exist_ok=True)
+        return [
+            self.trimming.cutadapt_args(cores=max(1, threads // self.TRIM_CORES_DIVISOR), report_dir=report_dir),
+            ['tee', fastqc_fifo],
+            self.aligner_args(threads=threads),
+        ]
 
-    def mapping(self):
-        pass
+    @contextmanager
+    def fastqc_pipes(self, fifo: str) -> Iterator[None]:
+        """
+        The fifo teed from the interleaved stream, and the fifos of R1 and R2 de-interleaved from it
+        """
+        if self.trimming is None:
+            yield
+            return
+        with named_pipe(fifo), named_pipe(fastqc_read_fifo(fifo=fifo, read=1)), \
+                named_pipe(fastqc_read_fifo(fifo=fifo, read=2)):
+            yield
+
+    def with_fastqc(self, cmd: str, fifo: str) -> str:
+        if self.trimming is None:
+            return cmd
+        fifo1, fifo2 = fastqc_read_fifo(fifo=fifo, read=1), fastqc_read_fifo(fifo=fifo, read=2)
+        report_dir = f'{self.outdir}/fastqc'
+        log = f'{self.outdir}/fastqc-{self.sample_name}.log'
+        fastqc1, fastqc2 = [
+            self.trimming.fastqc_args(read=read, fifo=f, report_dir=report_dir, log=log)
+            for read, f in [(1, fifo1), (2, fifo2)]
+        ]
+        deinterleave = self.trimming.deinterleave_args(fifo=fifo, fifo1=fifo1, fifo2=fifo2)
+        # readers are started first, as writing into a fifo blocks until the fifo is opened for reading
+        cmd = alongside(cmd=cmd, background=self.CMD_LINEBREAK.join(deinterleave), name='deinterleave')
+        cmd = alongside(cmd=cmd, background=self.CMD_LINEBREAK.join(fastqc2), name='fastqc2')
+        return alongside(cmd=cmd, background=self.CMD_LINEBREAK.join(fastqc1), name='fastqc1')
 
-    def sam_to_bam(self):
-        self.call(f'samtools view -b -h {self.sam} > {self.bam}')
+    def aligner_args(self, threads: int) -> List[str]:
+        pass
 
-    def sort_bam(self):
-        self.call(f'samtools sort {self.bam} > {self.sorted_bam}')
+    def read_group_fields(self) -> List[str]:
+        """
+        Fields of the @RG header line, with the library named after the sample,
+        so that duplicates are marked across the lanes of a library
+        """
+        if self.read_group is None:
+            return []
+        id_, sample = self.read_group
+        return [f'ID:{id_}', f'SM:{sample}', f'LB:{sample}', 'PL:ILLUMINA']
+
+    def fixmate_args(self, threads: int) -> List[str]:
+        return [
+            'samtools fixmate',
+            f'-@ {threads}',
+            '-m',
+            '-u',
+            '-',
+            '-',
+            f'2>> {self.outdir}/samtools-fixmate.log',
+        ]
 
-    def mapping_stats(self):
-        self.call(f'samtools stats {self.sorted_bam} > {self.mapping_stats_txt}')
+    def markdup_args(self, threads: int) -> List[str]:
+        return [
+            'samtools markdup',
+            f'-@ {threads}',
+            f'-f {self.metrics_txt}',
+            '--write-index',
+            '-',
+            f'{self.out_bam}##idx##{self.out_bam}.bai',
+            f'2>> {self.outdir}/samtools-markdup.log',
+        ]
 
 
 class Bowtie2Mapper(TemplateMapper):
 
+    ALIGNER_MEMORY_GB = 4.  # human genome index
+
     mode: str
 
     def main(
@@ -171,62 +515,89 @@ class Bowtie2Mapper(TemplateMapper):
             fq1: str,
             fq2: str,
             mode: str,
-            sample_name: str) -> str:
+            sample_name: str,
+            write_stats: bool = True,
+            mark_duplicates: bool = False,
+            trimming: Optional[TrimmingStream] = None,
+            read_group: Optional[Tuple[str, str]] = None) -> str:
 
         self.index = index
         self.fq1 = fq1
         self.fq2 = fq2
         self.mode = mode
         self.sample_name = sample_name
+        self.write_stats = write_stats
+        self.mark_duplicates = mark_duplicates
+        self.trimming = trimming
+        self.read_group = read_group
 
         self.run_workflow()
 
-        return self.sorted_bam
+        return self.out_bam
 
-    def mapping(self):
+    def aligner_args(self, threads: int) -> List[str]:
         log = f'{self.outdir}/bowtie2-{self.sample_name}.log'
-        cmd = f'''bowtie2 \\
--x {self.index} \\
--1 {self.fq1} \\
--2 {self.fq2} \\
--S {self.sam} \\
---{self.mode} \\
---no-unal \\
---threads {self.threads} \\
-1> {log} \\
-2> {log}'''
-        self.call(cmd)
+        return [
+            'bowtie2',
+            f'-x {self.index}',
+        ] + (['--interleaved -'] if self.trimming is not None else [f'-1 {self.fq1}', f'-2 {self.fq2}']) + [
+            f'--{self.mode}',
+            '--no-unal',
+            f'--threads {threads}',
+        ] + self.read_group_args() + [
+            f'2> {log}',
+        ]
+
+    def read_group_args(self) -> List[str]:
+        fields = self.read_group_fields()
+        if len(fields) == 0:
+            return []
+        id_field, *others = fields
+        return [f'--rg-id {id_field[len("ID:"):]}'] + [f'--rg {f}' for f in others]
 
 
 class BWAMapper(TemplateMapper):
 
+    ALIGNER_MEMORY_GB = 6.  # human genome index
+
     def main(
             self,
             index: str,
             fq1: str,
             fq2: str,
-            sample_name: str) -> str:
+            sample_name: str,
+            write_stats: bool = True,
+            mark_duplicates: bool = False,
+            trimming: Optional[TrimmingStream] = None,
+            read_group: Optional[Tuple[str, str]] = None) -> str:
 
         self.index = index
         self.fq1 = fq1
         self.fq2 = fq2
         self.sample_name = sample_name
+        self.write_stats = write_stats
+        self.mark_duplicates = mark_duplicates
+        self.trimming = trimming
+        self.read_group = read_group
 
         self.run_workflow()
 
-        return self.sorted_bam
+        return self.out_bam
 
-    def mapping(self):
+    def aligner_args(self, threads: int) -> List[str]:
         log = f'{self.outdir}/bwa-mem-{self.sample_name}.log'
-        args = [
+        return [
             'bwa mem',
-            f'-t {self.threads}',
-            f'-o {self.sam}',
-            self.index,
-            self.fq1,
-            self.fq2,
+            f'-t {threads}',
+        ] + self.read_group_args() + (
+            ['-p', self.index, '-'] if self.trimming is not None else [self.index, self.fq1, self.fq2]
+        ) + [
+            f'2> {log}',
         ]
 
-        args += [f'2> {log}']
-
-        self.call(self.CMD_LINEBREAK.join(args))
+    def read_group_args(self) -> List[str]:
+        fields = self.read_group_fields()
+        if len(fields) == 0:
+            return []
+        line = '\\t'.join(['@RG'] + fields)  # bwa unescapes the tabs
+        return [f"-R '{line}'"]
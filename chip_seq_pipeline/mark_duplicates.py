@@ -8,6 +8,7 @@ class MarkDuplicates(Processor):
 
     treatment_bam: str
     control_bam: Optional[str]
+    engine: str
 
     out_treatment_bam: str
     out_control_bam: Optional[str]
@@ -15,23 +16,40 @@ class MarkDuplicates(Processor):
     def main(
             self,
             treatment_bam: str,
-            control_bam: Optional[str]) -> Tuple[str, Optional[str]]:
+            control_bam: Optional[str],
+            engine: str = 'gatk') -> Tuple[str, Optional[str]]:
 
         self.treatment_bam = treatment_bam
         self.control_bam = control_bam
+        self.engine = engine
 
-        self.out_treatment_bam = GATKMarkDuplicates(self.settings).main(
-            bam=self.treatment_bam)
+        self.out_treatment_bam = MarkBamDuplicates(self.settings).main(
+            bam=self.treatment_bam,
+            engine=self.engine)
 
         self.out_control_bam = None if self.control_bam is None else \
-            GATKMarkDuplicates(self.settings).main(bam=self.control_bam)
+            MarkBamDuplicates(self.settings).main(bam=self.control_bam, engine=self.engine)
 
         return self.out_treatment_bam, self.out_control_bam
 
 
-class GATKMarkDuplicates(Processor):
+class MarkBamDuplicates(Processor):
+
+    ENGINES = ['gatk', 'samtools']
+
+    def main(self, bam: str, engine: str) -> str:
+        engine = engine.lower()
+        assert engine in self.ENGINES
+
+        marker = {
+            'gatk': GATKMarkDuplicates,
+            'samtools': SamtoolsMarkDuplicates,
+        }[engine]
+        return marker(self.settings).main(bam=bam)
+
+
+class TemplateMarkDuplicates(Processor):
 
-    REMOVE_DUPLICATES = 'false'
     METRICS_DIRNAME = 'duplicate-metrics'
 
     bam: str
@@ -62,15 +80,85 @@ class GATKMarkDuplicates(Processor):
             new_suffix='-duplicate-metrics.txt',
             dstdir=dstdir)
 
+    def execute(self):
+        pass
+
+
+class GATKMarkDuplicates(TemplateMarkDuplicates):
+
+    REMOVE_DUPLICATES = 'false'
+    MEMORY_GB = 8.
+    JVM_OVERHEAD_GB = 1.
+
     def execute(self):
         log = f'{self.outdir}/gatk-MarkDuplicates.log'
-        cmd = self.CMD_LINEBREAK.join([
-            'gatk MarkDuplicates',
-            f'--INPUT {self.bam}',
-            f'--METRICS_FILE {self.metrics_txt}',
-            f'--OUTPUT {self.out_bam}',
-            f'--REMOVE_DUPLICATES {self.REMOVE_DUPLICATES}',
-            f'1>> {log}',
-            f'2>> {log}',
-        ])
-        self.call(cmd)
+        with self.reserve_memory(self.MEMORY_GB) as memory_gb:
+            xmx = max(1, int(memory_gb - self.JVM_OVERHEAD_GB))
+            cmd = self.CMD_LINEBREAK.join([
+                f'gatk --java-options "-Xmx{xmx}g" MarkDuplicates',
+                f'--INPUT {self.bam}',
+                f'--METRICS_FILE {self.metrics_txt}',
+                f'--OUTPUT {self.out_bam}',
+                f'--REMOVE_DUPLICATES {self.REMOVE_DUPLICATES}',
+                '--CREATE_INDEX true',  # written as the BAM is, named <out minus .bam>.bai, e.g. sorted-mark-duplicates.bai
+                f'1>> {log}',
+                f'2>> {log}',
+            ])
+            self.call(cmd)
+
+
+class SamtoolsMarkDuplicates(TemplateMarkDuplicates):
+    """
+    samtools markdup needs mate score (ms) and mate cigar (MC) tags from fixmate,
+    which needs reads grouped by name, so the coordinate-sorted BAM is collated and sorted again,
+    all streamed as uncompressed BAM between multi-threaded samtools commands
+    """
+
+    SORT_MEMORY_GB = 4.
+    SORT_MIN_MEMORY_PER_THREAD_MB = 100
+
+    def execute(self):
+        log = f'{self.outdir}/samtools-markdup.log'
+        tmp_prefix = edit_fpath(fpath=self.bam, old_suffix='.bam', new_suffix='-markdup-tmp', dstdir=self.workdir)
+        with self.reserve_cores(self.threads) as cores, \
+                self.reserve_memory(self.SORT_MEMORY_GB) as memory_gb:
+            memory_per_thread = max(self.SORT_MIN_MEMORY_PER_THREAD_MB, int(memory_gb * 1024 / cores))
+            collate = [
+                'samtools collate',
+                f'-@ {cores}',
+                '-O',
+                '-u',
+                self.bam,
+                f'{tmp_prefix}-collate',
+                f'2>> {log}',
+            ]
+            fixmate = [
+                'samtools fixmate',
+                f'-@ {cores}',
+                '-m',
+                '-u',
+                '-',
+                '-',
+                f'2>> {log}',
+            ]
+            sort = [
+                'samtools sort',
+                f'-@ {cores}',
+                f'-m {memory_per_thread}M',
+                f'-T {tmp_prefix}-sort',
+                '-u',
+                '-',
+                f'2>> {log}',
+            ]
+            markdup = [
+                'samtools markdup',
+                f'-@ {cores}',
+                f'-f {self.metrics_txt}',
+                '--write-index',
+                '-',
+                f'{self.out_bam}##idx##{self.out_bam}.bai',
+                f'2>> {log}',
+            ]
+            cmd = ' | '.join(self.CMD_LINEBREAK.join(args) for args in [collate, fixmate, sort, markdup])
+            self.call(cmd)
+
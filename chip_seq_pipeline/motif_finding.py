@@ -2,7 +2,7 @@ import time
 import random
 from typing import List
 from os.path import basename
-from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from .template import Processor
 
 
@@ -16,18 +16,19 @@ class MotifFinding(Processor):
             self,
             peak_files: List[str],
             genome_version: str,
-            fragment_size: int):
+            fragment_size: int) -> List[str]:
 
         self.peak_files = peak_files
         self.genome_version = genome_version
         self.fragment_size = fragment_size
 
-        with Pool(self.threads) as p:
-            p.map(self.find_motifs_genome, self.peak_files)
+        # worker threads reserve cores from the run's budget when calling findMotifsGenome.pl
+        with ThreadPool(self.threads) as p:
+            return p.map(self.find_motifs_genome, self.peak_files)
 
-    def find_motifs_genome(self, peak_file: str):
+    def find_motifs_genome(self, peak_file: str) -> str:
         time.sleep(random.random())  # to avoid concurrent log message
-        FindMotifsGenome(self.settings).main(
+        return FindMotifsGenome(self.settings).main(
             peak_file=peak_file,
             genome_version=self.genome_version,
             fragment_size=self.fragment_size)
@@ -35,15 +36,19 @@ class MotifFinding(Processor):
 
 class FindMotifsGenome(Processor):
 
+    MEMORY_GB = 4.  # genome sequences and background
+
     peak_file: str
     genome_version: str
     fragment_size: int
 
+    motifs_dir: str
+
     def main(
             self,
             peak_file: str,
             genome_version: str,
-            fragment_size: int):
+            fragment_size: int) -> str:
 
         self.peak_file = peak_file
         self.genome_version = genome_version
@@ -52,20 +57,22 @@ class FindMotifsGenome(Processor):
         self.execute()
         self.print_done_msg()
 
+        return self.motifs_dir
+
     def execute(self):
-        outdir = f'{self.peak_file}-findMotifsGenome'
+        self.motifs_dir = f'{self.peak_file}-findMotifsGenome'
         log = f'{self.outdir}/findMotifsGenome-[{basename(self.peak_file)}].log'
         args = [
             f'findMotifsGenome.pl',
             self.peak_file,
             self.genome_version,
-            f'{outdir}',
+            self.motifs_dir,
             f'-size {self.fragment_size}',
             '-mask',
             f'1> {log}',
             f'2> {log}',
         ]
-        self.call(self.CMD_LINEBREAK.join(args))
+        self.call(self.CMD_LINEBREAK.join(args), memory_gb=self.MEMORY_GB)
 
     def print_done_msg(self):
         self.logger.info(f'findMotifsGenome.pl done for: {self.peak_file}')
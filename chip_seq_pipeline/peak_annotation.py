@@ -1,27 +1,52 @@
 import time
 import random
-from typing import List
+from typing import List, Optional
 from os.path import basename
-from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from .template import Processor
+from .gene_annotation import load_gene_annotation, read_peaks, annotate_peaks
 
 
 class PeakAnnotation(Processor):
 
+    ENGINES = ['homer', 'native']
+
     peak_files: List[str]
     genome_version: str
-
-    def main(self, peak_files: List[str], genome_version: str):
+    engine: str
+    gene_annotation: Optional[str]
+
+    def main(
+            self,
+            peak_files: List[str],
+            genome_version: str,
+            engine: str = 'homer',
+            gene_annotation: Optional[str] = None) -> List[str]:
+        """
+        engine: 'homer' for annotatePeaks.pl of the genome_version,
+            or 'native' for the in-process engine (gene_annotation.py) of the gene_annotation file
+        gene_annotation: GTF(.gz) or UCSC genePred (e.g. refGene.txt) file, for the native engine
+        """
 
         self.peak_files = peak_files
         self.genome_version = genome_version
+        self.engine = engine.lower()
+        self.gene_annotation = gene_annotation
 
-        with Pool(self.threads) as p:
-            p.map(self.anntotate_peaks, self.peak_files)
+        assert self.engine in self.ENGINES
+        if self.engine == 'native':
+            assert self.gene_annotation is not None, 'The native peak annotation engine needs a gene annotation file'
+            return NativeAnnotatePeaks(self.settings).main(
+                peak_files=self.peak_files,
+                gene_annotation=self.gene_annotation)
 
-    def anntotate_peaks(self, peak_file: str):
+        # threads share the core budget of the run, each annotatePeaks.pl reserves its own core
+        with ThreadPool(self.threads) as p:
+            return p.map(self.anntotate_peaks, self.peak_files)
+
+    def anntotate_peaks(self, peak_file: str) -> str:
         time.sleep(random.random())  # to avoid concurrent log message
-        AnnotatePeaks(self.settings).main(
+        return AnnotatePeaks(self.settings).main(
             peak_file=peak_file,
             genome_version=self.genome_version)
 
@@ -59,3 +84,38 @@ class AnnotatePeaks(Processor):
             f'2> {log}',
         ]
         self.call(self.CMD_LINEBREAK.join(args))
+
+
+class NativeAnnotatePeaks(Processor):
+    """
+    Annotates peak files in-process, instead of an annotatePeaks.pl per peak file each loading HOMER's genome annotation:
+    the gene annotation is loaded and indexed once (NumPy interval and TSS arrays), and peaks of each chromosome
+    are looked up all at once, into the columns of annotatePeaks.pl that are used downstream,
+    i.e. Annotation (promoter-TSS, TTS, exon, 5' UTR, 3' UTR, non-coding, intron, Intergenic), Distance to TSS,
+    Nearest PromoterID and Gene Name
+
+    Annotations follow the definitions and priority of HOMER (e.g. promoter-TSS from -1 kb to +100 bp),
+    but come from the given gene annotation rather than HOMER's, and Detailed Annotation has no repeats or CpG islands
+    """
+
+    FNAME_SUFFIX = AnnotatePeaks.FNAME_SUFFIX
+
+    peak_files: List[str]
+    gene_annotation: str
+
+    out_files: List[str]
+
+    def main(self, peak_files: List[str], gene_annotation: str) -> List[str]:
+
+        self.peak_files = peak_files
+        self.gene_annotation = gene_annotation
+
+        with self.profile():
+            annotation = load_gene_annotation(path=self.gene_annotation)
+            self.out_files = []
+            for peak_file in self.peak_files:
+                out_file = f'{peak_file.rsplit(".", 1)[0]}-{self.FNAME_SUFFIX}'
+                annotate_peaks(peaks=read_peaks(peak_file), annotation=annotation).to_csv(out_file, sep='\t', index=False)
+                self.out_files.append(out_file)
+
+        return self.out_files
@@ -1,62 +1,119 @@
 import os
-from typing import Optional, List
+import re
+import math
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from typing import Optional, List, Callable, Any, Union, Dict, Tuple
 from .template import Processor
 
 
+HEADER_STATISTIC_PATTERN = re.compile(r'^# (.+?) = (.*)$')  # e.g. '# Total tags = 1234567.0' in findPeaks tables
+
+# counts in the header of findPeaks tables, which add up over chromosome groups
+SUMMED_HEADER_STATISTICS = [
+    'genome size',
+    'Total tags',
+    'Total tags in peaks',
+    'number of putative peaks',
+    'Putative peaks filtered by local signal',
+    'Putative peaks filtered for being too clonal',
+]
+
+
+def concurrently(*functions: Callable[[], Any]) -> List[Any]:
+    """
+    Runs independent stages in threads and returns their results in the given order,
+    with each command reserving its cores from the run's budget when called
+    """
+    with ThreadPool(len(functions)) as p:
+        return p.map(lambda f: f(), functions)
+
+
 class PeakCalling(Processor):
+    """
+    MACS2 and HOMER peak calls are independent of each other, so they run concurrently,
+    and so do narrow and broad peaks of MACS2, and factor and histone peaks of HOMER
+    """
 
     treatment_bam: str
     control_bam: Optional[str]
     macs_effective_genome_size: str
     macs_fdr: float
+    macs_separate_calls: bool
 
     peak_files: List[str]
 
+    treatment_tag_dir: Optional[Union[str, List[str]]]
+    control_tag_dir: Optional[Union[str, List[str]]]
+
     def main(
             self,
             treatment_bam: str,
             control_bam: Optional[str],
             macs_effective_genome_size: str,
-            macs_fdr: float) -> List[str]:
+            macs_fdr: float,
+            macs_separate_calls: bool = False,
+            treatment_tag_dir: Optional[Union[str, List[str]]] = None,
+            control_tag_dir: Optional[Union[str, List[str]]] = None) -> List[str]:
+        """
+        macs_separate_calls: narrow and broad peaks by two full runs of MACS2 callpeak,
+            instead of broad peaks derived from the pileup and lambda tracks of the narrow run
+        treatment_tag_dir, control_tag_dir:
+            HOMER tag directories made beforehand (e.g. of a control shared by many treatments),
+            otherwise made from the BAM files,
+            or lists of tag directories of chromosome groups (MakeGroupTagDirectories), whose peaks are called separately
+        """
 
         self.treatment_bam = treatment_bam
         self.control_bam = control_bam
         self.macs_effective_genome_size = macs_effective_genome_size
         self.macs_fdr = macs_fdr
+        self.macs_separate_calls = macs_separate_calls
+        self.treatment_tag_dir = treatment_tag_dir
+        self.control_tag_dir = control_tag_dir
 
-        self.peak_files = []
-
-        self.macs()
-        self.homer()
+        macs_files, homer_files = concurrently(self.macs, self.homer)
+        self.peak_files = macs_files + homer_files
 
         return self.peak_files
 
-    def macs(self):
-        files = MACS(self.settings).main(
+    def macs(self) -> List[str]:
+        return MACS(self.settings).main(
             treatment_bam=self.treatment_bam,
             control_bam=self.control_bam,
             effective_genome_size=self.macs_effective_genome_size,
-            fdr=self.macs_fdr)
-        self.peak_files += files
+            fdr=self.macs_fdr,
+            separate_calls=self.macs_separate_calls)
 
-    def homer(self):
-        files = HOMER(self.settings).main(
+    def homer(self) -> List[str]:
+        return HOMER(self.settings).main(
             treatment_bam=self.treatment_bam,
-            control_bam=self.control_bam)
-        self.peak_files += files
+            control_bam=self.control_bam,
+            treatment_tag_dir=self.treatment_tag_dir,
+            control_tag_dir=self.control_tag_dir)
 
 
 class MACS(Processor):
     """
     For MACS2 output files please see: https://github.com/macs3-project/MACS/blob/master/docs/callpeak.md
+
+    Parsing the BAM files, filtering duplicates, and building the fragment pileup and the control lambda
+    take most of the time of callpeak, so by default they are done once, by the narrow peak run,
+    which saves the pileup and lambda as bedGraph files (kept in the outdir, e.g. narrow_treat_pileup.bdg).
+    Broad peaks are then called from the q-scores of these tracks (bdgcmp, bdgbroadcall),
+    with the cutoffs and gaps that callpeak --broad uses
     """
 
     BROAD_CUTOFF = 0.1
+    BROAD_MAX_GAP_FRAGMENTS = 4  # broad regions are linked across gaps of up to 4 fragment sizes, as callpeak --broad
+    D_PATTERN = re.compile(r'^# (?:d =|fragment size is determined as) (\d+)', re.MULTILINE)  # in the xls header of callpeak
+    TAG_SIZE_PATTERN = re.compile(r'^# tag size is determined as (\d+) bps', re.MULTILINE)
 
     treatment_bam: str
     control_bam: Optional[str]
     effective_genome_size: str
     fdr: float
+    separate_calls: bool
 
     dstdir: str
     base_args: List[str]
@@ -66,16 +123,22 @@ class MACS(Processor):
             treatment_bam: str,
             control_bam: Optional[str],
             effective_genome_size: str,
-            fdr: float) -> List[str]:
+            fdr: float,
+            separate_calls: bool = False) -> List[str]:
 
         self.treatment_bam = treatment_bam
         self.control_bam = control_bam
         self.effective_genome_size = effective_genome_size
         self.fdr = fdr
+        self.separate_calls = separate_calls
 
         self.set_base_args()
-        self.call_narrow_peaks()
-        self.call_broad_peaks()
+        os.makedirs(self.dstdir, exist_ok=True)  # before the concurrent calls, which would both make it
+        if self.separate_calls:
+            concurrently(self.call_narrow_peaks, self.call_broad_peaks)
+        else:
+            self.call_narrow_peaks()
+            self.call_broad_peaks_from_pileup()
 
         return [
             f'{self.dstdir}/broad_peaks.broadPeak',
@@ -99,6 +162,7 @@ class MACS(Processor):
         log = f'{self.outdir}/macs2-callpeak.log'
         args = self.base_args + [
             f'--name narrow',
+        ] + ([] if self.separate_calls else ['--bdg']) + [
             f'1> {log}',
             f'2> {log}',
         ]
@@ -115,14 +179,80 @@ class MACS(Processor):
         ]
         self.call(self.CMD_LINEBREAK.join(args))
 
+    def call_broad_peaks_from_pileup(self):
+        xls = f'{self.dstdir}/narrow_peaks.xls'
+        sizes = self.read_fragment_and_tag_size(xls=xls)
+        if sizes is None:
+            self.logger.info(f'No fragment size (e.g. "# d = 200") in the header of "{xls}", '
+                             f'so broad peaks are called by a separate callpeak --broad run')
+            self.call_broad_peaks()
+            return
+        d, tag_size = sizes
+
+        qscore_bdg = f'{self.workdir}/macs2-broad-qscore.bdg'
+        gapped_peak = f'{self.dstdir}/broad_peaks.gappedPeak'
+        log = f'{self.outdir}/macs2-callpeak-broad.log'
+        bdgcmp = [
+            'macs2 bdgcmp',
+            f'-t {self.dstdir}/narrow_treat_pileup.bdg',
+            f'-c {self.dstdir}/narrow_control_lambda.bdg',
+            '-m qpois',
+            f'-o {qscore_bdg}',
+            f'1> {log}',
+            f'2> {log}',
+        ]
+        bdgbroadcall = [
+            'macs2 bdgbroadcall',
+            f'-i {qscore_bdg}',
+            f'-c {-math.log10(self.fdr):.4f}',
+            f'-C {-math.log10(self.BROAD_CUTOFF):.4f}',
+            f'-l {d}',
+            f'-g {tag_size}',
+            f'-G {self.BROAD_MAX_GAP_FRAGMENTS * d}',
+            f'-o {gapped_peak}',
+            f'1>> {log}',
+            f'2>> {log}',
+        ]
+        self.call(self.CMD_LINEBREAK.join(bdgcmp))
+        self.call(self.CMD_LINEBREAK.join(bdgbroadcall))
+        with self.profile():
+            write_broad_peak(gapped_peak=gapped_peak, broad_peak=f'{self.dstdir}/broad_peaks.broadPeak')
+
+    def read_fragment_and_tag_size(self, xls: str) -> Optional[Tuple[int, int]]:
+        """
+        None if the fragment size is not in the header, e.g. of a truncated file or of another MACS version
+        """
+        with open(xls) as fh:
+            header = fh.read(100_000)
+        match = self.D_PATTERN.search(header)
+        if match is None:
+            return None
+        d = int(match.group(1))
+        match = self.TAG_SIZE_PATTERN.search(header)
+        tag_size = d if match is None else int(match.group(1))  # paired-end runs have no tag size
+        return d, tag_size
+
 
 class HOMER(Processor):
+    """
+    Tag directories can be lists of tag directories of chromosome groups, of the same groups for treatment and control,
+    in which case findPeaks runs on each group concurrently and the peak tables are merged
+
+    HOMER sets the expected tag density from the total tags and the genome size (-gsize, by default 2e9),
+    so each group is given its share of the genome size by its share of the mapped reads of the treatment BAM,
+    which keeps the expected density, and so the tag threshold, of a single run over the whole genome.
+    The fragment length and the peak size are estimated within each group,
+    which, as the FDR of the tag threshold, can make peaks at the margin differ from those of a single run;
+    test_peak_calling.TestHOMER.test_chromosome_groups compares the two on the test data
+    """
+
+    GENOME_SIZE = 2e9  # the default -gsize of findPeaks
 
     treatment_bam: str
     control_bam: Optional[str]
 
-    treatment_tag_dir: str
-    control_tag_dir: Optional[str]
+    treatment_tag_dir: Union[str, List[str]]
+    control_tag_dir: Optional[Union[str, List[str]]]
     dstdir: str
     factor_peaks_txt: str
     histone_regions_txt: str
@@ -130,49 +260,32 @@ class HOMER(Processor):
     def main(
             self,
             treatment_bam: str,
-            control_bam: Optional[str]) -> List[str]:
+            control_bam: Optional[str],
+            treatment_tag_dir: Optional[Union[str, List[str]]] = None,
+            control_tag_dir: Optional[Union[str, List[str]]] = None) -> List[str]:
 
         self.treatment_bam = treatment_bam
         self.control_bam = control_bam
+        self.treatment_tag_dir = treatment_tag_dir
+        self.control_tag_dir = control_tag_dir
 
-        self.make_treatment_tag_dir()
-        self.make_control_tag_dir()
+        concurrently(self.make_treatment_tag_dir, self.make_control_tag_dir)
         self.make_dstdir()
-        self.find_peaks_factor()
-        self.find_peaks_histone()
+        concurrently(self.find_peaks_factor, self.find_peaks_histone)
 
         return [self.factor_peaks_txt, self.histone_regions_txt]
 
     def make_treatment_tag_dir(self):
-        self.treatment_tag_dir = f'{self.workdir}/treatment-tag'
-        self.__make_tag_dir(
-            tag_dir=self.treatment_tag_dir,
-            bam=self.treatment_bam,
-            name='treatment'
-        )
+        if self.treatment_tag_dir is None:
+            self.treatment_tag_dir = MakeTagDirectory(self.settings).main(
+                bam=self.treatment_bam,
+                name='treatment')
 
     def make_control_tag_dir(self):
-        if self.control_bam is None:
-            self.control_tag_dir = None
-        else:
-            self.control_tag_dir = f'{self.workdir}/control-tag'
-            self.__make_tag_dir(
-                tag_dir=self.control_tag_dir,
+        if self.control_tag_dir is None and self.control_bam is not None:
+            self.control_tag_dir = MakeTagDirectory(self.settings).main(
                 bam=self.control_bam,
-                name='control'
-            )
-
-    def __make_tag_dir(self, tag_dir: str, bam: str, name: str):
-        log = f'{self.outdir}/makeTagDirectory-{name}.log'
-        args = [
-            'makeTagDirectory',
-            tag_dir,
-            f'-format sam',
-            bam,
-            f'1> {log}',
-            f'2> {log}',
-        ]
-        self.call(self.CMD_LINEBREAK.join(args))
+                name='control')
 
     def make_dstdir(self):
         self.dstdir = f'{self.outdir}/homer'
@@ -180,18 +293,85 @@ class HOMER(Processor):
 
     def find_peaks_factor(self):
         self.factor_peaks_txt = f'{self.dstdir}/factor-peaks.txt'
+        self.find_peaks(style='factor', output=self.factor_peaks_txt)
+
+    def find_peaks_histone(self):
+        self.histone_regions_txt = f'{self.dstdir}/histone-regions.txt'
+        self.find_peaks(style='histone', output=self.histone_regions_txt)
+
+    def find_peaks(self, style: str, output: str):
+        if isinstance(self.treatment_tag_dir, str):
+            self.run_find_peaks(
+                style=style,
+                treatment_tag_dir=self.treatment_tag_dir,
+                control_tag_dir=self.control_tag_dir,
+                output=output,
+                log=f'{self.outdir}/findPeaks-{style}.log')
+            return
+
+        if self.control_tag_dir is not None:
+            assert len(self.control_tag_dir) == len(self.treatment_tag_dir), \
+                'Treatment and control tag directories are not of the same chromosome groups'
+
+        fractions = self.get_read_fractions()
+        functions, group_outputs = [], []
+        for i, treatment_tag_dir in enumerate(self.treatment_tag_dir):
+            fraction = sum(fractions.get(c, 0.) for c in get_tag_dir_chromosomes(treatment_tag_dir))
+            if fraction == 0:  # no reads, no peaks
+                continue
+            group_output = f'{self.workdir}/homer-{style}-group-{i + 1}.txt'
+            functions.append(partial(
+                self.run_find_peaks,
+                style=style,
+                treatment_tag_dir=treatment_tag_dir,
+                control_tag_dir=None if self.control_tag_dir is None else self.control_tag_dir[i],
+                output=group_output,
+                log=f'{self.outdir}/findPeaks-{style}-group-{i + 1}.log',
+                genome_size=round(self.GENOME_SIZE * fraction)))
+            group_outputs.append(group_output)
+
+        if len(functions) > 0:
+            concurrently(*functions)
+        with self.profile():
+            merge_peak_tables(peak_txts=group_outputs, output=output)
+
+    def get_read_fractions(self) -> Dict[str, float]:
+        """
+        Shares of the mapped reads of the treatment BAM by chromosome
+        """
+        txt = f'{self.workdir}/homer-treatment-idxstats.txt'
+        self.call(f'samtools idxstats {self.treatment_bam} > {txt}')
+        mapped = {}
+        with open(txt) as fh:
+            for line in fh:
+                chrom, _, n, _ = line.rstrip('\n').split('\t')
+                if chrom != '*':
+                    mapped[chrom] = int(n)
+        total = sum(mapped.values())
+        return {c: n / total for c, n in mapped.items()} if total > 0 else {}
+
+    def run_find_peaks(
+            self,
+            style: str,
+            treatment_tag_dir: str,
+            control_tag_dir: Optional[str],
+            output: str,
+            log: str,
+            genome_size: Optional[int] = None):
 
         args = [
             f'findPeaks',
-            self.treatment_tag_dir,
-            '-style factor',
-            f'-o {self.factor_peaks_txt}'
+            treatment_tag_dir,
+            f'-style {style}',
+            f'-o {output}'
         ]
 
-        if self.control_tag_dir is not None:
-            args += [f'-i {self.control_tag_dir}']
+        if control_tag_dir is not None:
+            args += [f'-i {control_tag_dir}']
+
+        if genome_size is not None:
+            args += [f'-gsize {genome_size}']
 
-        log = f'{self.outdir}/findPeaks-factor.log'
         args += [
             f'1> {log}',
             f'2> {log}',
@@ -199,23 +379,209 @@ class HOMER(Processor):
 
         self.call(self.CMD_LINEBREAK.join(args))
 
-    def find_peaks_histone(self):
-        self.histone_regions_txt = f'{self.dstdir}/histone-regions.txt'
 
-        args = [
-            f'findPeaks',
-            self.treatment_tag_dir,
-            '-style histone',
-            f'-o {self.histone_regions_txt}'
-        ]
+class MakeTagDirectory(Processor):
 
-        if self.control_tag_dir is not None:
-            args += [f'-i {self.control_tag_dir}']
+    bam: str
+    name: str
 
-        log = f'{self.outdir}/findPeaks-histone.log'
-        args += [
+    tag_dir: str
+
+    def main(self, bam: str, name: str) -> str:
+        self.bam = bam
+        self.name = name
+
+        self.tag_dir = f'{self.workdir}/{self.name}-tag'
+        log = f'{self.outdir}/makeTagDirectory-{self.name}.log'
+        args = [
+            'makeTagDirectory',
+            self.tag_dir,
+            f'-format sam',
+            self.bam,
             f'1> {log}',
             f'2> {log}',
         ]
+        self.call(self.CMD_LINEBREAK.join(args))
+
+        return self.tag_dir
+
+
+class ChromosomeGroups(Processor):
+    """
+    Splits the chromosomes of the reference genome (from its .fai) into groups of similar total length,
+    the longest chromosomes first, each into the shortest group so far
+    """
+
+    ref_fa: str
+    groups: int
+
+    chrom_sizes: List[Tuple[str, int]]
+    chromosome_groups: List[List[str]]
+
+    def main(self, ref_fa: str, groups: int) -> List[List[str]]:
+        self.ref_fa = ref_fa
+        self.groups = groups
+
+        self.set_chrom_sizes()
+        self.set_chromosome_groups()
+        self.write_chromosome_groups()
+
+        return self.chromosome_groups
+
+    def set_chrom_sizes(self):
+        fai = f'{self.ref_fa}.fai'
+        if not os.path.exists(fai):
+            fai = f'{self.workdir}/{os.path.basename(self.ref_fa)}.fai'
+            self.call(f'samtools faidx {self.ref_fa} --fai-idx {fai}')
+        self.chrom_sizes = []
+        with open(fai) as fh:
+            for line in fh:
+                chrom, length = line.split('\t')[:2]
+                self.chrom_sizes.append((chrom, int(length)))
+
+    def set_chromosome_groups(self):
+        groups = [[] for _ in range(min(self.groups, len(self.chrom_sizes)))]
+        lengths = [0] * len(groups)
+        order = {chrom: i for i, (chrom, _) in enumerate(self.chrom_sizes)}
+        for chrom, length in sorted(self.chrom_sizes, key=lambda x: -x[1]):
+            i = lengths.index(min(lengths))
+            groups[i].append(chrom)
+            lengths[i] += length
+        self.chromosome_groups = [sorted(g, key=order.get) for g in groups]
+
+    def write_chromosome_groups(self):
+        with open(f'{self.outdir}/chromosome-groups.tsv', 'w') as fh:
+            fh.write('group\tchromosome\n')
+            for i, group in enumerate(self.chromosome_groups):
+                for chrom in group:
+                    fh.write(f'{i + 1}\t{chrom}\n')
+
+
+class MakeGroupTagDirectories(Processor):
+    """
+    Makes a HOMER tag directory for each chromosome group, from the reads of its chromosomes in the BAM,
+    with the groups made concurrently
+    """
+
+    bam: str
+    name: str
+    chromosome_groups: List[List[str]]
 
+    def main(self, bam: str, name: str, chromosome_groups: List[List[str]]) -> List[str]:
+        self.bam = bam
+        self.name = name
+        self.chromosome_groups = chromosome_groups
+
+        return concurrently(*[partial(self.make_group, i=i) for i in range(len(self.chromosome_groups))])
+
+    def make_group(self, i: int) -> str:
+        name = f'{self.name}-group-{i + 1}'
+        group_bam = f'{self.workdir}/{name}.bam'
+        args = [
+            'samtools view',
+            '-b',
+            f'-o {group_bam}',
+            self.bam,
+        ] + self.chromosome_groups[i]
         self.call(self.CMD_LINEBREAK.join(args))
+
+        tag_dir = MakeTagDirectory(self.settings).main(bam=group_bam, name=name)
+        os.remove(group_bam)
+
+        return tag_dir
+
+
+def get_tag_dir_chromosomes(tag_dir: str) -> List[str]:
+    """
+    HOMER tag directories have a tag file per chromosome, e.g. chr1.tags.tsv
+    """
+    suffix = '.tags.tsv'
+    return [f[:-len(suffix)] for f in sorted(os.listdir(tag_dir)) if f.endswith(suffix)]
+
+
+def merge_peak_tables(peak_txts: List[str], output: str):
+    """
+    Merges findPeaks tables of chromosome groups into one, as findPeaks writes it:
+    the header of the first table, with the genome-wide statistics of all groups,
+    and peaks sorted by normalized tag count (high to low) with PeakIDs renumbered
+    """
+    headers, peaks = [], []
+    for txt in peak_txts:
+        header = []
+        with open(txt) as fh:
+            for line in fh:
+                if line.startswith('#'):
+                    header.append(line)
+                elif line.strip() != '':
+                    peaks.append(line.rstrip('\n').split('\t'))
+        headers.append(header)
+
+    peaks.sort(key=lambda p: (-float(p[5]), p[1], int(p[2])))
+
+    statistics = [read_header_statistics(header) for header in headers]
+    with open(output, 'w') as fh:
+        for line in headers[0] if len(headers) > 0 else []:
+            match = HEADER_STATISTIC_PATTERN.match(line.rstrip('\n'))
+            if match is not None:
+                value = merge_header_statistic(key=match.group(1), statistics=statistics, total_peaks=len(peaks))
+                if value is None:
+                    continue
+                line = f'# {match.group(1)} = {value}\n'
+            fh.write(line)
+        for n, items in enumerate(peaks):
+            fh.write('\t'.join([f'peak-{n + 1}'] + items[1:]) + '\n')
+
+
+def read_header_statistics(header: List[str]) -> Dict[str, str]:
+    ret = {}
+    for line in header:
+        match = HEADER_STATISTIC_PATTERN.match(line.rstrip('\n'))
+        if match is not None:
+            ret[match.group(1)] = match.group(2)
+    return ret
+
+
+def merge_header_statistic(key: str, statistics: List[Dict[str, str]], total_peaks: int) -> Optional[str]:
+    """
+    Counts are summed over the groups, the IP efficiency is recomputed from the summed tag counts,
+    other statistics are kept if the same in all groups, e.g. the peak size or the FDR rate threshold,
+    and None (dropped) if specific to a group, e.g. the tag threshold or the command of the group
+    """
+    values = [s.get(key) for s in statistics]
+    if key == 'total peaks':
+        return str(total_peaks)
+    if None in values:
+        return None
+    if key in SUMMED_HEADER_STATISTICS:
+        return sum_numbers(values)
+    if key == 'Approximate IP efficiency':
+        tags = [s.get(k) for s in statistics for k in ['Total tags', 'Total tags in peaks']]
+        if None in tags:
+            return None
+        total = sum(float(t) for t in tags[0::2])
+        in_peaks = sum(float(t) for t in tags[1::2])
+        return f'{100 * in_peaks / total:.2f}%' if total > 0 else None
+    return values[0] if len(set(values)) == 1 else None
+
+
+def sum_numbers(values: List[str]) -> str:
+    """
+    e.g. ['1000', '2000'] -> '3000', ['1000.0', '2000.5'] -> '3000.5'
+    """
+    if all(re.match(r'^-?\d+$', v) for v in values):
+        return str(sum(int(v) for v in values))
+    return f'{sum(float(v) for v in values):.1f}'
+
+
+def write_broad_peak(gapped_peak: str, broad_peak: str):
+    """
+    gappedPeak (BED12 + signalValue, pValue, qValue) -> broadPeak (BED6 + signalValue, pValue, qValue),
+    the same as callpeak --broad writes both
+    """
+    with open(gapped_peak) as reader, open(broad_peak, 'w') as writer:
+        for line in reader:
+            if line.startswith(('track', 'browser', '#')):
+                continue
+            items = line.rstrip('\n').split('\t')
+            scores = items[12:15] if len(items) >= 15 else ['-1', '-1', '-1']
+            writer.write('\t'.join(items[:6] + scores) + '\n')
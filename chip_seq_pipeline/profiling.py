@@ -0,0 +1,98 @@
+import json
+import threading
+from typing import List, Dict, Any, Optional
+
+
+class Profiler:
+    """
+    Collects resource usage records of external commands and Python-side stages of a run
+
+    Each record has:
+        stage: name of the Processor class, e.g. 'Bowtie2Mapper' or 'WriteCleanBed'
+        command: tool name of an external command, or None for a Python-side stage
+        wall_seconds, user_seconds, sys_seconds
+        peak_rss_mb
+        read_bytes, write_bytes: characters read/written through syscalls (rchar/wchar of /proc/<pid>/io)
+    """
+
+    records: List[Dict[str, Any]]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(
+            self,
+            stage: str,
+            command: Optional[str],
+            start: str,
+            wall_seconds: float,
+            user_seconds: float,
+            sys_seconds: float,
+            peak_rss_mb: float,
+            read_bytes: int,
+            write_bytes: int):
+
+        with self.lock:
+            self.records.append({
+                'stage': stage,
+                'command': command,
+                'start': start,
+                'wall_seconds': round(wall_seconds, 3),
+                'user_seconds': round(user_seconds, 3),
+                'sys_seconds': round(sys_seconds, 3),
+                'peak_rss_mb': round(peak_rss_mb, 1),
+                'read_bytes': read_bytes,
+                'write_bytes': write_bytes,
+            })
+
+    def write_json(self, json_path: str):
+        with open(json_path, 'w') as fh:
+            json.dump({'records': self.records, 'stages': self.summarize()}, fh, indent=2)
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        for r in self.records:
+            s = stages.setdefault(r['stage'], {
+                'stage': r['stage'],
+                'calls': 0,
+                'wall_seconds': 0.,
+                'cpu_seconds': 0.,
+                'peak_rss_mb': 0.,
+                'read_bytes': 0,
+                'write_bytes': 0,
+            })
+            s['calls'] += 1
+            s['wall_seconds'] += r['wall_seconds']
+            s['cpu_seconds'] += r['user_seconds'] + r['sys_seconds']
+            s['peak_rss_mb'] = max(s['peak_rss_mb'], r['peak_rss_mb'])
+            s['read_bytes'] += r['read_bytes']
+            s['write_bytes'] += r['write_bytes']
+        return sorted(stages.values(), key=lambda s: s['wall_seconds'], reverse=True)
+
+    def summary_table(self) -> str:
+        header = f'{"stage":<24}{"calls":>6}{"wall (s)":>12}{"CPU (s)":>12}{"peak RSS (MB)":>15}{"read (MB)":>12}{"write (MB)":>12}'
+        lines = [header, '-' * len(header)]
+        for s in self.summarize():
+            lines.append(
+                f'{s["stage"]:<24}'
+                f'{s["calls"]:>6}'
+                f'{s["wall_seconds"]:>12.1f}'
+                f'{s["cpu_seconds"]:>12.1f}'
+                f'{s["peak_rss_mb"]:>15.1f}'
+                f'{s["read_bytes"] / 1024 ** 2:>12.1f}'
+                f'{s["write_bytes"] / 1024 ** 2:>12.1f}'
+            )
+        return '\n'.join(lines)
+
+
+def read_proc_io(path: str) -> Dict[str, int]:
+    """
+    path: e.g. '/proc/<pid>/io' or '/proc/thread-self/io', which is not available on all systems
+    """
+    try:
+        with open(path) as fh:
+            return {k: int(v) for k, v in (line.split(': ') for line in fh)}
+    except (FileNotFoundError, PermissionError, ValueError):
+        return {}
@@ -0,0 +1,232 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Set, Any, Optional, Union
+from .manifest import Manifest, fingerprint
+from .tools import get_tool_version
+from .template import Settings, Logger
+
+
+class Task:
+
+    name: str
+    function: Callable
+    inputs: Dict[str, Union[str, List[str]]]
+    params: Dict[str, Any]
+    files: List[str]
+    dependencies: List[str]
+    tools: List[str]
+    resumable: bool
+    prefix_result: bool
+
+    result: Any
+
+    def __init__(
+            self,
+            name: str,
+            function: Callable,
+            inputs: Dict[str, Union[str, List[str]]],
+            params: Dict[str, Any],
+            files: List[str],
+            dependencies: List[str],
+            tools: List[str],
+            resumable: bool,
+            prefix_result: bool):
+
+        self.name = name
+        self.function = function
+        self.inputs = inputs
+        self.params = params
+        self.files = files
+        self.dependencies = dependencies
+        self.tools = tools
+        self.resumable = resumable
+        self.prefix_result = prefix_result
+        self.result = None
+
+    def upstream(self) -> List[str]:
+        names = []
+        for value in self.inputs.values():
+            names += value if isinstance(value, list) else [value]
+        return names + self.dependencies
+
+
+class DAGScheduler:
+    """
+    Runs tasks as a dependency graph, each task is started as soon as all its upstream tasks are done
+
+    A task is called with keyword arguments:
+        `inputs` maps a keyword to the name of an upstream task, whose result is passed as the value,
+            or to a list of names, e.g. scattered chunks, whose results are passed as a list
+        `params` are passed as they are
+    `files` are keys of `params` that are paths of input files, e.g. fastq files
+    `dependencies` are upstream tasks that only need to finish first, without passing their results
+
+    Tasks run in threads, since the heavy lifting is done by external commands
+
+    A failed task cancels its downstream tasks, while independent tasks (e.g. other samples of a batch)
+    keep running. The first error is raised after all runnable tasks are finished.
+
+    With a `manifest_dir`, each finished task writes a manifest of its arguments,
+    fingerprints of its input files, i.e. the results of `inputs` and the `files` of `params`,
+    and versions of its `tools` (version commands, e.g. 'samtools --version').
+    Other params are compared by value only.
+    A resumable task whose manifest still matches is skipped, and its recorded result is used instead.
+    The result of a `prefix_result` task is a path prefix of files, e.g. an aligner index,
+    fingerprinted as all files sharing it.
+    """
+
+    settings: Settings
+    max_workers: int
+    manifest_dir: Optional[str]
+    logger: Logger
+
+    tasks: Dict[str, Task]
+    statuses: Dict[str, str]
+    tool_versions: Dict[str, str]
+    lock: threading.Lock
+
+    def __init__(
+            self,
+            settings: Settings,
+            max_workers: int,
+            manifest_dir: Optional[str]):
+
+        self.settings = settings
+        self.max_workers = max_workers
+        self.manifest_dir = manifest_dir
+        self.logger = Logger(
+            name=self.__class__.__name__,
+            level=Logger.DEBUG if settings.debug else Logger.INFO)
+        self.tasks = {}
+        self.statuses = {}
+        self.tool_versions = {}
+        self.lock = threading.Lock()
+
+    def add(
+            self,
+            name: str,
+            function: Callable,
+            inputs: Optional[Dict[str, Union[str, List[str]]]] = None,
+            params: Optional[Dict[str, Any]] = None,
+            files: Optional[List[str]] = None,
+            dependencies: Optional[List[str]] = None,
+            tools: Optional[List[str]] = None,
+            resumable: bool = True,
+            prefix_result: bool = False) -> str:
+
+        assert name not in self.tasks, f'Duplicated task name: {name}'
+        task = Task(
+            name=name,
+            function=function,
+            inputs={} if inputs is None else inputs,
+            params={} if params is None else params,
+            files=[] if files is None else files,
+            dependencies=[] if dependencies is None else dependencies,
+            tools=[] if tools is None else tools,
+            resumable=resumable,
+            prefix_result=prefix_result)
+        for upstream in task.upstream():
+            assert upstream in self.tasks, f'Task "{name}" depends on unknown task "{upstream}"'
+        for key in task.files:
+            assert key in task.params, f'Input file "{key}" of task "{name}" is not a parameter'
+        self.tasks[name] = task
+        self.statuses[name] = 'pending'
+        return name
+
+    def result(self, name: str) -> Any:
+        return self.tasks[name].result
+
+    def status(self, name: str) -> str:
+        """
+        'pending', 'running', 'done', 'failed' or 'cancelled' (due to a failed upstream task)
+        """
+        return self.statuses[name]
+
+    def run(self):
+        pending = list(self.tasks.keys())
+        running: Dict[Future, str] = {}
+        error: Optional[BaseException] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                self.cancel_downstream_of_failed(pending=pending)
+
+                for name in [n for n in pending if self.__upstream_statuses(n) <= {'done'}]:
+                    pending.remove(name)
+                    self.statuses[name] = 'running'
+                    self.logger.debug(f'Start task: {name}')
+                    running[executor.submit(self.__run_one, name)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is None:
+                        self.statuses[name] = 'done'
+                        self.logger.debug(f'Task done: {name}')
+                    else:
+                        self.statuses[name] = 'failed'
+                        self.logger.info(f'Task failed: {name}: {future.exception()}')
+                        if error is None:
+                            error = future.exception()
+
+        if error is not None:
+            raise error
+
+    def cancel_downstream_of_failed(self, pending: List[str]):
+        cancelled_any = True
+        while cancelled_any:
+            cancelled_any = False
+            for name in [n for n in pending if self.__upstream_statuses(n) & {'failed', 'cancelled'}]:
+                pending.remove(name)
+                self.statuses[name] = 'cancelled'
+                self.logger.info(f'Task cancelled: {name}')
+                cancelled_any = True
+
+    def __upstream_statuses(self, name: str) -> Set[str]:
+        return {self.statuses[u] for u in self.tasks[name].upstream()}
+
+    def __run_one(self, name: str):
+        task = self.tasks[name]
+        kwargs = {key: self.get_input(upstream) for key, upstream in task.inputs.items()}
+        kwargs.update(task.params)
+
+        if self.manifest_dir is None or not task.resumable:
+            task.result = task.function(**kwargs)
+            return
+
+        manifest = Manifest(json_path=f'{self.manifest_dir}/{name}.json', prefix=task.prefix_result)
+        signature = {
+            'params': task.params,
+            'inputs': {
+                key: {'value': kwargs[key], 'fingerprint': self.fingerprint_input(upstream)}
+                for key, upstream in task.inputs.items()
+            },
+            'files': {key: fingerprint(task.params[key]) for key in task.files},
+            'tools': {cmd: self.get_tool_version(cmd) for cmd in task.tools},
+        }
+        if manifest.matches(signature=signature):
+            self.logger.info(f'Skip task "{name}", as its inputs, parameters and tool versions are unchanged')
+            task.result = manifest.result()
+        else:
+            task.result = task.function(**kwargs)
+            manifest.write(signature=signature, result=task.result)
+
+    def get_input(self, upstream: Union[str, List[str]]) -> Any:
+        if isinstance(upstream, list):
+            return [self.tasks[u].result for u in upstream]
+        return self.tasks[upstream].result
+
+    def fingerprint_input(self, upstream: Union[str, List[str]]) -> Any:
+        if isinstance(upstream, list):
+            return [self.fingerprint_input(u) for u in upstream]
+        task = self.tasks[upstream]
+        return fingerprint(task.result, prefix=task.prefix_result)
+
+    def get_tool_version(self, cmd: str) -> str:
+        with self.lock:
+            if cmd not in self.tool_versions:
+                self.tool_versions[cmd] = get_tool_version(cmd)
+            return self.tool_versions[cmd]
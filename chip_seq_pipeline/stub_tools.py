@@ -0,0 +1,551 @@
+"""
+Fake executables of all external tools called by the pipeline, to benchmark orchestration
+(scheduling, core and memory budgets, logging) without installing the bioinformatics tools
+
+install_stub_tools() writes one executable per tool into a bin directory to be put first on PATH,
+each of which runs this module as a script, e.g.
+
+stub-tools/samtools sort -@ 4 -o sorted.bam - -> python stub_tools.py --cost-model cost-model.json samtools sort ...
+
+Run as a script by the fake executables, so this module does not import the rest of the package
+
+Each fake tool creates the files that the next stage expects, and spends time, CPU and memory
+per the cost model of the tool (e.g. 'samtools sort' or 'bowtie2'), given the size of its input:
+    seconds: fixed time per call
+    seconds_per_gb: time per GB of input files and stdin
+    cpu: fraction of the time spent busy on each thread (-@, --threads, ...), the rest is spent sleeping
+    memory_mb: memory allocated and touched during the call
+    output_ratio: output bytes per input byte, of outputs generated from scratch (e.g. SAM of an aligner)
+
+Alignments are plain SAM text all the way, in "BAM" files too, so that pass-through tools
+(sort, view, fixmate, markdup, ...) read valid records
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+from typing import List, Dict, Optional, IO, Iterable, Set
+
+
+TOOLS = [
+    'trim_galore',
+    'cutadapt',
+    'fastqc',
+    'bowtie2-build',
+    'bowtie2',
+    'bwa',
+    'samtools',
+    'gatk',
+    'bamCoverage',
+    'macs2',
+    'makeTagDirectory',
+    'findPeaks',
+    'annotatePeaks.pl',
+    'findMotifsGenome.pl',
+    'Rscript',
+]
+
+DEFAULT_COST_MODEL = {
+    'default':             {'seconds': 0.1, 'seconds_per_gb': 10., 'cpu': 0.5, 'memory_mb': 20, 'output_ratio': 1.},
+    'trim_galore':         {'seconds': 0.5, 'seconds_per_gb': 60., 'cpu': 0.9, 'memory_mb': 50, 'output_ratio': 1.},
+    'cutadapt':            {'seconds': 0.2, 'seconds_per_gb': 20., 'cpu': 0.9, 'memory_mb': 50, 'output_ratio': 1.},
+    'fastqc':              {'seconds': 1.0, 'seconds_per_gb': 20., 'cpu': 1., 'memory_mb': 250, 'output_ratio': 1.},
+    'bowtie2-build':       {'seconds': 1.0, 'seconds_per_gb': 600., 'cpu': 1., 'memory_mb': 200, 'output_ratio': 1.3},
+    'bwa index':           {'seconds': 1.0, 'seconds_per_gb': 600., 'cpu': 1., 'memory_mb': 200, 'output_ratio': 1.3},
+    'bowtie2':             {'seconds': 0.5, 'seconds_per_gb': 300., 'cpu': 1., 'memory_mb': 300, 'output_ratio': 4.},
+    'bwa mem':             {'seconds': 0.5, 'seconds_per_gb': 300., 'cpu': 1., 'memory_mb': 400, 'output_ratio': 4.},
+    'samtools sort':       {'seconds': 0.2, 'seconds_per_gb': 20., 'cpu': 0.8, 'memory_mb': 200, 'output_ratio': 1.},
+    'samtools stats':      {'seconds': 0.1, 'seconds_per_gb': 10., 'cpu': 1., 'memory_mb': 20, 'output_ratio': 1.},
+    'gatk':                {'seconds': 2.0, 'seconds_per_gb': 60., 'cpu': 0.9, 'memory_mb': 500, 'output_ratio': 1.},
+    'bamCoverage':         {'seconds': 0.5, 'seconds_per_gb': 30., 'cpu': 0.9, 'memory_mb': 100, 'output_ratio': 0.1},
+    'macs2 callpeak':      {'seconds': 1.0, 'seconds_per_gb': 60., 'cpu': 1., 'memory_mb': 300, 'output_ratio': 0.001},
+    'makeTagDirectory':    {'seconds': 0.5, 'seconds_per_gb': 30., 'cpu': 1., 'memory_mb': 100, 'output_ratio': 0.5},
+    'findPeaks':           {'seconds': 0.5, 'seconds_per_gb': 30., 'cpu': 1., 'memory_mb': 100, 'output_ratio': 0.002},
+    'annotatePeaks.pl':    {'seconds': 1.0, 'seconds_per_gb': 100., 'cpu': 1., 'memory_mb': 300, 'output_ratio': 3.},
+    'findMotifsGenome.pl': {'seconds': 2.0, 'seconds_per_gb': 100., 'cpu': 1., 'memory_mb': 500, 'output_ratio': 1.},
+    'Rscript':             {'seconds': 1.0, 'seconds_per_gb': 10., 'cpu': 0.8, 'memory_mb': 200, 'output_ratio': 1.},
+}
+
+THREAD_OPTIONS = ['-@', '--threads', '-p', '-t', '--cores', '-j', '--numberOfProcessors']
+SUBCOMMAND_TOOLS = ['samtools', 'bwa', 'macs2']
+CHUNK_SIZE = 1024 * 1024
+SAM_CHROM = 'chr1'
+SAM_CHROM_LENGTH = 248956422
+STUB_VERSION = '0.0.0-stub'
+
+
+def install_stub_tools(bindir: str, cost_model_json: Optional[str] = None) -> str:
+    """
+    cost_model_json: overrides of DEFAULT_COST_MODEL by tool, e.g. {"bowtie2": {"seconds_per_gb": 100}}
+
+    Returns the absolute path of the bin directory
+    """
+    bindir = os.path.abspath(bindir)
+    os.makedirs(bindir, exist_ok=True)
+
+    cost_model = {k: dict(v) for k, v in DEFAULT_COST_MODEL.items()}
+    if cost_model_json is not None:
+        with open(cost_model_json) as fh:
+            for tool, costs in json.load(fh).items():
+                cost_model.setdefault(tool, dict(DEFAULT_COST_MODEL['default'])).update(costs)
+
+    model_json = f'{bindir}/cost-model.json'
+    with open(model_json, 'w') as fh:
+        json.dump(cost_model, fh, indent=2)
+
+    for tool in TOOLS:
+        path = f'{bindir}/{tool}'
+        with open(path, 'w') as fh:
+            fh.write(f'#!/bin/bash\nexec {sys.executable} {os.path.abspath(__file__)} --cost-model {model_json} {tool} "$@"\n')
+        os.chmod(path, 0o755)
+
+    return bindir
+
+
+class StubTool:
+
+    tool: str
+    args: List[str]
+    costs: Dict[str, float]
+
+    input_bytes: int
+
+    def __init__(self, tool: str, args: List[str], cost_model: Dict[str, Dict[str, float]]):
+        self.tool = tool
+        self.args = args
+        self.costs = cost_model.get(self.key(), cost_model['default'])
+        self.input_bytes = 0
+
+    def key(self) -> str:
+        """
+        Tool name as in the cost model, e.g. 'samtools sort', 'bwa mem', 'macs2 callpeak', 'bowtie2'
+        """
+        if self.tool in SUBCOMMAND_TOOLS and len(self.args) > 0 and not self.args[0].startswith('-'):
+            return f'{self.tool} {self.args[0]}'
+        return self.tool
+
+    def main(self) -> int:
+        if '--version' in self.args or (self.tool == 'bwa' and len(self.args) == 0):
+            print(f'{self.tool} version {STUB_VERSION}')
+            return 0
+
+        self.input_bytes = sum(path_size(a) for a in self.args if os.path.exists(a) and not is_fifo(a))
+        handler = getattr(self, 'run_' + self.key().replace(' ', '_').replace('-', '_').replace('.', '_'), None)
+        if handler is None:
+            sys.stderr.write(f'{self.tool} (stub): unsupported command: {" ".join(self.args)}\n')
+            return 1
+        handler()
+        spend(
+            seconds=self.costs['seconds'] + self.costs['seconds_per_gb'] * self.input_bytes / 1e9,
+            cpu=self.costs['cpu'],
+            threads=self.threads(),
+            memory_mb=self.costs['memory_mb'])
+        return 0
+
+    def threads(self) -> int:
+        for i, a in enumerate(self.args[:-1]):
+            if a in THREAD_OPTIONS and self.args[i + 1].isdigit():
+                return max(1, int(self.args[i + 1]))
+        return 1
+
+    def option(self, *keys: str) -> Optional[str]:
+        for i, a in enumerate(self.args[:-1]):
+            if a in keys:
+                return self.args[i + 1]
+        return None
+
+    def positionals(self, options_with_value: Iterable[str]) -> List[str]:
+        ret, skip = [], False
+        for a in self.args[1:] if self.key() != self.tool else self.args:
+            if skip:
+                skip = False
+            elif a in options_with_value:
+                skip = True
+            elif a == '-' or not a.startswith('-'):
+                ret.append(a)
+        return ret
+
+    def generated_bytes(self) -> int:
+        return int(self.input_bytes * self.costs['output_ratio'])
+
+    # trimming
+
+    def run_trim_galore(self):
+        outdir = self.option('--output_dir')
+        suffix = '.fq' if '--dont_gzip' in self.args else '.fq.gz'
+        for i, fq in [(1, self.args[-2]), (2, self.args[-1])]:
+            name = get_fq_filename(fq)
+            copy_fastq(src=fq, dst=f'{outdir}/{name}_val_{i}{suffix}')
+            if '--fastqc' in self.args or any(a.startswith('--fastqc_args') for a in self.args):
+                for f in [f'{name}_val_{i}_fastqc.html', f'{name}_val_{i}_fastqc.zip']:
+                    write_bytes(path=f'{outdir}/{f}', size=CHUNK_SIZE // 4)
+            with open(f'{outdir}/{os.path.basename(fq)}_trimming_report.txt', 'w') as fh:
+                fh.write(f'Trimming report of {fq} (stub)\n')
+
+    def run_cutadapt(self):
+        """
+        Only the interleaved output to stdout of the trimming stream, read 1 and read 2 records alternating
+        """
+        fq1, fq2 = self.args[-2:]
+        with open_fastq(fq1) as in1, open_fastq(fq2) as in2:
+            while True:
+                r1 = [in1.readline() for _ in range(4)]
+                r2 = [in2.readline() for _ in range(4)]
+                if r1[0] == '' or r2[0] == '':
+                    break
+                sys.stdout.write(''.join(r1 + r2))
+        sys.stderr.write(f'This is cutadapt {STUB_VERSION} (stub)\n')
+
+    def run_fastqc(self):
+        outdir = self.option('--outdir', '-o')
+        for f in self.positionals(options_with_value=['--threads', '-t', '--outdir', '-o']):
+            if f.startswith('stdin'):
+                name = f.split(':', 1)[1] if ':' in f else 'stdin'
+                self.input_bytes += sum(len(line) for line in sys.stdin)
+            else:
+                name = get_fq_filename(f)
+            for suffix in ['_fastqc.html', '_fastqc.zip']:
+                write_bytes(path=f'{outdir}/{name}{suffix}', size=CHUNK_SIZE // 4)
+
+    # indexing and mapping
+
+    def run_bowtie2_build(self):
+        ref, index = self.positionals(options_with_value=[])[:2]
+        for suffix in ['1.bt2', '2.bt2', '3.bt2', '4.bt2', 'rev.1.bt2', 'rev.2.bt2']:
+            write_bytes(path=f'{index}.{suffix}', size=self.generated_bytes() // 6)
+
+    def run_bwa_index(self):
+        index = self.option('-p')
+        for suffix in ['amb', 'ann', 'bwt', 'pac', 'sa']:
+            write_bytes(path=f'{index}.{suffix}', size=self.generated_bytes() // 5)
+
+    def run_bowtie2(self):
+        self.read_stdin_reads()
+        write_sam(out=sys.stdout, size=self.generated_bytes())
+
+    def run_bwa_mem(self):
+        self.read_stdin_reads()
+        write_sam(out=sys.stdout, size=self.generated_bytes())
+
+    def read_stdin_reads(self):
+        if '-' in self.args:  # interleaved read pairs from the trimming stream
+            self.input_bytes += sum(len(line) for line in sys.stdin)
+
+    # samtools, which passes SAM text through
+
+    def run_samtools_sort(self):
+        self.pass_through(options_with_value=['-@', '-m', '-T', '-o', '-O', '-n'])
+
+    def run_samtools_view(self):
+        # as samtools, SAM to stdout has no header, unless asked for (-h) or written as BAM (-b)
+        keep_header = any(a in self.args for a in ['-h', '-H', '-b', '-o'])
+        options_with_value = ['-@', '-o', '-f', '-F', '-q', '-O', '-s', '-L', '-e', '-N']
+        regions = self.positionals(options_with_value=options_with_value)[1:]
+        chroms = {r.split(':')[0] for r in regions} if len(regions) > 0 else None
+        self.pass_through(
+            options_with_value=options_with_value,
+            keep_header=keep_header,
+            chroms=set() if '-H' in self.args else chroms)  # -H: header only
+
+    def run_samtools_fixmate(self):
+        self.pass_through(options_with_value=['-@', '-O'])
+
+    def run_samtools_collate(self):
+        ins = self.positionals(options_with_value=['-@', '-n'])
+        self.copy(inputs=ins[:1], output='-')
+
+    def run_samtools_markdup(self):
+        ins = self.positionals(options_with_value=['-@', '-f', '-T', '-O'])
+        self.copy(inputs=ins[:1], output=ins[1])
+        metrics = self.option('-f')
+        if metrics is not None:
+            with open(metrics, 'w') as fh:
+                fh.write('COMMAND: samtools markdup (stub)\nDUPLICATE TOTAL: 0\n')
+
+    def run_samtools_merge(self):
+        ins = self.positionals(options_with_value=['-@', '-o', '-O'])
+        self.copy(inputs=ins, output=self.option('-o'))
+
+    def run_samtools_index(self):
+        bam = self.positionals(options_with_value=['-@'])[0]
+        write_bytes(path=f'{bam}.bai', size=max(1, self.input_bytes // 1000))
+
+    def run_samtools_idxstats(self):
+        bam = self.positionals(options_with_value=['-@'])[-1]
+        mapped = self.copy(inputs=[bam], output=None)
+        print(f'{SAM_CHROM}\t{SAM_CHROM_LENGTH}\t{mapped}\t0\n*\t0\t0\t0')
+
+    def run_samtools_faidx(self):
+        """
+        Names and lengths of the sequences, as the first two columns of the .fai
+        """
+        ref = self.positionals(options_with_value=['--fai-idx', '-o'])[0]
+        fai = self.option('--fai-idx') or f'{ref}.fai'
+        sizes = {}
+        with open(ref) as fh:
+            for line in fh:
+                if line.startswith('>'):
+                    name = line[1:].split()[0]
+                    sizes[name] = 0
+                else:
+                    sizes[name] += len(line.rstrip())
+        with open(fai, 'w') as fh:
+            for name, length in sizes.items():
+                fh.write(f'{name}\t{length}\t0\t60\t61\n')
+
+    def run_samtools_stats(self):
+        ins = self.positionals(options_with_value=['-@'])
+        lines = self.copy(inputs=ins[:1], output=None)
+        print(f'# samtools stats (stub)\nSN\traw total sequences:\t{lines}')
+
+    def pass_through(
+            self,
+            options_with_value: List[str],
+            keep_header: bool = True,
+            chroms: Optional[Set[str]] = None):
+        ins = self.positionals(options_with_value=options_with_value)
+        output = self.option('-o')
+        self.copy(
+            inputs=ins[:1] or ['-'],
+            output='-' if output is None else output,
+            keep_header=keep_header,
+            chroms=chroms)
+
+    def copy(
+            self,
+            inputs: List[str],
+            output: Optional[str],
+            keep_header: bool = True,
+            chroms: Optional[Set[str]] = None) -> int:
+        """
+        Concatenates SAM inputs ('-' for stdin) into the output ('-' for stdout, None to discard),
+        keeping the header of the first input only, and writes the index of 'out.bam##idx##out.bam.bai'
+
+        chroms: only alignments on these chromosomes, e.g. of the regions of samtools view
+
+        Returns the number of alignment lines
+        """
+        index = None
+        if output is not None and '##idx##' in output:
+            output, index = output.split('##idx##')
+
+        out = None if output is None else sys.stdout if output == '-' else open(output, 'w')
+        lines = 0
+        try:
+            for i, path in enumerate(inputs):
+                fh = sys.stdin if path == '-' else open(path)
+                for line in fh:
+                    self.input_bytes += len(line) if path == '-' or is_fifo(path) else 0
+                    if line.startswith('@'):
+                        if i > 0 or not keep_header:
+                            continue
+                    elif chroms is not None and line.split('\t', 3)[2] not in chroms:
+                        continue
+                    else:
+                        lines += 1
+                    if out is not None:
+                        out.write(line)
+                if fh is not sys.stdin:
+                    fh.close()
+        finally:
+            if out is not None and out is not sys.stdout:
+                out.close()
+
+        if index is not None:
+            write_bytes(path=index, size=max(1, path_size(output) // 1000))
+        return lines
+
+    # duplicate marking and coverage
+
+    def run_gatk(self):
+        out = self.option('--OUTPUT')
+        self.copy(inputs=[self.option('--INPUT')], output=out)
+        with open(self.option('--METRICS_FILE'), 'w') as fh:
+            fh.write('## METRICS CLASS\tpicard.sam.DuplicationMetrics (stub)\n')
+        if self.option('--CREATE_INDEX') == 'true':
+            write_bytes(path=f'{out[:-len(".bam")]}.bai', size=max(1, self.input_bytes // 1000))
+
+    def run_bamCoverage(self):
+        write_bytes(path=self.option('--outFileName'), size=self.generated_bytes())
+
+    # peak calling, annotation and motifs
+
+    def run_macs2_callpeak(self):
+        outdir, name = self.option('--outdir'), self.option('--name')
+        os.makedirs(outdir, exist_ok=True)
+        broad = '--broad' in self.args
+        with open(f'{outdir}/{name}_peaks.{"broadPeak" if broad else "narrowPeak"}', 'w') as fh:
+            for i, start in enumerate(peak_starts(size=self.generated_bytes())):
+                columns = [SAM_CHROM, start, start + 500, f'{name}_peak_{i + 1}', 100, '.', 5.0, 10.0, 8.0]
+                if not broad:
+                    columns.append(250)
+                fh.write('\t'.join(str(c) for c in columns) + '\n')
+        with open(f'{outdir}/{name}_peaks.xls', 'w') as fh:
+            fh.write(f'# This file is generated by MACS version {STUB_VERSION}\n# d = 200\n')
+        if '--bdg' in self.args or '-B' in self.args:
+            for suffix in ['treat_pileup.bdg', 'control_lambda.bdg']:
+                write_bedgraph(path=f'{outdir}/{name}_{suffix}', size=self.generated_bytes() * 100)
+
+    def run_macs2_bdgcmp(self):
+        write_bedgraph(path=self.option('-o'), size=self.input_bytes // 2)
+
+    def run_macs2_bdgbroadcall(self):
+        with open(self.option('-o'), 'w') as fh:
+            for i, start in enumerate(peak_starts(size=self.input_bytes // 1000)):
+                columns = [SAM_CHROM, start, start + 500, f'broadRegion{i + 1}', 100, '.', start, start + 500, 0,
+                           1, 500, 0, 5.0, 10.0, 8.0]
+                fh.write('\t'.join(str(c) for c in columns) + '\n')
+
+    def run_makeTagDirectory(self):
+        tag_dir = self.args[0]
+        os.makedirs(tag_dir, exist_ok=True)
+        with open(f'{tag_dir}/tagInfo.txt', 'w') as fh:
+            fh.write('name\tUnique Positions\tTotal Tags\n')
+        sam = self.positionals(options_with_value=['-format'])[-1]
+        if self.copy(inputs=[sam], output=None) > 0:  # as HOMER, tag files of chromosomes with reads only
+            write_bytes(path=f'{tag_dir}/{SAM_CHROM}.tags.tsv', size=self.generated_bytes())
+
+    def run_findPeaks(self):
+        with open(self.option('-o'), 'w') as fh:
+            fh.write('#PeakID\tchr\tstart\tend\tstrand\tNormalized Tag Count\n')
+            for i, start in enumerate(peak_starts(size=self.generated_bytes())):
+                fh.write(f'peak-{i + 1}\t{SAM_CHROM}\t{start}\t{start + 200}\t+\t50.0\n')
+
+    def run_annotatePeaks_pl(self):
+        peak_file = self.args[0]
+        print('PeakID\tChr\tStart\tEnd\tStrand\tAnnotation\tDistance to TSS\tGene Name')
+        with open(peak_file) as fh:
+            for i, line in enumerate(fh):
+                if not line.startswith('#'):
+                    print(f'peak-{i}\t{SAM_CHROM}\t1\t2\t+\tIntergenic\t1000\tSTUB{i}')
+
+    def run_findMotifsGenome_pl(self):
+        outdir = self.args[2]
+        os.makedirs(outdir, exist_ok=True)
+        with open(f'{outdir}/knownResults.txt', 'w') as fh:
+            fh.write('Motif Name\tConsensus\tP-value\n')
+        write_bytes(path=f'{outdir}/homerResults.html', size=self.generated_bytes())
+
+    def run_Rscript(self):
+        with open(self.args[0]) as fh:
+            for line in fh:
+                line = line.strip()
+                if line.startswith('pdf("'):
+                    write_bytes(path=line[len('pdf("'):line.index('")')], size=CHUNK_SIZE // 8)
+
+
+def spend(seconds: float, cpu: float, threads: int, memory_mb: float):
+    """
+    Holds memory_mb for `seconds`, busy on `threads` processes for the `cpu` fraction of the time
+    """
+    memory = bytearray(int(memory_mb * 1024 ** 2))
+    memory[::4096] = b'\x01' * len(range(0, len(memory), 4096))  # touch every page, so that it is resident
+
+    busy_until = time.time() + seconds * cpu
+    children = []
+    for _ in range(threads - 1):
+        pid = os.fork()
+        if pid == 0:
+            busy_loop(until=busy_until)
+            os._exit(0)
+        children.append(pid)
+    busy_loop(until=busy_until)
+    for pid in children:
+        os.waitpid(pid, 0)
+    time.sleep(seconds * (1 - cpu))
+
+
+def busy_loop(until: float):
+    x = 0
+    while time.time() < until:
+        for i in range(10000):
+            x += i * i
+
+
+def write_sam(out: IO[str], size: int):
+    """
+    Coordinate-sorted read pairs, with both mates of a pair at the same position
+    and the last two of every ten pairs at the same position as duplicates
+    """
+    out.write(f'@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:{SAM_CHROM}\tLN:{SAM_CHROM_LENGTH}\n')
+    seq, qual = 'ACGT' * 12 + 'AC', 'I' * 50
+    written, i = 0, 0
+    while written < size:
+        pos = 1 + (i // 10 * 10 + min(i % 10, 8)) * 37
+        lines = (
+            f'stub{i}\t99\t{SAM_CHROM}\t{pos}\t42\t50M\t=\t{pos}\t50\t{seq}\t{qual}\n'
+            f'stub{i}\t147\t{SAM_CHROM}\t{pos}\t42\t50M\t=\t{pos}\t-50\t{seq}\t{qual}\n'
+        )
+        out.write(lines)
+        written += len(lines)
+        i += 1
+
+
+def write_bedgraph(path: str, size: int):
+    with open(path, 'w') as fh:
+        written, start = 0, 0
+        while written < size:
+            line = f'{SAM_CHROM}\t{start}\t{start + 50}\t1.0\n'
+            fh.write(line)
+            written += len(line)
+            start += 50
+
+
+def write_bytes(path: str, size: int):
+    with open(path, 'wb') as fh:
+        while size > 0:
+            n = min(size, CHUNK_SIZE)
+            fh.write(b'\0' * n)
+            size -= n
+
+
+def peak_starts(size: int) -> List[int]:
+    n = max(1, size // 60)  # about 60 bytes per peak line
+    return [1000 + i * 2000 for i in range(n)]
+
+
+def path_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(path_size(f'{path}/{f}') for f in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def is_fifo(path: str) -> bool:
+    return os.path.exists(path) and not os.path.isfile(path) and not os.path.isdir(path)
+
+
+def open_fastq(path: str) -> IO[str]:
+    return gzip.open(path, 'rt') if path.endswith('.gz') else open(path)
+
+
+def copy_fastq(src: str, dst: str):
+    """
+    Decompresses or compresses as the suffix of dst says
+    """
+    with open_fastq(src) as reader:
+        with (gzip.open(dst, 'wt', compresslevel=1) if dst.endswith('.gz') else open(dst, 'w')) as writer:
+            shutil.copyfileobj(reader, writer)
+
+
+def get_fq_filename(f: str) -> str:
+    """
+    As in trimming.get_fq_filename, which names the output of trim_galore
+    """
+    f = os.path.basename(f)
+    for suffix in ['.fq', '.fq.gz', '.fastq', '.fastq.gz']:
+        if f.endswith(suffix):
+            f = f[:-len(suffix)]
+    return f
+
+
+def main():
+    assert sys.argv[1] == '--cost-model', 'Usage: stub_tools.py --cost-model <json> <tool> [args...]'
+    with open(sys.argv[2]) as fh:
+        cost_model = json.load(fh)
+    sys.exit(StubTool(tool=sys.argv[3], args=sys.argv[4:], cost_model=cost_model).main())
+
+
+if __name__ == '__main__':
+    main()
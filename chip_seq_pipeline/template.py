@@ -1,6 +1,153 @@
+import re
+import copy
+import time
+import resource
+import threading
 import subprocess
 from abc import ABC
 from datetime import datetime
+from contextlib import contextmanager
+from typing import Iterator, ContextManager, Optional, Dict
+from .profiling import Profiler, read_proc_io
+from .executor import Executor, LocalExecutor
+
+
+class CoreAllocator:
+    """
+    A budget of CPU cores shared by all concurrent stages, Pool workers and external commands of a run
+
+    A reservation blocks until enough cores are free, and nested reservations in the same thread
+    are served from the outer one, so that a command run within a reservation does not reserve again
+
+    Reservations can belong to groups (e.g. samples of a batch), in which case each reservation is capped
+    at a fair share of the total among the groups currently holding or waiting for cores
+    """
+
+    total: int
+    used: int
+    active_groups: Dict[Optional[str], int]  # group -> number of reservations held or waiting
+    condition: threading.Condition
+    local: threading.local
+
+    def __init__(self, total: int):
+        self.total = max(1, total)
+        self.used = 0
+        self.active_groups = {}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    def held(self) -> int:
+        """
+        Cores reserved by the current thread
+        """
+        return getattr(self.local, 'cores', 0)
+
+    @contextmanager
+    def reserve(self, cores: int, group: Optional[str] = None) -> Iterator[int]:
+        held = self.held()
+        if held > 0:
+            yield min(cores, held)
+            return
+
+        with self.condition:
+            self.active_groups[group] = self.active_groups.get(group, 0) + 1
+            while True:
+                fair_share = max(1, self.total // len(self.active_groups))
+                granted = max(1, min(cores, fair_share))
+                if self.total - self.used >= granted:
+                    break
+                self.condition.wait()
+            self.used += granted
+
+        self.local.cores = granted
+        try:
+            yield granted
+        finally:
+            self.local.cores = 0
+            with self.condition:
+                self.used -= granted
+                self.active_groups[group] -= 1
+                if self.active_groups[group] == 0:
+                    self.active_groups.pop(group)
+                self.condition.notify_all()
+
+
+class MemoryAllocator:
+    """
+    Admission control of external commands by their peak memory (GB)
+
+    A command is admitted only when its estimated peak memory fits in what is not yet reserved.
+    The capacity is either configured or read from MemAvailable of /proc/meminfo.
+    Estimates are declared by the caller, or learned from the peak RSS of earlier runs of the same tool.
+    """
+
+    DEFAULT_ESTIMATE_GB = 0.5
+
+    capacity_gb: float
+    used_gb: float
+    learned_gb: Dict[str, float]
+    condition: threading.Condition
+    local: threading.local
+
+    def __init__(self, capacity_gb: Optional[float]):
+        self.capacity_gb = get_available_memory_gb() if capacity_gb is None else capacity_gb
+        self.used_gb = 0.
+        self.learned_gb = {}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    def estimate(self, tool: str, declared_gb: Optional[float]) -> float:
+        estimates = [self.learned_gb.get(tool, self.DEFAULT_ESTIMATE_GB)]
+        if declared_gb is not None:
+            estimates.append(declared_gb)
+        return max(estimates)
+
+    def learn(self, tool: str, peak_gb: float):
+        with self.condition:
+            self.learned_gb[tool] = max(peak_gb, self.learned_gb.get(tool, 0.))
+
+    @contextmanager
+    def reserve(self, gb: float) -> Iterator[float]:
+        held = getattr(self.local, 'gb', 0.)
+        if held > 0:
+            yield min(gb, held)
+            return
+
+        gb = min(gb, self.capacity_gb)  # a command larger than the capacity still runs, but alone
+        with self.condition:
+            while self.used_gb > 0 and self.used_gb + gb > self.capacity_gb:
+                self.condition.wait()
+            self.used_gb += gb
+
+        self.local.gb = gb
+        try:
+            yield gb
+        finally:
+            self.local.gb = 0.
+            with self.condition:
+                self.used_gb -= gb
+                self.condition.notify_all()
+
+
+def get_available_memory_gb() -> float:
+    try:
+        with open('/proc/meminfo') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024 ** 2  # kB -> GB
+    except FileNotFoundError:
+        pass
+    return float('inf')
+
+
+def get_tool_name(cmd: str) -> str:
+    """
+    'samtools sort -@ 4 ...' -> 'samtools sort', 'Rscript path/to/covplot.R' -> 'Rscript'
+    """
+    words = cmd.split()
+    if len(words) > 1 and re.fullmatch(r'[A-Za-z][\w-]*', words[1]):
+        return ' '.join(words[:2])
+    return words[0]
 
 
 class Settings:
@@ -8,22 +155,56 @@ class Settings:
     workdir: str
     outdir: str
     threads: int
+    max_memory_gb: Optional[float]
     debug: bool
     mock: bool
+    keep_workdir: bool
+
+    group: Optional[str]
+    cpu: CoreAllocator
+    memory: MemoryAllocator
+    profiler: Profiler
+    executor: Executor
 
     def __init__(
             self,
             workdir: str,
             outdir: str,
             threads: int,
+            max_memory_gb: Optional[float],
             debug: bool,
-            mock: bool):
+            mock: bool,
+            executor: Optional[Executor] = None,
+            keep_workdir: bool = False):
+        """
+        executor: backend running external commands, by default on the current host
+        keep_workdir: keep the workdir (and its task manifests) at the end of the run, e.g. to resume it later
+        """
 
         self.workdir = workdir
         self.outdir = outdir
         self.threads = threads
+        self.max_memory_gb = max_memory_gb
         self.debug = debug
         self.mock = mock
+        self.keep_workdir = keep_workdir
+
+        self.group = None
+        self.cpu = CoreAllocator(total=threads)
+        self.memory = MemoryAllocator(capacity_gb=max_memory_gb)
+        self.profiler = Profiler()
+        self.executor = LocalExecutor() if executor is None else executor
+
+    def derive(self, workdir: str, outdir: str, group: str) -> 'Settings':
+        """
+        Settings for a part of the run, e.g. one sample of a batch,
+        which shares the core and memory budgets, the profiler and the executor with the whole run
+        """
+        settings = copy.copy(self)
+        settings.workdir = workdir
+        settings.outdir = outdir
+        settings.group = group
+        return settings
 
 
 class Logger:
@@ -77,7 +258,81 @@ class Processor(ABC):
             level=Logger.DEBUG if self.debug else Logger.INFO
         )
 
-    def call(self, cmd: str):
-        self.logger.info(cmd)
-        if not self.mock:
-            subprocess.check_call(cmd, shell=True)
+    def reserve_cores(self, cores: int) -> ContextManager[int]:
+        """
+        Reserves up to `cores` from the run's core budget, e.g.
+
+        with self.reserve_cores(self.threads) as cores:
+            self.call(f'bowtie2 --threads {cores} ...')
+        """
+        return self.settings.cpu.reserve(cores=min(cores, self.threads), group=self.settings.group)
+
+    @contextmanager
+    def reserve_memory(self, gb: float) -> Iterator[float]:
+        """
+        Reserves memory (GB) for commands whose memory flags are set by the caller, e.g.
+
+        with self.reserve_memory(8) as gb:
+            self.call(f'gatk --java-options "-Xmx{int(gb)}g" ...')
+        """
+        with self.reserve_cores(1):  # cores are always reserved before memory, to avoid deadlock
+            with self.settings.memory.reserve(gb=gb) as gb:
+                yield gb
+
+    def call(self, cmd: str, memory_gb: Optional[float] = None):
+        """
+        Reserves one core and the peak memory of the command, unless the caller already holds reservations,
+        and runs the command with the executor of the run, e.g. on the current host or as a batch job
+
+        memory_gb: declared peak memory estimate, otherwise learned from earlier runs of the same tool
+        """
+        tool = get_tool_name(cmd)
+        with self.reserve_memory(self.settings.memory.estimate(tool=tool, declared_gb=memory_gb)) as gb:
+            self.logger.info(cmd)
+            if not self.mock:
+                peak_gb = self.__run(cmd=cmd, tool=tool, cores=self.settings.cpu.held(), memory_gb=gb)
+                self.settings.memory.learn(tool=tool, peak_gb=peak_gb)
+
+    def __run(self, cmd: str, tool: str, cores: int, memory_gb: float) -> float:
+        execution = self.settings.executor.run(cmd=cmd, cores=cores, memory_gb=memory_gb)
+
+        self.settings.profiler.add(
+            stage=self.__class__.__name__,
+            command=tool,
+            start=execution.start,
+            wall_seconds=execution.wall_seconds,
+            user_seconds=execution.user_seconds,
+            sys_seconds=execution.sys_seconds,
+            peak_rss_mb=execution.peak_rss_mb,
+            read_bytes=execution.read_bytes,
+            write_bytes=execution.write_bytes)
+
+        if execution.returncode != 0:
+            raise subprocess.CalledProcessError(returncode=execution.returncode, cmd=cmd)
+        return execution.peak_rss_mb / 1024  # MB -> GB
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """
+        Profiles a Python-side stage running in the current thread, e.g.
+
+        with self.profile():
+            self.parse_lines_and_set_data()
+        """
+        who = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+        start, t0 = datetime.now(), time.time()
+        usage0, io0 = resource.getrusage(who), read_proc_io('/proc/thread-self/io')
+        try:
+            yield
+        finally:
+            usage1, io1 = resource.getrusage(who), read_proc_io('/proc/thread-self/io')
+            self.settings.profiler.add(
+                stage=self.__class__.__name__,
+                command=None,
+                start=str(start),
+                wall_seconds=time.time() - t0,
+                user_seconds=usage1.ru_utime - usage0.ru_utime,
+                sys_seconds=usage1.ru_stime - usage0.ru_stime,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                read_bytes=io1.get('rchar', 0) - io0.get('rchar', 0),
+                write_bytes=io1.get('wchar', 0) - io0.get('wchar', 0))
@@ -1,5 +1,11 @@
 import os
-from typing import Optional
+import re
+import subprocess
+from contextlib import contextmanager
+from typing import Optional, Iterator
+
+
+UNKNOWN_VERSION = 'unknown'
 
 
 def get_temp_path(
@@ -29,3 +35,34 @@ def edit_fpath(
         dstdir = os.path.dirname(fpath)
 
     return f'{dstdir}/{f}'
+
+
+def get_tool_version(cmd: str) -> str:
+    """
+    Runs a command that prints the version of a tool, e.g. 'bowtie2 --version',
+    and returns the version string found in stdout or stderr, or UNKNOWN_VERSION if none is found, e.g. of a missing tool
+    """
+    p = subprocess.run(['bash', '-c', cmd], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = p.stdout.decode(errors='replace')
+    for pattern in [
+        r'[Vv]ersion:?\s*v?(\S+)',  # e.g. 'bowtie2-build-s version 2.5.1', 'Version: 0.7.17-r1188'
+        r'\bv?(\d+(?:\.\d+)+[\w.-]*)',  # e.g. 'samtools 1.17', 'The Genome Analysis Toolkit (GATK) v4.4.0.0'
+    ]:
+        match = re.search(pattern, output)
+        if match:
+            return match.group(1)
+    return UNKNOWN_VERSION
+
+
+@contextmanager
+def named_pipe(fpath: str) -> Iterator[str]:
+    """
+    A fifo through which one command streams data into another, e.g. 'tee {fifo}' into 'samtools stats {fifo}'
+    """
+    if os.path.exists(fpath):  # left over by an interrupted run
+        os.remove(fpath)
+    os.mkfifo(fpath)
+    try:
+        yield fpath
+    finally:
+        os.remove(fpath)
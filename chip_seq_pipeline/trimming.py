@@ -1,10 +1,20 @@
 import os
+import re
 from os.path import basename
 from functools import partial
-from typing import Tuple, Optional, Callable
+from typing import Tuple, Optional, Callable, List
 from .template import Processor
 
 
+STREAM = 'stream'
+UNCOMPRESSED = 'uncompressed'
+GZIP = 'gzip'
+TRIM_OUTPUTS = [STREAM, UNCOMPRESSED, GZIP]
+
+# e.g. 'Total reads processed:  1,000', 'Quality-trimmed:  1,234 bp (0.5%)'
+REPORT_COUNT_PATTERN = re.compile(r'^([A-Z][^:]*):\s+([\d,]+)( bp)?(?:\s+\([\d.]+%\))?$')
+
+
 class Trimming(Processor):
 
     treatment_fq1: str
@@ -62,13 +72,13 @@ class Trimming(Processor):
 class TrimGalore(Processor):
 
     MAX_N = 0
-    CUTADAPT_TOTAL_CORES = 2
-    # According to the help message of trim_galore, 2 cores for cutadapt -> actually up to 9 cores
+    FASTQC_MAX_THREADS = 2  # one FastQC thread per fastq file
 
     fq1: str
     fq2: str
     base_quality_cutoff: int
     min_read_length: int
+    compress: bool
 
     out_fq1: str
     out_fq2: str
@@ -78,12 +88,18 @@ class TrimGalore(Processor):
             fq1: str,
             fq2: str,
             base_quality_cutoff: int,
-            min_read_length: int) -> Tuple[str, str]:
+            min_read_length: int,
+            compress: bool = True) -> Tuple[str, str]:
+        """
+        compress: False to write uncompressed trimmed reads, which are intermediate files read once by the aligner,
+            so that they are not gzipped at full level only to be decompressed again
+        """
 
         self.fq1 = fq1
         self.fq2 = fq2
         self.base_quality_cutoff = base_quality_cutoff
         self.min_read_length = min_read_length
+        self.compress = compress
 
         self.execute()
         self.set_out_fq1_fq2()
@@ -92,43 +108,293 @@ class TrimGalore(Processor):
         return self.out_fq1, self.out_fq2
 
     def execute(self):
-        args = [
-            'trim_galore',
-            '--paired',
-            f'--quality {self.base_quality_cutoff}',
-            '--phred33',
-            f'--cores {self.CUTADAPT_TOTAL_CORES}',
-            f'--fastqc_args "--threads {self.threads}"',
-            '--illumina',
-            f'--length {self.min_read_length}',
-            f'--max_n {self.MAX_N}',
-            '--trim-n',
-            '--gzip',
-            f'--output_dir {self.workdir}'
-        ]
+        with self.reserve_cores(self.requested_cores()) as cores:
+            args = [
+                'trim_galore',
+                '--paired',
+                f'--quality {self.base_quality_cutoff}',
+                '--phred33',
+                f'--cores {cutadapt_cores(total_cores=cores)}',
+            ] + self.fastqc_args(cores=cores) + [
+                '--illumina',
+                f'--length {self.min_read_length}',
+                f'--max_n {self.MAX_N}',
+                '--trim-n',
+                '--gzip' if self.compress else '--dont_gzip',
+                f'--output_dir {self.output_dir()}'
+            ]
 
-        log = f'{self.outdir}/trim_galore.log'
-        args += [
-            self.fq1,
-            self.fq2,
-            f'1>> {log} 2>> {log}'
-        ]
+            log = f'{self.outdir}/trim_galore.log'
+            args += [
+                self.fq1,
+                self.fq2,
+                f'1>> {log} 2>> {log}'
+            ]
+
+            self.call(self.CMD_LINEBREAK.join(args))
+
+    def requested_cores(self) -> int:
+        return self.threads
+
+    def fastqc_args(self, cores: int) -> List[str]:
+        return [f'--fastqc_args "--threads {min(cores, self.FASTQC_MAX_THREADS)}"']  # implies --fastqc
 
-        self.call(self.CMD_LINEBREAK.join(args))
+    def output_dir(self) -> str:
+        return self.workdir
 
     def set_out_fq1_fq2(self):
-        self.out_fq1 = f'{self.workdir}/{get_fq_filename(self.fq1)}_val_1.fq.gz'
-        self.out_fq2 = f'{self.workdir}/{get_fq_filename(self.fq2)}_val_2.fq.gz'
+        suffix = '.fq.gz' if self.compress else '.fq'
+        self.out_fq1 = f'{self.output_dir()}/{get_fq_filename(self.fq1)}_val_1{suffix}'
+        self.out_fq2 = f'{self.output_dir()}/{get_fq_filename(self.fq2)}_val_2{suffix}'
 
     def move_fastqc_report(self):
         dstdir = f'{self.outdir}/fastqc'
         os.makedirs(dstdir, exist_ok=True)
-        for suffix in [
-            'fastqc.html',
-            'fastqc.zip',
-            'trimming_report.txt'
-        ]:
-            self.call(f'mv {self.workdir}/*{suffix} {dstdir}/')
+        # only move the reports of this pair, as other pairs may be trimmed concurrently in the same workdir
+        for i, fq in [(1, self.fq1), (2, self.fq2)]:
+            for f in [
+                f'{get_fq_filename(fq)}_val_{i}_fastqc.html',
+                f'{get_fq_filename(fq)}_val_{i}_fastqc.zip',
+                f'{basename(fq)}_trimming_report.txt',
+            ]:
+                self.call(f'mv {self.workdir}/{f} {dstdir}/')
+
+
+class TrimGaloreChunk(TrimGalore):
+    """
+    Trims a chunk of a fastq pair without FastQC, writing the trimmed reads and trimming reports beside the chunk,
+    to be merged with those of the other chunks by MergeTrimmedChunks
+    """
+
+    MIN_CORES = 4  # trim_galore itself, one cutadapt and the (de)compressing processes
+
+    chunks: int
+
+    def main(
+            self,
+            fq1: str,
+            fq2: str,
+            base_quality_cutoff: int,
+            min_read_length: int,
+            compress: bool = True,
+            chunks: int = 1) -> Tuple[str, str]:
+        """
+        chunks: total number of chunks trimmed concurrently, which share the cores
+        """
+        self.chunks = chunks
+        return super().main(
+            fq1=fq1,
+            fq2=fq2,
+            base_quality_cutoff=base_quality_cutoff,
+            min_read_length=min_read_length,
+            compress=compress)
+
+    def requested_cores(self) -> int:
+        return max(self.MIN_CORES, self.threads // self.chunks)
+
+    def fastqc_args(self, cores: int) -> List[str]:
+        return []
+
+    def output_dir(self) -> str:
+        return os.path.dirname(self.fq1)
+
+    def move_fastqc_report(self):
+        pass
+
+
+class MergeTrimmedChunks(Processor):
+    """
+    Concatenates the trimmed reads of chunks into one pair of fastq files, as is for gzip files,
+    which are valid as concatenated gzip members, and merges the trimming reports of the chunks into one per read
+    """
+
+    fq1: str
+    fq2: str
+    chunk_fqs: List[Tuple[str, str]]
+    trimmed_chunk_fqs: List[Tuple[str, str]]
+
+    out_fq1: str
+    out_fq2: str
+
+    def main(
+            self,
+            fq1: str,
+            fq2: str,
+            chunk_fqs: List[Optional[Tuple[str, str]]],
+            trimmed_chunk_fqs: List[Optional[Tuple[str, str]]]) -> Tuple[str, str]:
+        """
+        fq1, fq2: the untrimmed pair, after which the merged files and reports are named, as with TrimGalore
+        chunk_fqs: untrimmed chunks from SplitFastqPair, None for a chunk without reads
+        trimmed_chunk_fqs: trimmed chunks from TrimGaloreChunk, None for a chunk without reads
+        """
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.chunk_fqs = [c for c in chunk_fqs if c is not None]
+        self.trimmed_chunk_fqs = [c for c in trimmed_chunk_fqs if c is not None]
+
+        self.concatenate()
+        self.merge_reports()
+
+        return self.out_fq1, self.out_fq2
+
+    def concatenate(self):
+        suffix = '.fq.gz' if self.trimmed_chunk_fqs[0][0].endswith('.gz') else '.fq'
+        self.out_fq1 = f'{self.workdir}/{get_fq_filename(self.fq1)}_val_1{suffix}'
+        self.out_fq2 = f'{self.workdir}/{get_fq_filename(self.fq2)}_val_2{suffix}'
+        for i, out in [(0, self.out_fq1), (1, self.out_fq2)]:
+            chunks = ' '.join(c[i] for c in self.trimmed_chunk_fqs)
+            self.call(f'cat {chunks} > {out}')
+
+    def merge_reports(self):
+        dstdir = f'{self.outdir}/fastqc'
+        os.makedirs(dstdir, exist_ok=True)
+        for i, fq in [(0, self.fq1), (1, self.fq2)]:
+            reports = [f'{os.path.dirname(c[i])}/{basename(c[i])}_trimming_report.txt' for c in self.chunk_fqs]
+            with self.profile():
+                merge_trimming_reports(
+                    reports=reports,
+                    output=f'{dstdir}/{basename(fq)}_trimming_report.txt',
+                    title=f'Trimming report of {fq}, merged from {len(reports)} chunks')
+
+
+def merge_trimming_reports(reports: List[str], output: str, title: str):
+    """
+    Sums up the counts of the summary of cutadapt reports, e.g. 'Total reads processed: 1,000',
+    and the pair validation count of trim_galore, followed by the report of each chunk as is
+    """
+    totals = {}  # label -> (count, unit), in the order of the first report
+    texts = []
+    for report in reports:
+        with open(report) as fh:
+            text = fh.read()
+        texts.append(text)
+        in_summary = False
+        for line in text.splitlines():
+            if line.startswith('==='):
+                in_summary = line.strip() == '=== Summary ==='
+                continue
+            match = REPORT_COUNT_PATTERN.match(line.strip())
+            if match and (in_summary or line.startswith('Number of sequence pairs removed')):
+                label, count, unit = match.group(1), int(match.group(2).replace(',', '')), match.group(3) or ''
+                totals[label] = (totals.get(label, (0, unit))[0] + count, unit)
+
+    with open(output, 'w') as fh:
+        fh.write(f'{title}\n\n=== Summary ===\n\n')
+        for label, (count, unit) in totals.items():
+            fh.write(f'{label}: {count:,}{unit}\n')
+        for report, text in zip(reports, texts):
+            fh.write(f'\n\n=== Chunk report: {basename(report)} ===\n\n{text}')
+
+
+class FastQC(Processor):
+    """
+    FastQC of the untrimmed reads, as a task of its own, when trimming is split into chunks
+    """
+
+    def main(self, fq1: str, fq2: str):
+        dstdir = f'{self.outdir}/fastqc'
+        os.makedirs(dstdir, exist_ok=True)
+        log = f'{self.outdir}/fastqc.log'
+        with self.reserve_cores(TrimGalore.FASTQC_MAX_THREADS) as cores:
+            cmd = self.CMD_LINEBREAK.join([
+                'fastqc',
+                f'--threads {cores}',
+                f'--outdir {dstdir}',
+                fq1,
+                fq2,
+                f'1>> {log} 2>> {log}',
+            ])
+            self.call(cmd)
+
+
+class TrimmingStream:
+    """
+    Trims a pair of fastq files with cutadapt, with the options trim_galore passes to it,
+    into one interleaved stream of read pairs on stdout, which is piped into the aligner,
+    so that the trimmed reads are never written to disk
+
+    The stream is also teed into a named pipe, from which it is de-interleaved into one FastQC per read,
+    so that the trimming report and the FastQC reports of the trimmed R1 and R2 are written to outdir/fastqc,
+    named as with trim_galore
+    """
+
+    ADAPTER = 'AGATCGGAAGAGC'  # trim_galore --illumina
+    STRINGENCY = 1  # trim_galore default, minimum overlap with the adapter
+
+    fq1: str
+    fq2: str
+    base_quality_cutoff: int
+    min_read_length: int
+
+    def __init__(
+            self,
+            fq1: str,
+            fq2: str,
+            base_quality_cutoff: int,
+            min_read_length: int):
+
+        self.fq1 = fq1
+        self.fq2 = fq2
+        self.base_quality_cutoff = base_quality_cutoff
+        self.min_read_length = min_read_length
+
+    def cutadapt_args(self, cores: int, report_dir: str) -> List[str]:
+        """
+        Pairs are discarded if either read is shorter than min_read_length or has N,
+        which is what the pair validation of trim_galore does
+        """
+        return [
+            'cutadapt',
+            f'--cores {cores}',
+            f'--quality-cutoff {self.base_quality_cutoff}',
+            f'--adapter {self.ADAPTER}',
+            f'-A {self.ADAPTER}',
+            f'--overlap {self.STRINGENCY}',
+            '--trim-n',
+            f'--max-n {TrimGalore.MAX_N}',
+            f'--minimum-length {self.min_read_length}',
+            '--pair-filter any',
+            '--interleaved',
+            self.fq1,
+            self.fq2,
+            f'2> {report_dir}/{basename(self.fq1)}_trimming_report.txt',
+        ]
+
+    def deinterleave_args(self, fifo: str, fifo1: str, fifo2: str) -> List[str]:
+        """
+        Writes the first four lines of every eight lines of the interleaved stream, i.e. R1, into fifo1, and R2 into fifo2
+        """
+        return [
+            'awk',
+            f'-v r1={fifo1}',
+            f'-v r2={fifo2}',
+            "'{ print > ((NR - 1) % 8 < 4 ? r1 : r2) }'",
+            fifo,
+        ]
+
+    def fastqc_args(self, read: int, fifo: str, report_dir: str, log: str) -> List[str]:
+        """
+        FastQC reads the fifo of R1 (read 1) or R2 (read 2) as stdin,
+        the report is named as with trim_galore, e.g. 'sample_R2_val_2_fastqc.html'
+        """
+        fq = self.fq1 if read == 1 else self.fq2
+        return [
+            'fastqc',
+            '--threads 1',
+            f'--outdir {report_dir}',
+            f'stdin:{get_fq_filename(fq)}_val_{read}',
+            f'< {fifo}',
+            f'1>> {log} 2>> {log}',
+        ]
+
+
+def cutadapt_cores(total_cores: int) -> int:
+    """
+    According to the help message of trim_galore, --cores N actually uses up to
+    N (read) + N (write) + N (cutadapt) + 2 (extra cutadapt) + 1 (trim_galore) = 3N + 3 cores,
+    e.g. 2 cores for cutadapt -> up to 9 cores
+    """
+    return max(1, (total_cores - 3) // 3)
 
 
 def get_fq_filename(f: str) -> str:
@@ -1,8 +1,9 @@
 import os
 import shutil
 import unittest
+import subprocess
 import pandas as pd
-from typing import Tuple
+from typing import Tuple, Dict
 from chip_seq_pipeline.template import Settings
 
 
@@ -26,6 +27,7 @@ class TestCase(unittest.TestCase):
             workdir=self.workdir,
             outdir=self.outdir,
             threads=6,
+            max_memory_gb=None,
             debug=True,
             mock=False)
 
@@ -51,3 +53,20 @@ class TestCase(unittest.TestCase):
     def assertFileExists(self, expected: str, actual: str):
         self.assertEqual(expected, actual)
         assert os.path.exists(actual)
+
+
+def read_markdup_metrics(path: str) -> Dict[str, int]:
+    """
+    'DUPLICATE TOTAL: 123' lines of samtools markdup -f
+    """
+    ret = {}
+    with open(path) as fh:
+        for line in fh:
+            key, _, value = line.strip().partition(': ')
+            if value.isdigit():
+                ret[key] = int(value)
+    return ret
+
+
+def count_reads(bam: str, flags: str) -> int:
+    return int(subprocess.check_output(f'samtools view -c {flags} {bam}', shell=True))
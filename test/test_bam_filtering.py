@@ -0,0 +1,105 @@
+import subprocess
+from os.path import exists
+from chip_seq_pipeline.bam_filtering import FilterBam, read_bed, subtract_intervals, fragment_span, overlaps
+from .setup import TestCase
+
+
+class TestFilterBam(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        blacklist = f'{self.workdir}/blacklist.bed'
+        with open(blacklist, 'w') as fh:
+            fh.write('chr22\t16000000\t17000000\n')
+
+        actual = FilterBam(self.settings).main(
+            bam=f'{self.indir}/sorted-treatment.bam',
+            min_mapq=30,
+            keep_improper_pairs=False,
+            contigs='primary',
+            blacklist=blacklist)
+
+        self.assertFileExists(f'{self.workdir}/sorted-treatment-filtered.bam', actual)
+        self.assertTrue(exists(f'{actual}.bai'))
+
+    def test_pairs(self):
+        """
+        Pairs are kept or removed together: one mate of low mapping quality, a fragment spanning the blacklist
+        with neither mate in it, and one mate overlapping the edge of the blacklist remove the whole pair
+        """
+        blacklist = f'{self.workdir}/blacklist.bed'
+        with open(blacklist, 'w') as fh:
+            fh.write('chr1\t50000\t50100\n')
+
+        seq, qual = 'A' * 50, 'I' * 50
+        pairs = [
+            # name, pos, mapq, mate pos, mate mapq
+            ('kept', 1001, 40, 1201, 40),
+            ('low-mapq-mate', 2001, 40, 2201, 5),
+            ('spanning-blacklist', 49801, 40, 50201, 40),
+            ('blacklist-edge', 49981, 40, 50301, 40),
+            ('kept-downstream', 60001, 40, 60201, 40),
+        ]
+        sam = f'{self.workdir}/pairs.sam'
+        with open(sam, 'w') as fh:
+            fh.write('@HD\tVN:1.6\tSO:coordinate\n@SQ\tSN:chr1\tLN:100000\n')
+            for name, pos, mapq, mate_pos, mate_mapq in pairs:
+                tlen = mate_pos + 50 - pos
+                fh.write(f'{name}\t99\tchr1\t{pos}\t{mapq}\t50M\t=\t{mate_pos}\t{tlen}\t{seq}\t{qual}\tMQ:i:{mate_mapq}\n')
+                fh.write(f'{name}\t147\tchr1\t{mate_pos}\t{mate_mapq}\t50M\t=\t{pos}\t{-tlen}\t{seq}\t{qual}\tMQ:i:{mapq}\n')
+        bam = f'{self.workdir}/pairs.bam'
+        subprocess.check_call(f'samtools sort -o {bam} {sam} && samtools index {bam}', shell=True)
+
+        actual = FilterBam(self.settings).main(
+            bam=bam,
+            min_mapq=30,
+            keep_improper_pairs=False,
+            contigs='all',
+            blacklist=blacklist)
+
+        names = subprocess.check_output(f'samtools view {actual} | cut -f 1', shell=True, text=True).split()
+        self.assertEqual(['kept', 'kept', 'kept-downstream', 'kept-downstream'], names)
+
+    def test_fragment_span(self):
+        self.assertEqual((1000, 1250), fragment_span(pos=1001, cigar='50M', tlen=250))
+        self.assertEqual((1000, 1250), fragment_span(pos=1201, cigar='50M', tlen=-250))
+        self.assertEqual((1000, 1052), fragment_span(pos=1001, cigar='20M2D30M5S', tlen=0))
+
+    def test_overlaps(self):
+        intervals = [(100, 200), (500, 600)]
+        self.assertTrue(overlaps(intervals=intervals, start=0, end=101))
+        self.assertTrue(overlaps(intervals=intervals, start=199, end=300))
+        self.assertTrue(overlaps(intervals=intervals, start=50, end=1000))
+        self.assertFalse(overlaps(intervals=intervals, start=0, end=100))
+        self.assertFalse(overlaps(intervals=intervals, start=200, end=500))
+        self.assertFalse(overlaps(intervals=[], start=0, end=100))
+
+    def test_is_kept_contig(self):
+        processor = FilterBam(self.settings)
+        processor.contigs = 'primary'
+        for contig in ['chr1', 'chr22', 'chrX', 'chrY', '1', 'X']:
+            self.assertTrue(processor.is_kept_contig(contig))
+        for contig in ['chrM', 'MT', 'chr1_KI270706v1_random', 'chrUn_GL000195v1', 'chrEBV', 'chr0']:
+            self.assertFalse(processor.is_kept_contig(contig))
+
+        processor.contigs = 'chr1,chrM'
+        self.assertTrue(processor.is_kept_contig('chrM'))
+        self.assertFalse(processor.is_kept_contig('chr2'))
+
+    def test_read_bed(self):
+        bed = f'{self.workdir}/blacklist.bed'
+        with open(bed, 'w') as fh:
+            fh.write('track name=blacklist\nchr1\t500\t600\nchr1\t100\t200\nchr1\t150\t300\nchr2\t0\t10\n')
+        self.assertEqual({'chr1': [(100, 300), (500, 600)], 'chr2': [(0, 10)]}, read_bed(bed))
+
+    def test_subtract_intervals(self):
+        self.assertEqual([(0, 1000)], subtract_intervals(size=1000, intervals=[]))
+        self.assertEqual(
+            [(0, 100), (300, 500), (600, 1000)],
+            subtract_intervals(size=1000, intervals=[(100, 300), (500, 600)]))
+        self.assertEqual([(10, 900)], subtract_intervals(size=1000, intervals=[(0, 10), (900, 1200)]))
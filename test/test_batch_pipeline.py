@@ -0,0 +1,124 @@
+import os
+import pandas as pd
+from chip_seq_pipeline.batch_pipeline import BatchPipeline, ReadSampleSheet
+from .setup import TestCase
+
+
+class TestReadSampleSheet(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        for fq in ['t1.fq.gz', 't2.fq.gz', 'c1.fq.gz', 'c2.fq.gz']:
+            open(f'{self.workdir}/{fq}', 'w').close()
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_sample_sheet(self, lines: list) -> str:
+        path = f'{self.workdir}/samples.tsv'
+        with open(path, 'w') as fh:
+            fh.write('\n'.join('\t'.join(line) for line in lines) + '\n')
+        return path
+
+    def test_main(self):
+        w = self.workdir
+        sample_sheet = self.write_sample_sheet([
+            ['sample_name', 'treatment_fq1', 'treatment_fq2', 'control_fq1', 'control_fq2'],
+            ['A', f'{w}/t1.fq.gz', f'{w}/t2.fq.gz', f'{w}/c1.fq.gz', f'{w}/c2.fq.gz'],
+            ['B', f'{w}/t1.fq.gz', f'{w}/t2.fq.gz', '', ''],
+        ])
+        samples = ReadSampleSheet(self.settings).main(sample_sheet=sample_sheet)
+        self.assertListEqual(['A', 'B'], [s.name for s in samples])
+        self.assertEqual(f'{w}/c2.fq.gz', samples[0].control_fq2)
+        self.assertIsNone(samples[1].control_fq1)
+
+    def test_without_control_columns(self):
+        w = self.workdir
+        sample_sheet = self.write_sample_sheet([
+            ['sample_name', 'treatment_fq1', 'treatment_fq2'],
+            ['A', f'{w}/t1.fq.gz', f'{w}/t2.fq.gz'],
+        ])
+        samples = ReadSampleSheet(self.settings).main(sample_sheet=sample_sheet)
+        self.assertIsNone(samples[0].control_fq2)
+
+    def test_duplicated_sample_names(self):
+        w = self.workdir
+        sample_sheet = self.write_sample_sheet([
+            ['sample_name', 'treatment_fq1', 'treatment_fq2'],
+            ['A', f'{w}/t1.fq.gz', f'{w}/t2.fq.gz'],
+            ['A', f'{w}/c1.fq.gz', f'{w}/c2.fq.gz'],
+        ])
+        with self.assertRaises(AssertionError):
+            ReadSampleSheet(self.settings).main(sample_sheet=sample_sheet)
+
+    def test_missing_fastq(self):
+        w = self.workdir
+        sample_sheet = self.write_sample_sheet([
+            ['sample_name', 'treatment_fq1', 'treatment_fq2'],
+            ['A', f'{w}/t1.fq.gz', f'{w}/missing.fq.gz'],
+        ])
+        with self.assertRaises(AssertionError):
+            ReadSampleSheet(self.settings).main(sample_sheet=sample_sheet)
+
+
+class TestBatchPipeline(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.threads = 2  # to avoid memory overload
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        i = f'{os.path.dirname(self.indir)}/test_chip_seq_pipeline'  # shares input files
+        sample_sheet = f'{self.workdir}/samples.tsv'
+        with open(sample_sheet, 'w') as fh:
+            fh.write('sample_name\ttreatment_fq1\ttreatment_fq2\tcontrol_fq1\tcontrol_fq2\n')
+            fh.write(f'KEAP1\t{i}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz\t{i}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz\t{i}/test_ATO_0_Input_S1_R1_001.fastq.gz\t{i}/test_ATO_0_Input_S1_R2_001.fastq.gz\n')
+            fh.write(f'KEAP1-no-control\t{i}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz\t{i}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz\t\t\n')
+            fh.write(f'KEAP1-same-control\t{i}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz\t{i}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz\t{i}/test_ATO_0_Input_S1_R1_001.fastq.gz\t{i}/test_ATO_0_Input_S1_R2_001.fastq.gz\n')
+
+        BatchPipeline(self.settings).main(
+            sample_sheet=sample_sheet,
+            ref_fa=f'{i}/chr22.fa',
+
+            base_quality_cutoff=20,
+            min_read_length=20,
+            trim_output='stream',
+            trimming_chunks=2,
+
+            read_aligner='bowtie2',
+            bowtie2_mode='sensitive',
+            alignment_chunks=2,
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
+            discard_bam=False,
+
+            skip_mark_duplicates=False,
+            markdup_engine='gatk',
+
+            filter_bam=False,
+            filter_min_mapq=30,
+            filter_keep_improper_pairs=False,
+            filter_contigs='primary',
+            filter_blacklist=None,
+
+            macs_effective_genome_size='hs',
+            macs_fdr=0.05,
+            macs_separate_calls=False,
+            homer_chromosome_groups=1,
+
+            genome_version='hg38',
+            peak_annotation_engine='homer',
+            gene_annotation=None,
+            skip_motif_finding=True,
+            motif_finding_fragment_size=20
+        )
+
+        for f in ['KEAP1/macs2', 'KEAP1-no-control/homer']:
+            self.assertTrue(os.path.exists(f'{self.outdir}/{f}'))
+        summary = pd.read_csv(f'{self.outdir}/summary.tsv', sep='\t')
+        self.assertListEqual(['KEAP1', 'KEAP1-no-control', 'KEAP1-same-control'], list(summary['sample_name']))
+        self.assertListEqual(['done', 'done', 'done'], list(summary['status']))
+        self.assertEqual(1, len(os.listdir(f'{self.outdir}/controls')))  # the shared control is processed once
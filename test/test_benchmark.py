@@ -0,0 +1,51 @@
+import gzip
+import pandas as pd
+from benchmark.simulate import simulate, parse_count
+from benchmark.suite import compare
+from .setup import TestCase
+
+
+class TestSimulate(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        sim = simulate(outdir=self.workdir, pairs=1000, chromosomes=2, chromosome_length=100_000, peaks=10)
+
+        self.assertEqual(200_000, sim.genome_size)
+        with open(sim.peaks_bed) as fh:
+            self.assertEqual(10, len(fh.readlines()))
+        for fq in [sim.chip_fq1, sim.chip_fq2, sim.input_fq1, sim.input_fq2]:
+            with gzip.open(fq, 'rt') as fh:
+                self.assertEqual(4 * 1000, len(fh.readlines()))
+
+    def test_parse_count(self):
+        self.assertEqual(1_000_000, parse_count('1M'))
+        self.assertEqual(500_000, parse_count('500k'))
+        self.assertEqual(2000, parse_count('2000'))
+
+
+class TestCompare(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        history = pd.DataFrame([
+            ['aaa111', '1M', 4, 'Mapping', 100., 400., 1000.],
+            ['aaa111', '1M', 4, 'Mapping', 110., 400., 1000.],
+            ['bbb222', '1M', 4, 'Mapping', 120., 410., 1000.],
+            ['bbb222', '1M', 4, 'PeakCalling', 10., 10., 500.],  # not at the base commit
+        ], columns=['commit', 'depth', 'threads', 'stage', 'wall_seconds', 'cpu_seconds', 'peak_rss_mb'])
+
+        df = compare(history=history, base='aaa', head='bbb', threshold=10.)
+
+        self.assertListEqual(['wall_seconds', 'cpu_seconds', 'peak_rss_mb'], list(df['metric']))
+        self.assertListEqual([True, False, False], list(df['regression']))  # 105 -> 120 is +14.3%
@@ -0,0 +1,68 @@
+import gzip
+from chip_seq_pipeline.bgzf import open_bgzf, block_offsets, is_bgzf, BLOCK_SIZE
+from .setup import TestCase
+
+
+class TestBgzf(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.data = b''.join(b'@read%d\nACGTTGCA\n+\nIIIIIIII\n' % i for i in range(100_000))
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_round_trip(self):
+        path = f'{self.workdir}/reads.fq.gz'
+        for threads in [1, 4]:
+            with open_bgzf(path, 'wb', threads=threads) as fh:
+                fh.write(self.data)
+            self.assertTrue(is_bgzf(path))
+            with open_bgzf(path, 'rb', threads=threads) as fh:
+                self.assertEqual(self.data, fh.read())
+
+    def test_readable_by_gzip(self):
+        path = f'{self.workdir}/reads.fq.gz'
+        with open_bgzf(path, 'wb', threads=2) as fh:
+            fh.write(self.data)
+        with gzip.open(path, 'rb') as fh:
+            self.assertEqual(self.data, fh.read())
+
+    def test_read_plain_gzip(self):
+        path = f'{self.workdir}/reads.fq.gz'
+        with gzip.open(path, 'wb') as fh:
+            fh.write(self.data)
+        with open(path, 'ab') as fh:  # a second gzip member
+            fh.write(gzip.compress(b'@last\nA\n+\nI\n'))
+        with open_bgzf(path, 'rt') as fh:
+            lines = fh.readlines()
+        self.assertEqual(4 * 100_001, len(lines))
+        self.assertEqual('@last\n', lines[-4])
+
+    def test_read_uncompressed(self):
+        path = f'{self.workdir}/reads.fq'
+        with open(path, 'wb') as fh:
+            fh.write(self.data)
+        with open_bgzf(path, 'rb') as fh:
+            self.assertEqual(self.data, fh.read())
+
+    def test_truncated_gzip(self):
+        path = f'{self.workdir}/reads.fq.gz'
+        with open(path, 'wb') as fh:
+            fh.write(gzip.compress(self.data)[:-100])
+        with self.assertRaises(EOFError):
+            with open_bgzf(path, 'rb') as fh:
+                fh.read()
+
+    def test_block_offsets(self):
+        path = f'{self.workdir}/reads.fq.gz'
+        with open_bgzf(path, 'wb', threads=2) as fh:
+            fh.write(self.data)
+        offsets = block_offsets(path)
+        self.assertEqual(len(self.data), sum(size for offset, size in offsets))
+        self.assertTrue(all(size == BLOCK_SIZE for offset, size in offsets[:-1]))
+
+        offset, size = offsets[-1]  # a block read from its offset on its own
+        with open(path, 'rb') as fh:
+            fh.seek(offset)
+            self.assertEqual(self.data[-size:], gzip.decompress(fh.read()))
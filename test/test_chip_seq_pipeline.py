@@ -1,4 +1,10 @@
+import os
+import json
+from glob import glob
+import chip_seq_pipeline
+from benchmark.simulate import simulate
 from chip_seq_pipeline import ChipSeqPipeline
+from chip_seq_pipeline.stub_tools import DEFAULT_COST_MODEL
 from .setup import TestCase
 
 
@@ -21,17 +27,33 @@ class TestChipSeqPipeline(TestCase):
 
             base_quality_cutoff=20,
             min_read_length=20,
+            trim_output='stream',
+            trimming_chunks=1,
 
             read_aligner='bowtie2',
             bowtie2_mode='sensitive',
+            alignment_chunks=1,
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
             discard_bam=False,
 
             skip_mark_duplicates=False,
+            markdup_engine='gatk',
+
+            filter_bam=False,
+            filter_min_mapq=30,
+            filter_keep_improper_pairs=False,
+            filter_contigs='primary',
+            filter_blacklist=None,
 
             macs_effective_genome_size='hs',
             macs_fdr=0.05,
+            macs_separate_calls=False,
+            homer_chromosome_groups=1,
 
             genome_version='hg38',
+            peak_annotation_engine='homer',
+            gene_annotation=None,
             skip_motif_finding=False,
             motif_finding_fragment_size=20
         )
@@ -46,17 +68,117 @@ class TestChipSeqPipeline(TestCase):
 
             base_quality_cutoff=20,
             min_read_length=20,
+            trim_output='gzip',
+            trimming_chunks=1,
 
             read_aligner='bowtie2',
             bowtie2_mode='sensitive',
+            alignment_chunks=1,
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
             discard_bam=False,
 
             skip_mark_duplicates=False,
+            markdup_engine='gatk',
+
+            filter_bam=False,
+            filter_min_mapq=30,
+            filter_keep_improper_pairs=False,
+            filter_contigs='primary',
+            filter_blacklist=None,
 
             macs_effective_genome_size='hs',
             macs_fdr=0.05,
+            macs_separate_calls=False,
+            homer_chromosome_groups=1,
 
             genome_version='hg38',
+            peak_annotation_engine='homer',
+            gene_annotation=None,
             skip_motif_finding=True,
             motif_finding_fragment_size=20
         )
+
+
+class TestResume(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.path = os.environ['PATH']
+        self.sim = simulate(outdir=f'{self.workdir}/sim', pairs=2000, chromosomes=2, chromosome_length=100_000, peaks=10)
+        self.cost_model_json = f'{self.workdir}/cost-model.json'
+        with open(self.cost_model_json, 'w') as fh:
+            json.dump({tool: {'seconds': 0., 'seconds_per_gb': 0.} for tool in DEFAULT_COST_MODEL}, fh)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path  # stub tools are put in front of PATH
+        self.tear_down()
+
+    def run_pipeline(self, resume: str, macs_fdr: float):
+        chip_seq_pipeline.main(
+            ref_fa=self.sim.genome_fa,
+            treatment_fq1=self.sim.chip_fq1,
+            treatment_fq2=self.sim.chip_fq2,
+            control_fq1=self.sim.input_fq1,
+            control_fq2=self.sim.input_fq2,
+            sample_sheet='None',
+
+            base_quality_cutoff=20,
+            min_read_length=20,
+            trim_output='stream',
+            trimming_chunks=1,
+
+            read_aligner='bowtie2',
+            bowtie2_mode='sensitive',
+            alignment_chunks=1,
+            index_cache_dir='None',
+            index_cache_max_gb=200.0,
+            discard_bam=False,
+
+            skip_mark_duplicates=False,
+            markdup_engine='samtools',
+
+            filter_bam=False,
+            filter_min_mapq=30,
+            filter_keep_improper_pairs=False,
+            filter_contigs='primary',
+            filter_blacklist='None',
+
+            macs_effective_genome_size='1000000',
+            macs_fdr=macs_fdr,
+            macs_separate_calls=False,
+            homer_chromosome_groups=1,
+
+            genome_version='hg38',
+            peak_annotation_engine='homer',
+            gene_annotation='None',
+            skip_motif_finding=True,
+            motif_finding_fragment_size=0,
+
+            outdir=f'{self.outdir}/pipeline',
+            threads=2,
+            max_memory_gb=0.,
+            executor='local',
+            executor_jobs=0,
+            max_job_memory_gb=0.,
+            slurm_options='None',
+            stub_tools=self.cost_model_json,
+            resume=resume,
+            keep_workdir=False,
+            debug=False)
+
+    def test_new_macs_fdr(self):
+        resume = f'{self.workdir}/pipeline'
+        self.run_pipeline(resume=resume, macs_fdr=0.05)
+        manifests = {
+            os.path.basename(f)[:-len('.json')]: os.stat(f).st_mtime_ns
+            for f in glob(f'{resume}/manifests/*.json')
+        }
+
+        self.run_pipeline(resume=resume, macs_fdr=0.01)
+
+        rerun = sorted(
+            name for name, mtime in manifests.items()
+            if os.stat(f'{resume}/manifests/{name}.json').st_mtime_ns != mtime)
+        self.assertListEqual(['chipseeker', 'peak-annotation', 'peak-calling'], rerun)
+        self.assertTrue(os.path.exists(f'{self.outdir}/pipeline/sorted-treatment-mark-duplicates.bam'))
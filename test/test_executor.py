@@ -0,0 +1,84 @@
+import os
+import subprocess
+from chip_seq_pipeline.template import Processor
+from chip_seq_pipeline.executor import LocalExecutor, PoolExecutor, BatchExecutor
+from .setup import TestCase
+
+
+FAKE_SBATCH = '''#!/bin/bash
+# runs the job script (last argument) in the background, and prints its PID as the job ID
+bash "${@: -1}" > /dev/null 2>&1 &
+echo $!
+'''
+
+FAKE_SQUEUE = '''#!/bin/bash
+# prints the job while its PID (last argument) is alive
+kill -0 "${@: -1}" 2> /dev/null && echo "${@: -1} RUNNING"
+exit 0
+'''
+
+
+class Dummy(Processor):
+
+    def main(self, cmd: str):
+        self.call(cmd)
+
+
+class TestExecutors(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def write_script(self, name: str, text: str) -> str:
+        path = f'{self.workdir}/{name}'
+        with open(path, 'w') as fh:
+            fh.write(text)
+        os.chmod(path, 0o755)
+        return path
+
+    def get_batch_executor(self) -> BatchExecutor:
+        sbatch = self.write_script(name='sbatch', text=FAKE_SBATCH)
+        squeue = self.write_script(name='squeue', text=FAKE_SQUEUE)
+        return BatchExecutor(
+            jobdir=f'{self.workdir}/batch-jobs',
+            poll_seconds=0.1,
+            submit_cmd=f'{sbatch} --parsable',
+            queue_cmd=f'{squeue} --noheader --jobs {{job_id}}',
+            cancel_cmd='kill {job_id}')
+
+    def test_local(self):
+        execution = LocalExecutor().run(cmd=f'echo hello > {self.workdir}/out.txt', cores=1, memory_gb=1.)
+        self.assertEqual(0, execution.returncode)
+        self.assertGreater(execution.write_bytes, 0)
+        self.assertEqual(1, LocalExecutor().run(cmd='false | cat', cores=1, memory_gb=1.).returncode)
+
+    def test_pool(self):
+        executor = PoolExecutor(max_jobs=2, max_job_memory_gb=1.)
+        execution = executor.run(cmd=f'ulimit -v > {self.workdir}/ulimit.txt', cores=1, memory_gb=1.)
+        self.assertEqual(0, execution.returncode)
+        with open(f'{self.workdir}/ulimit.txt') as fh:
+            self.assertEqual(str(1024 ** 2), fh.read().strip())
+
+    def test_batch(self):
+        executor = self.get_batch_executor()
+        execution = executor.run(cmd=f'echo hello > {self.workdir}/out.txt', cores=2, memory_gb=1.5)
+        self.assertEqual(0, execution.returncode)
+        with open(f'{self.workdir}/out.txt') as fh:
+            self.assertEqual('hello\n', fh.read())
+        with open(f'{self.workdir}/batch-jobs/job-0001.sh') as fh:
+            script = fh.read()
+        self.assertIn('#SBATCH --cpus-per-task=2', script)
+        self.assertIn('#SBATCH --mem=1536M', script)
+
+        self.assertEqual(3, executor.run(cmd='exit 3', cores=1, memory_gb=1.).returncode)
+
+    def test_processor_with_batch_executor(self):
+        self.settings.executor = self.get_batch_executor()
+        Dummy(self.settings).main(cmd=f'touch {self.workdir}/touched')
+        self.assertTrue(os.path.exists(f'{self.workdir}/touched'))
+        self.assertEqual('touch', self.settings.profiler.records[0]['command'])
+        with self.assertRaises(subprocess.CalledProcessError):
+            Dummy(self.settings).main(cmd='false')
@@ -0,0 +1,83 @@
+import gzip
+from chip_seq_pipeline.fastq import SplitFastqPair, get_lanes
+from .setup import TestCase
+
+
+class TestSplitFastqPair(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.fq1 = f'{self.workdir}/R1.fq.gz'
+        self.fq2 = f'{self.workdir}/R2.fq.gz'
+        for fq, mate in [(self.fq1, 1), (self.fq2, 2)]:
+            with gzip.open(fq, 'wt') as fh:
+                for i in range(10):
+                    fh.write(f'@read{i}/{mate}\nACGT\n+\nIIII\n')
+
+    def tearDown(self):
+        self.tear_down()
+
+    def read_names(self, fq: str) -> list:
+        with gzip.open(fq, 'rt') as fh:
+            return [line.strip() for i, line in enumerate(fh) if i % 4 == 0]
+
+    def test_main(self):
+        splitter = SplitFastqPair(self.settings)
+        splitter.READS_PER_BLOCK = 2
+        chunk_fqs = splitter.main(
+            fq1=self.fq1,
+            fq2=self.fq2,
+            chunks=3,
+            dstdir=f'{self.workdir}/chunks')
+
+        self.assertEqual(3, len(chunk_fqs))
+        names = [self.read_names(fq1) for fq1, fq2 in chunk_fqs]
+        self.assertListEqual(['@read0/1', '@read1/1', '@read6/1', '@read7/1'], names[0])
+        self.assertListEqual(['@read4/1', '@read5/1'], names[2])
+        self.assertEqual(10, sum(len(n) for n in names))
+
+        for fq1, fq2 in chunk_fqs:  # mates stay in the same order
+            self.assertListEqual(
+                [n[:-1] for n in self.read_names(fq1)],
+                [n[:-1] for n in self.read_names(fq2)])
+
+    def test_empty_chunks(self):
+        splitter = SplitFastqPair(self.settings)
+        splitter.READS_PER_BLOCK = 100
+        chunk_fqs = splitter.main(
+            fq1=self.fq1,
+            fq2=self.fq2,
+            chunks=2,
+            dstdir=f'{self.workdir}/chunks')
+        self.assertIsNotNone(chunk_fqs[0])
+        self.assertIsNone(chunk_fqs[1])
+
+
+class TestGetLanes(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_illumina_lanes(self):
+        lanes = get_lanes(
+            fq1='S1_L001_R1_001.fastq.gz, S1_L002_R1_001.fastq.gz',
+            fq2='S1_L001_R2_001.fastq.gz, S1_L002_R2_001.fastq.gz')
+        self.assertListEqual([
+            ('L001', 'S1_L001_R1_001.fastq.gz', 'S1_L001_R2_001.fastq.gz'),
+            ('L002', 'S1_L002_R1_001.fastq.gz', 'S1_L002_R2_001.fastq.gz'),
+        ], lanes)
+
+    def test_lanes_by_order(self):
+        lanes = get_lanes(fq1='a_R1.fq.gz,b_R1.fq.gz', fq2='a_R2.fq.gz,b_R2.fq.gz')
+        self.assertListEqual(['lane-1', 'lane-2'], [name for name, fq1, fq2 in lanes])
+
+    def test_single_lane(self):
+        self.assertListEqual([('lane-1', 'R1.fq.gz', 'R2.fq.gz')], get_lanes(fq1='R1.fq.gz', fq2='R2.fq.gz'))
+
+    def test_unpaired_lanes(self):
+        with self.assertRaises(AssertionError):
+            get_lanes(fq1='a_R1.fq.gz,b_R1.fq.gz', fq2='a_R2.fq.gz')
+
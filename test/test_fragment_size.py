@@ -0,0 +1,32 @@
+import json
+import pandas as pd
+from chip_seq_pipeline.fragment_size import EstimateFragmentSize, percentile
+from .setup import TestCase
+
+
+class TestEstimateFragmentSize(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        fragment_size = EstimateFragmentSize(self.settings).main(
+            bam=f'{self.indir}/sorted-treatment.bam',
+            name='treatment')
+
+        with open(f'{self.outdir}/fragment-size-treatment.json') as fh:
+            summary = json.load(fh)
+        self.assertEqual(summary['fragment_size'], fragment_size)
+        self.assertTrue(summary['estimated'])
+        df = pd.read_csv(f'{self.outdir}/fragment-size-treatment.tsv', sep='\t')
+        self.assertEqual(summary['sampled_pairs'], df['pairs'].sum())
+        self.assertEqual(summary['mode'], df.loc[df['pairs'].idxmax(), 'fragment_size'])
+
+    def test_percentile(self):
+        sizes = [(100, 1), (150, 2), (200, 6), (300, 1)]
+        self.assertEqual(100, percentile(sizes=sizes, pairs=10, q=0.05))
+        self.assertEqual(200, percentile(sizes=sizes, pairs=10, q=0.5))
+        self.assertEqual(300, percentile(sizes=sizes, pairs=10, q=0.95))
@@ -0,0 +1,101 @@
+import numpy as np
+from chip_seq_pipeline.gene_annotation import IntervalIndex, load_gene_annotation, read_peaks, annotate_peaks
+from .setup import TestCase
+
+
+GTF = '''\
+chr1\ttest\texon\t1001\t2000\t.\t+\t.\tgene_id "G1"; transcript_id "T1"; gene_name "A"; gene_type "protein_coding";
+chr1\ttest\texon\t3001\t4000\t.\t+\t.\tgene_id "G1"; transcript_id "T1"; gene_name "A"; gene_type "protein_coding";
+chr1\ttest\tCDS\t1501\t2000\t.\t+\t0\tgene_id "G1"; transcript_id "T1"; gene_name "A"; gene_type "protein_coding";
+chr1\ttest\tCDS\t3001\t3500\t.\t+\t0\tgene_id "G1"; transcript_id "T1"; gene_name "A"; gene_type "protein_coding";
+chr1\ttest\texon\t20001\t21000\t.\t-\t.\tgene_id "G2"; transcript_id "T2"; gene_name "B"; gene_type "lncRNA";
+chr1\ttest\texon\t22001\t23000\t.\t-\t.\tgene_id "G2"; transcript_id "T2"; gene_name "B"; gene_type "lncRNA";
+'''
+
+REF_GENE = '''\
+585\tT1\tchr1\t+\t1000\t4000\t1500\t3500\t2\t1000,3000,\t2000,4000,\t0\tA\tcmpl\tcmpl\t0,0,
+585\tT2\tchr1\t-\t20000\t23000\t23000\t23000\t2\t20000,22000,\t21000,23000,\t0\tB\tunk\tunk\t-1,-1,
+'''
+
+PEAKS = '''\
+#PeakID\tchr\tstart\tend\tstrand\tNormalized Tag Count
+p1\tchr1\t951\t1050\t+\t10.0
+p2\tchr1\t1201\t1300\t+\t9.0
+p3\tchr1\t1701\t1800\t+\t8.0
+p4\tchr1\t2501\t2600\t+\t7.0
+p5\tchr1\t3701\t3800\t+\t6.0
+p6\tchr1\t10001\t10100\t+\t5.0
+p7\tchr1\t21501\t21600\t+\t4.0
+p8\tchr1\t22901\t23000\t+\t3.0
+p9\tchr2\t1\t100\t+\t2.0
+'''
+
+
+class TestGeneAnnotation(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.peak_file = f'{self.workdir}/peaks.txt'
+        with open(self.peak_file, 'w') as fh:
+            fh.write(PEAKS)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_gtf(self):
+        gtf = f'{self.workdir}/genes.gtf'
+        with open(gtf, 'w') as fh:
+            fh.write(GTF)
+        df = annotate_peaks(peaks=read_peaks(self.peak_file), annotation=load_gene_annotation(gtf))
+
+        self.assertEqual([
+            'promoter-TSS (T1)',
+            "5' UTR (T1, exon 1 of 2)",
+            'exon (T1, exon 1 of 2)',
+            'intron (T1, intron 1 of 1)',
+            "3' UTR (T1, exon 2 of 2)",
+            'Intergenic',
+            'intron (T2, intron 1 of 1)',
+            'promoter-TSS (T2)',
+            'Intergenic',
+        ], list(df['Annotation']))
+        self.assertEqual(['-1', '249', '749', '1549', '2749', '9049', '1450', '50', 'NA'], list(df['Distance to TSS']))
+        self.assertEqual(['A'] * 6 + ['B'] * 2 + [''], list(df['Gene Name']))
+
+    def test_ref_gene(self):
+        ref_gene = f'{self.workdir}/refGene.txt'
+        with open(ref_gene, 'w') as fh:
+            fh.write(REF_GENE)
+        df = annotate_peaks(peaks=read_peaks(self.peak_file), annotation=load_gene_annotation(ref_gene))
+
+        self.assertEqual('exon (T1, exon 1 of 2)', df.loc[2, 'Annotation'])
+        self.assertEqual('intron (T2, intron 1 of 1)', df.loc[6, 'Annotation'])
+        self.assertEqual(['protein-coding'] * 6 + ['ncRNA'] * 2 + [''], list(df['Gene Type']))
+        self.assertEqual(['T1'] * 6 + ['T2'] * 2 + [''], list(df['Nearest PromoterID']))
+
+    def test_narrow_peak(self):
+        narrow_peak = f'{self.workdir}/narrow_peaks.narrowPeak'
+        with open(narrow_peak, 'w') as fh:
+            fh.write('chr1\t950\t1050\tpeak_1\t52\t.\t3.1\t6.2\t5.2\t50\n')
+        df = read_peaks(narrow_peak)
+        self.assertEqual(['peak_1', 'chr1', 951, 1050, '+', '52'], list(df.loc[0]))
+
+
+class TestIntervalIndex(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_find(self):
+        index = IntervalIndex(
+            chroms=['chr1', 'chr1', 'chr1', 'chr2'],
+            starts=[100, 150, 1000, 0],
+            ends=[900, 200, 1100, 10])
+        positions = np.array([50, 100, 175, 899, 900, 1050, 1100])
+        self.assertEqual([-1, 0, 0, 0, -1, 2, -1], list(index.find(chrom='chr1', positions=positions)))
+        self.assertEqual([1, -1], list(IntervalIndex(
+            chroms=['chr1', 'chr1'], starts=[100, 150], ends=[200, 500]).find(chrom='chr1', positions=np.array([180, 600]))))
+        self.assertEqual([-1], list(index.find(chrom='chr3', positions=np.array([5]))))
@@ -0,0 +1,117 @@
+import os
+import fcntl
+from chip_seq_pipeline.index_cache import IndexCache
+from chip_seq_pipeline.tools import UNKNOWN_VERSION
+from .setup import TestCase
+
+
+class TestIndexCache(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.cache_dir = f'{self.workdir}/index-cache'
+        self.ref_fa = f'{self.workdir}/ref.fa'
+        with open(self.ref_fa, 'w') as fh:
+            fh.write('>chr1\nACGTACGTACGT\n')
+        self.n_builds = 0
+        self.caches = []
+
+    def tearDown(self):
+        self.release_caches()
+        self.tear_down()
+
+    def release_caches(self):
+        while self.caches:
+            self.caches.pop().release()
+
+    def build(self, index: str):
+        self.n_builds += 1
+        with open(f'{index}.idx', 'w') as fh:
+            fh.write('A' * 1024 ** 2)  # 1 MB
+
+    def get_index(self, aligner: str, version: str, max_gb: float = 1.0) -> str:
+        cache = IndexCache(self.settings)
+        self.caches.append(cache)
+        return cache.main(
+            ref_fa=self.ref_fa,
+            aligner=aligner,
+            version=version,
+            build=self.build,
+            cache_dir=self.cache_dir,
+            max_gb=max_gb)
+
+    def test_build_once_and_reuse(self):
+        index_1 = self.get_index(aligner='bowtie2', version='2.5.1')
+        index_2 = self.get_index(aligner='bowtie2', version='2.5.1')
+        self.assertEqual(index_1, index_2)
+        self.assertEqual(1, self.n_builds)
+        self.assertTrue(os.path.exists(f'{index_1}.idx'))
+
+    def test_key_depends_on_aligner_version_and_content(self):
+        index_1 = self.get_index(aligner='bowtie2', version='2.5.1')
+        index_2 = self.get_index(aligner='bowtie2', version='2.5.2')
+        index_3 = self.get_index(aligner='bwa', version='2.5.1')
+        with open(self.ref_fa, 'a') as fh:
+            fh.write('ACGT\n')
+        index_4 = self.get_index(aligner='bowtie2', version='2.5.1')
+        self.assertEqual(4, len({index_1, index_2, index_3, index_4}))
+        self.assertEqual(4, self.n_builds)
+
+    def test_evict_least_recently_used(self):
+        max_gb = 2.5 / 1024  # room for two 1 MB entries
+        index_1 = self.get_index(aligner='bowtie2', version='1', max_gb=max_gb)
+        index_2 = self.get_index(aligner='bowtie2', version='2', max_gb=max_gb)
+        os.utime(f'{os.path.dirname(index_2)}/{IndexCache.COMPLETE_FLAG}', (0, 0))  # least recently used
+
+        index_3 = self.get_index(aligner='bowtie2', version='3', max_gb=max_gb)
+        for index in [index_1, index_2, index_3]:  # entries in use by this run are never evicted
+            self.assertTrue(os.path.exists(f'{index}.idx'))
+
+        self.release_caches()  # as if the runs using them are done
+        self.get_index(aligner='bowtie2', version='3', max_gb=max_gb)
+        self.assertTrue(os.path.exists(f'{index_1}.idx'))
+        self.assertFalse(os.path.exists(f'{index_2}.idx'))
+        self.assertFalse(os.path.exists(f'{os.path.dirname(index_2)}.lock'))  # removed along with the entry
+        self.assertTrue(os.path.exists(f'{index_3}.idx'))
+
+    def test_release(self):
+        cache = IndexCache(self.settings)
+        cache.main(
+            ref_fa=self.ref_fa,
+            aligner='bowtie2',
+            version='1',
+            build=self.build,
+            cache_dir=self.cache_dir,
+            max_gb=1.0)
+        lock = cache.held_lock
+        self.assertFalse(lock.closed)
+        cache.release()
+        self.assertTrue(lock.closed)
+        self.assertIsNone(cache.held_lock)
+        cache.release()  # releasing twice is harmless
+
+    def test_failed_build(self):
+        def build(index: str):
+            open(f'{index}.idx', 'w').close()
+            raise RuntimeError('Build failed')
+
+        cache = IndexCache(self.settings)
+        with self.assertRaises(RuntimeError):
+            cache.main(
+                ref_fa=self.ref_fa,
+                aligner='bowtie2',
+                version='1',
+                build=build,
+                cache_dir=self.cache_dir,
+                max_gb=1.0)
+        self.assertEqual([], [d for d in os.listdir(self.cache_dir) if d.startswith('.tmp-')])
+        with open(cache.lock_file, 'a') as fh:  # not held by the failed build
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self.get_index(aligner='bowtie2', version='1')  # built by the next run
+        self.assertEqual(1, self.n_builds)
+
+    def test_unknown_version(self):
+        with self.assertRaises(AssertionError):
+            self.get_index(aligner='bowtie2', version=UNKNOWN_VERSION)
+        self.assertEqual(0, self.n_builds)
@@ -1,5 +1,9 @@
-from chip_seq_pipeline.mapping import Mapping
-from .setup import TestCase
+import subprocess
+from os.path import exists
+from typing import Dict
+from chip_seq_pipeline.mapping import Mapping, BuildIndex, MapReads, MergeBams
+from chip_seq_pipeline.trimming import TrimmingStream
+from .setup import TestCase, read_markdup_metrics, count_reads
 
 
 class TestMapping(TestCase):
@@ -19,6 +23,8 @@ class TestMapping(TestCase):
             control_fq2=f'{self.indir}/test_ATO_0_Input_S1_R2_001.fastq.gz',
             read_aligner='bwa',
             bowtie2_mode='',
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
         )
         self.assertFileExists(f'{self.workdir}/sorted-treatment.bam', treatment_bam)
         self.assertFileExists(f'{self.workdir}/sorted-control.bam', control_bam)
@@ -32,6 +38,112 @@ class TestMapping(TestCase):
             control_fq2=f'{self.indir}/test_ATO_0_Input_S1_R2_001.fastq.gz',
             read_aligner='bowtie2',
             bowtie2_mode='sensitive',
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
         )
         self.assertFileExists(f'{self.workdir}/sorted-treatment.bam', treatment_bam)
         self.assertFileExists(f'{self.workdir}/sorted-control.bam', control_bam)
+
+    def test_bowtie2_index_cache(self):
+        for _ in range(2):  # the second run reuses the cached index
+            treatment_bam, control_bam = Mapping(self.settings).main(
+                ref_fa=f'{self.indir}/chr22.fa',
+                treatment_fq1=f'{self.indir}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz',
+                treatment_fq2=f'{self.indir}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz',
+                control_fq1=None,
+                control_fq2=None,
+                read_aligner='bowtie2',
+                bowtie2_mode='sensitive',
+                index_cache_dir=f'{self.workdir}/index-cache',
+                index_cache_max_gb=200.0,
+            )
+            self.assertFileExists(f'{self.workdir}/sorted-treatment.bam', treatment_bam)
+            self.assertIsNone(control_bam)
+
+    def test_bowtie2_mark_duplicates(self):
+        index = BuildIndex(self.settings).main(
+            ref_fa=f'{self.indir}/chr22.fa',
+            read_aligner='bowtie2',
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
+        )
+        bam = MapReads(self.settings).main(
+            index=index,
+            fq1=f'{self.indir}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz',
+            fq2=f'{self.indir}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz',
+            read_aligner='bowtie2',
+            bowtie2_mode='sensitive',
+            sample_name='treatment',
+            mark_duplicates=True,
+        )
+        self.assertFileExists(f'{self.workdir}/sorted-treatment-mark-duplicates.bam', bam)
+        self.assertFileExists(f'{self.workdir}/sorted-treatment-mark-duplicates.bam.bai', f'{bam}.bai')
+        stats = read_samtools_stats(f'{self.outdir}/mapping-stats-treatment.txt')  # teed from the same stream
+        self.assertEqual(count_reads(bam=bam, flags='-F 2304'), stats['raw total sequences'])
+        metrics = read_markdup_metrics(f'{self.outdir}/duplicate-metrics/sorted-treatment-duplicate-metrics.txt')
+        self.assertEqual(count_reads(bam=bam, flags='-f 1024 -F 2304'), metrics['DUPLICATE TOTAL'])
+
+    def test_bowtie2_trimming_stream(self):
+        index = BuildIndex(self.settings).main(
+            ref_fa=f'{self.indir}/chr22.fa',
+            read_aligner='bowtie2',
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
+        )
+        fq1 = f'{self.indir}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz'
+        fq2 = f'{self.indir}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz'
+        bam = MapReads(self.settings).main(
+            index=index,
+            fq1=fq1,
+            fq2=fq2,
+            read_aligner='bowtie2',
+            bowtie2_mode='sensitive',
+            sample_name='treatment',
+            trimming=TrimmingStream(fq1=fq1, fq2=fq2, base_quality_cutoff=20, min_read_length=20),
+        )
+        self.assertFileExists(f'{self.workdir}/sorted-treatment.bam', bam)
+        self.assertTrue(exists(f'{self.outdir}/fastqc/test_ATO_0_KEAP1_S4_R1_001_val_1_fastqc.html'))
+        self.assertTrue(exists(f'{self.outdir}/fastqc/test_ATO_0_KEAP1_S4_R2_001_val_2_fastqc.html'))
+        self.assertTrue(exists(f'{self.outdir}/fastqc/test_ATO_0_KEAP1_S4_R1_001.fastq.gz_trimming_report.txt'))
+
+    def test_bwa_lanes_read_groups(self):
+        index = BuildIndex(self.settings).main(
+            ref_fa=f'{self.indir}/chr22.fa',
+            read_aligner='bwa',
+            index_cache_dir=None,
+            index_cache_max_gb=200.0,
+        )
+        bams = []
+        for lane in ['L001', 'L002']:
+            bams.append(MapReads(self.settings).main(
+                index=index,
+                fq1=f'{self.indir}/test_ATO_0_KEAP1_S4_R1_001.fastq.gz',
+                fq2=f'{self.indir}/test_ATO_0_KEAP1_S4_R2_001.fastq.gz',
+                read_aligner='bwa',
+                bowtie2_mode='sensitive',
+                sample_name=f'treatment-{lane}',
+                write_stats=False,
+                read_group=(f'treatment-{lane}', 'treatment'),
+            ))
+        bam = MergeBams(self.settings).main(bams=bams, sample_name='treatment')
+        self.assertFileExists(f'{self.workdir}/sorted-treatment.bam', bam)
+        header = subprocess.check_output(f'samtools view -H {bam}', shell=True).decode()
+        self.assertListEqual([
+            '@RG\tID:treatment-L001\tSM:treatment\tLB:treatment\tPL:ILLUMINA',
+            '@RG\tID:treatment-L002\tSM:treatment\tLB:treatment\tPL:ILLUMINA',
+        ], [line for line in header.splitlines() if line.startswith('@RG')])
+        stats = read_samtools_stats(f'{self.outdir}/mapping-stats-treatment.txt')  # of the merged lanes
+        self.assertEqual(count_reads(bam=bam, flags='-F 2304'), stats['raw total sequences'])
+
+
+def read_samtools_stats(path: str) -> Dict[str, float]:
+    """
+    Summary numbers (SN lines) of samtools stats, e.g. {'raw total sequences': 2000, ...}
+    """
+    ret = {}
+    with open(path) as fh:
+        for line in fh:
+            if line.startswith('SN\t'):
+                key, value = line.split('\t')[1:3]
+                ret[key.rstrip(':')] = float(value)
+    return ret
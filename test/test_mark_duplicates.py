@@ -1,5 +1,5 @@
 from chip_seq_pipeline.mark_duplicates import MarkDuplicates
-from .setup import TestCase
+from .setup import TestCase, read_markdup_metrics, count_reads
 
 
 class TestGATKMarkDuplicates(TestCase):
@@ -17,3 +17,15 @@ class TestGATKMarkDuplicates(TestCase):
         )
         self.assertFileExists(f'{self.workdir}/sorted-treatment-mark-duplicates.bam', t)
         self.assertFileExists(f'{self.workdir}/sorted-control-mark-duplicates.bam', c)
+
+    def test_samtools_engine(self):
+        t, c = MarkDuplicates(self.settings).main(
+            treatment_bam=f'{self.indir}/sorted-treatment.bam',
+            control_bam=None,
+            engine='samtools'
+        )
+        self.assertFileExists(f'{self.workdir}/sorted-treatment-mark-duplicates.bam', t)
+        metrics = read_markdup_metrics(f'{self.outdir}/duplicate-metrics/sorted-treatment-duplicate-metrics.txt')
+        self.assertEqual(count_reads(bam=t, flags='-f 1024 -F 2304'), metrics['DUPLICATE TOTAL'])
+        self.assertIsNone(c)
+
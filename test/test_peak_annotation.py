@@ -35,6 +35,26 @@ class TestPeakAnnotation(TestCase):
         for f in annotated_files:
             self.assertTrue(exists(f))
 
+    def test_native_engine(self):
+        self.__move_test_files_to_outdir()
+
+        actual = PeakAnnotation(self.settings).main(
+            peak_files=[
+                f'{self.outdir}/homer/factor-peaks.txt',
+                f'{self.outdir}/macs2/narrow_peaks.narrowPeak',
+            ],
+            genome_version='hg38',
+            engine='native',
+            gene_annotation=f'{self.indir}/chr22.gtf')
+
+        expected = [
+            f'{self.outdir}/homer/factor-peaks-annotated.tsv',
+            f'{self.outdir}/macs2/narrow_peaks-annotated.tsv',
+        ]
+        self.assertListEqual(expected, actual)
+        for f in expected:
+            self.assertTrue(exists(f))
+
     def __move_test_files_to_outdir(self):
         for d in ['homer', 'macs2']:
             src = f'{self.indir}/{d}'
@@ -1,5 +1,9 @@
+import subprocess
 from os.path import exists
-from chip_seq_pipeline.peak_calling import PeakCalling
+from typing import List, Tuple
+from chip_seq_pipeline.tools import edit_fpath
+from chip_seq_pipeline.peak_calling import PeakCalling, MACS, HOMER, MakeGroupTagDirectories, ChromosomeGroups, \
+    write_broad_peak, merge_peak_tables
 from .setup import TestCase
 
 
@@ -30,3 +34,157 @@ class TestPeakCalling(TestCase):
         )
         for f in peak_files:
             self.assertTrue(exists(f))
+
+    def test_treatment_control_separate_calls(self):
+        peak_files = PeakCalling(self.settings).main(
+            treatment_bam=f'{self.indir}/sorted-treatment.bam',
+            control_bam=f'{self.indir}/sorted-control.bam',
+            macs_effective_genome_size='5.1e7',  # size of chr22
+            macs_fdr=0.05,
+            macs_separate_calls=True
+        )
+        for f in peak_files:
+            self.assertTrue(exists(f))
+
+    def test_read_fragment_and_tag_size(self):
+        xls = f'{self.workdir}/narrow_peaks.xls'
+        with open(xls, 'w') as fh:
+            fh.write('# This file is generated by MACS version 2.2.7.1\n# d = 251\n# tag size is determined as 75 bps\n')
+        self.assertEqual((251, 75), MACS(self.settings).read_fragment_and_tag_size(xls=xls))
+
+        with open(xls, 'w') as fh:
+            fh.write('# This file is generated by MACS version 2.2.7.1\n# fragment size is determined as 198 bps\n')
+        self.assertEqual((198, 198), MACS(self.settings).read_fragment_and_tag_size(xls=xls))
+
+        with open(xls, 'w') as fh:
+            fh.write('# This file is generated by MACS version 2.2.7.1\n')  # truncated
+        self.assertIsNone(MACS(self.settings).read_fragment_and_tag_size(xls=xls))
+
+    def test_write_broad_peak(self):
+        gapped_peak = f'{self.workdir}/broad_peaks.gappedPeak'
+        broad_peak = f'{self.workdir}/broad_peaks.broadPeak'
+        with open(gapped_peak, 'w') as fh:
+            fh.write('chr22\t100\t900\tbroadRegion1\t52\t.\t100\t900\t0\t2\t200,300\t0,500\t3.1\t6.2\t5.2\n')
+        write_broad_peak(gapped_peak=gapped_peak, broad_peak=broad_peak)
+        with open(broad_peak) as fh:
+            self.assertEqual('chr22\t100\t900\tbroadRegion1\t52\t.\t3.1\t6.2\t5.2\n', fh.read())
+
+    def test_merge_peak_tables(self):
+        txts = []
+        for i, (tags, tags_in_peaks, tag_threshold, peaks) in enumerate([
+            (1000, 100, 12, ['chr1-1\tchr1\t100\t300\t+\t20.0', 'chr1-2\tchr1\t900\t1100\t+\t10.0']),
+            (3000, 200, 15, ['chr2-1\tchr2\t500\t700\t+\t15.0']),
+        ]):
+            txts.append(f'{self.workdir}/group-{i + 1}.txt')
+            with open(txts[-1], 'w') as fh:
+                fh.write(
+                    f'# HOMER Peaks\n'
+                    f'# total peaks = {len(peaks)}\n'
+                    f'# peak size = 200\n'
+                    f'# genome size = {1000 * (i + 1)}\n'
+                    f'# Total tags = {tags}.0\n'
+                    f'# Total tags in peaks = {tags_in_peaks}.0\n'
+                    f'# Approximate IP efficiency = {100 * tags_in_peaks / tags:.2f}%\n'
+                    f'# FDR tag threshold = {tag_threshold}.0\n'
+                    f'#PeakID\tchr\tstart\tend\tstrand\tNormalized Tag Count\n'
+                    + ''.join(p + '\n' for p in peaks))
+
+        merge_peak_tables(peak_txts=txts, output=f'{self.workdir}/merged.txt')
+
+        with open(f'{self.workdir}/merged.txt') as fh:
+            self.assertEqual(
+                '# HOMER Peaks\n'
+                '# total peaks = 3\n'
+                '# peak size = 200\n'
+                '# genome size = 3000\n'
+                '# Total tags = 4000.0\n'
+                '# Total tags in peaks = 300.0\n'
+                '# Approximate IP efficiency = 7.50%\n'
+                '#PeakID\tchr\tstart\tend\tstrand\tNormalized Tag Count\n'
+                'peak-1\tchr1\t100\t300\t+\t20.0\n'
+                'peak-2\tchr2\t500\t700\t+\t15.0\n'
+                'peak-3\tchr1\t900\t1100\t+\t10.0\n',
+                fh.read())
+
+
+class TestChromosomeGroups(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        ref_fa = f'{self.workdir}/genome.fa'
+        with open(f'{ref_fa}.fai', 'w') as fh:
+            for chrom, length in [('chr1', 1000), ('chr2', 900), ('chr3', 500), ('chr4', 400), ('chrM', 16)]:
+                fh.write(f'{chrom}\t{length}\t0\t60\t61\n')
+
+        groups = ChromosomeGroups(self.settings).main(ref_fa=ref_fa, groups=2)
+
+        self.assertEqual([['chr1', 'chr4', 'chrM'], ['chr2', 'chr3']], groups)
+        self.assertTrue(exists(f'{self.outdir}/chromosome-groups.tsv'))
+
+
+class TestHOMER(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_chromosome_groups(self):
+        """
+        Peaks called by chromosome group, merged, are those of a single call over the whole genome,
+        with chr22 of the test data copied as a second chromosome, so that both groups have reads,
+        each called with half of the genome size
+
+        Tolerance: at least 95% of the peaks of either call are the same regions in the other
+        """
+        treatment_bam = copy_chromosome(
+            bam=f'{self.indir}/sorted-treatment.bam', chromosome='chr22', copy='chr22copy', workdir=self.workdir)
+        control_bam = copy_chromosome(
+            bam=f'{self.indir}/sorted-control.bam', chromosome='chr22', copy='chr22copy', workdir=self.workdir)
+        single = [read_peak_regions(f) for f in HOMER(self.settings).main(
+            treatment_bam=treatment_bam,
+            control_bam=control_bam)]
+
+        chromosome_groups = [['chr22'], ['chr22copy']]
+        grouped = [read_peak_regions(f) for f in HOMER(self.settings).main(
+            treatment_bam=treatment_bam,
+            control_bam=control_bam,
+            treatment_tag_dir=MakeGroupTagDirectories(self.settings).main(
+                bam=treatment_bam, name='treatment', chromosome_groups=chromosome_groups),
+            control_tag_dir=MakeGroupTagDirectories(self.settings).main(
+                bam=control_bam, name='control', chromosome_groups=chromosome_groups))]
+
+        for s, g in zip(single, grouped):
+            self.assertEqual({'chr22', 'chr22copy'}, {chrom for chrom, _, _ in g})
+            same = len(set(s) & set(g))
+            self.assertGreaterEqual(same, 0.95 * max(len(s), len(g)))
+
+
+def copy_chromosome(bam: str, chromosome: str, copy: str, workdir: str) -> str:
+    """
+    Writes a BAM with the alignments of the chromosome duplicated onto a copy of it, as another chromosome
+    """
+    out = edit_fpath(fpath=bam, old_suffix='.bam', new_suffix=f'-{copy}.bam', dstdir=workdir)
+    awk = (
+        f"awk 'BEGIN {{ FS = OFS = \"\\t\" }} "
+        f"/^@SQ/ && $2 == \"SN:{chromosome}\" {{ print; $2 = \"SN:{copy}\"; print; next }} "
+        f"/^@/ {{ print; next }} "
+        f"$3 == \"{chromosome}\" {{ print; $3 = \"{copy}\"; print; next }} "
+        f"{{ print }}'"
+    )
+    subprocess.check_call(
+        f'samtools view -h {bam} | {awk} | samtools sort -o {out} - && samtools index {out}', shell=True)
+    return out
+
+
+def read_peak_regions(peak_txt: str) -> List[Tuple[str, int, int]]:
+    with open(peak_txt) as fh:
+        return sorted(
+            (items[1], int(items[2]), int(items[3]))
+            for items in (line.split('\t') for line in fh if not line.startswith('#')))
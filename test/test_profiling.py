@@ -0,0 +1,45 @@
+import json
+from chip_seq_pipeline.template import Processor
+from .setup import TestCase
+
+
+class Dummy(Processor):
+
+    def main(self):
+        self.call(f'head -c 1000000 /dev/zero > {self.workdir}/zeros')
+        with self.profile():
+            with open(f'{self.workdir}/zeros', 'rb') as fh:
+                fh.read()
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_records(self):
+        Dummy(self.settings).main()
+
+        command, python_stage = self.settings.profiler.records
+        self.assertEqual('Dummy', command['stage'])
+        self.assertEqual('head', command['command'])
+        self.assertGreaterEqual(command['write_bytes'], 1000000)
+        self.assertGreater(command['peak_rss_mb'], 0)
+
+        self.assertIsNone(python_stage['command'])
+        self.assertGreaterEqual(python_stage['read_bytes'], 1000000)
+
+    def test_write_json_and_summary(self):
+        Dummy(self.settings).main()
+        Dummy(self.settings).main()
+
+        profiler = self.settings.profiler
+        profiler.write_json(f'{self.outdir}/profile.json')
+        with open(f'{self.outdir}/profile.json') as fh:
+            data = json.load(fh)
+        self.assertEqual(4, len(data['records']))
+        self.assertEqual(4, data['stages'][0]['calls'])
+        self.assertIn('Dummy', profiler.summary_table())
@@ -0,0 +1,178 @@
+import os
+import time
+from chip_seq_pipeline.scheduler import DAGScheduler
+from .setup import TestCase
+
+
+class TestDAGScheduler(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.scheduler = DAGScheduler(settings=self.settings, max_workers=4, manifest_dir=None)
+        self.events = []
+        self.calls = []
+
+    def tearDown(self):
+        self.tear_down()
+
+    def sleep_and_return(self, value: str, seconds: float = 0.) -> str:
+        self.events.append(f'start {value}')
+        time.sleep(seconds)
+        self.events.append(f'end {value}')
+        return value
+
+    def test_inputs_and_params(self):
+        a = self.scheduler.add(name='a', function=self.sleep_and_return, params=dict(value='A'))
+        b = self.scheduler.add(name='b', function=lambda x, y: x + y, inputs=dict(x=a), params=dict(y='B'))
+        self.scheduler.run()
+        self.assertEqual('AB', self.scheduler.result(b))
+
+    def test_list_of_inputs(self):
+        chunks = [
+            self.scheduler.add(name=f'chunk-{i}', function=self.sleep_and_return, params=dict(value=str(i)))
+            for i in range(3)
+        ]
+        merge = self.scheduler.add(name='merge', function=lambda values: ''.join(values), inputs=dict(values=chunks))
+        self.scheduler.run()
+        self.assertEqual('012', self.scheduler.result(merge))
+
+    def test_independent_tasks_overlap(self):
+        self.scheduler.add(name='a', function=self.sleep_and_return, params=dict(value='a', seconds=0.3))
+        self.scheduler.add(name='b', function=self.sleep_and_return, params=dict(value='b', seconds=0.3))
+        self.scheduler.add(name='c', function=self.sleep_and_return, params=dict(value='c'), dependencies=['a', 'b'])
+
+        start = time.time()
+        self.scheduler.run()
+        self.assertLess(time.time() - start, 0.55)
+        self.assertListEqual(['start c', 'end c'], self.events[-2:])
+
+    def test_failure_stops_downstream(self):
+        def fail():
+            raise ValueError('failed')
+        a = self.scheduler.add(name='a', function=fail)
+        self.scheduler.add(name='b', function=self.sleep_and_return, params=dict(value='b'), dependencies=[a])
+        with self.assertRaises(ValueError):
+            self.scheduler.run()
+        self.assertListEqual([], self.events)
+        self.assertEqual('cancelled', self.scheduler.status('b'))
+
+    def test_failure_does_not_stop_independent_tasks(self):
+        def fail():
+            raise ValueError('failed')
+        a = self.scheduler.add(name='a', function=fail)
+        self.scheduler.add(name='b', function=self.sleep_and_return, params=dict(value='b', seconds=0.1))
+        self.scheduler.add(name='c', function=self.sleep_and_return, params=dict(value='c'), dependencies=['b'])
+        with self.assertRaises(ValueError):
+            self.scheduler.run()
+        self.assertEqual('failed', self.scheduler.status(a))
+        self.assertEqual('done', self.scheduler.status('c'))
+        self.assertEqual('c', self.scheduler.result('c'))
+
+    def test_unknown_upstream(self):
+        with self.assertRaises(AssertionError):
+            self.scheduler.add(name='a', function=self.sleep_and_return, inputs=dict(value='b'))
+
+    def write_file(self, name: str, content: str) -> str:
+        self.calls.append(name)
+        path = f'{self.workdir}/{name}.txt'
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+
+    def concat_files(self, name: str, files: list) -> str:
+        content = ''
+        for f in files:
+            with open(f) as fh:
+                content += fh.read()
+        return self.write_file(name=name, content=content)
+
+    def run_resumable(self, a_content: str, b_content: str):
+        scheduler = DAGScheduler(settings=self.settings, max_workers=4, manifest_dir=f'{self.workdir}/manifests')
+        a = scheduler.add(name='a', function=self.write_file, params=dict(name='a', content=a_content))
+        b = scheduler.add(name='b', function=self.write_file, params=dict(name='b', content=b_content))
+        scheduler.add(name='c', function=lambda a, b: self.concat_files(name='c', files=[a, b]), inputs=dict(a=a, b=b))
+        scheduler.run()
+        return scheduler
+
+    def test_resume_skips_unchanged_tasks(self):
+        self.run_resumable(a_content='A', b_content='B')
+        self.assertListEqual(['a', 'b', 'c'], sorted(self.calls))
+
+        self.calls = []
+        scheduler = self.run_resumable(a_content='A', b_content='B')
+        self.assertListEqual([], self.calls)
+        self.assertEqual(f'{self.workdir}/c.txt', scheduler.result('c'))
+
+    def test_resume_reruns_changed_parameter_and_downstream(self):
+        self.run_resumable(a_content='A', b_content='B')
+        self.calls = []
+        time.sleep(0.01)  # new mtime for rewritten files
+        self.run_resumable(a_content='A', b_content='X')
+        self.assertListEqual(['b', 'c'], sorted(self.calls))
+        with open(f'{self.workdir}/c.txt') as fh:
+            self.assertEqual('AX', fh.read())
+
+    def test_resume_reruns_missing_output(self):
+        self.run_resumable(a_content='A', b_content='B')
+        os.remove(f'{self.workdir}/c.txt')
+        self.calls = []
+        self.run_resumable(a_content='A', b_content='B')
+        self.assertListEqual(['c'], self.calls)
+
+    def run_with_files(self, genome: str, ref_fa: str) -> DAGScheduler:
+        """
+        'index' writes files sharing a prefix, 'count' reads the reference, whose path is an input file,
+        and 'annotate' takes a genome name, which is compared by value only
+        """
+        def index(ref_fa: str) -> str:
+            self.calls.append('index')
+            prefix = f'{self.workdir}/index'
+            for suffix in ['1.idx', '2.idx']:
+                with open(f'{prefix}.{suffix}', 'w') as fh:
+                    fh.write(suffix)
+            return prefix
+
+        def annotate(genome: str) -> str:
+            self.calls.append('annotate')
+            return genome
+
+        scheduler = DAGScheduler(settings=self.settings, max_workers=4, manifest_dir=f'{self.workdir}/manifests')
+        i = scheduler.add(name='index', function=index, params=dict(ref_fa=ref_fa), files=['ref_fa'], prefix_result=True)
+        scheduler.add(name='map', function=lambda index: self.calls.append('map'), inputs=dict(index=i))
+        scheduler.add(name='annotate', function=annotate, params=dict(genome=genome))
+        scheduler.run()
+        return scheduler
+
+    def test_resume_fingerprints_input_files_and_prefixes(self):
+        ref_fa = f'{self.workdir}/ref.fa'
+        with open(ref_fa, 'w') as fh:
+            fh.write('>chr1\nACGT\n')
+        genome = f'{self.workdir}/hg38'  # not a file, but the prefix of one
+        with open(f'{genome}.txt', 'w') as fh:
+            fh.write('not an input')
+
+        self.run_with_files(genome=genome, ref_fa=ref_fa)
+        self.assertListEqual(['annotate', 'index', 'map'], sorted(self.calls))
+
+        self.calls = []
+        time.sleep(0.01)  # new mtime for rewritten files
+        with open(f'{genome}.txt', 'w') as fh:
+            fh.write('changed')
+        self.run_with_files(genome=genome, ref_fa=ref_fa)
+        self.assertListEqual([], self.calls)
+
+        self.calls = []
+        os.remove(f'{self.workdir}/index.2.idx')
+        self.run_with_files(genome=genome, ref_fa=ref_fa)
+        self.assertListEqual(['index', 'map'], sorted(self.calls))
+
+        self.calls = []
+        time.sleep(0.01)
+        with open(ref_fa, 'a') as fh:
+            fh.write('ACGT\n')
+        self.run_with_files(genome=genome, ref_fa=ref_fa)
+        self.assertListEqual(['index', 'map'], sorted(self.calls))
+
+    def test_unknown_file_param(self):
+        with self.assertRaises(AssertionError):
+            self.scheduler.add(name='a', function=self.sleep_and_return, params=dict(value='a'), files=['path'])
@@ -0,0 +1,38 @@
+import os
+import json
+import subprocess
+from chip_seq_pipeline.stub_tools import install_stub_tools, STUB_VERSION
+from .setup import TestCase
+
+
+class TestStubTools(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        cost_model_json = f'{self.workdir}/cost-model.json'
+        with open(cost_model_json, 'w') as fh:
+            json.dump({'default': {'seconds': 0., 'seconds_per_gb': 0.}, 'bowtie2': {'seconds': 0.}}, fh)
+        self.bindir = install_stub_tools(bindir=f'{self.workdir}/bin', cost_model_json=cost_model_json)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def run_stub(self, cmd: str) -> str:
+        env = dict(os.environ, PATH=f'{self.bindir}:{os.environ["PATH"]}')
+        p = subprocess.run(cmd, shell=True, env=env, check=True, stdout=subprocess.PIPE, executable='/bin/bash')
+        return p.stdout.decode()
+
+    def test_version(self):
+        self.assertIn(STUB_VERSION, self.run_stub('samtools --version'))
+
+    def test_align_sort_index(self):
+        fq = f'{self.workdir}/reads.fq'
+        with open(fq, 'w') as fh:
+            fh.write('@r1\nACGT\n+\nIIII\n' * 100)
+        bam = f'{self.workdir}/sorted.bam'
+        self.run_stub(
+            f'set -o pipefail; bowtie2 -p 2 -x {self.workdir}/index -1 {fq} -2 {fq} '
+            f'| samtools sort -@ 2 -o {bam} -')
+        self.run_stub(f'samtools index {bam}')
+        self.assertGreater(os.path.getsize(bam), 0)
+        self.assertTrue(os.path.exists(f'{bam}.bai'))
@@ -0,0 +1,114 @@
+import time
+import threading
+from multiprocessing.pool import ThreadPool
+from chip_seq_pipeline.template import CoreAllocator, MemoryAllocator, get_tool_name
+from .setup import TestCase
+
+
+class TestCoreAllocator(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.allocator = CoreAllocator(total=4)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def tearDown(self):
+        self.tear_down()
+
+    def use_cores(self, cores: int) -> int:
+        with self.allocator.reserve(cores=cores) as granted:
+            with self.lock:
+                self.in_use += granted
+                self.max_in_use = max(self.max_in_use, self.in_use)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_use -= granted
+        return granted
+
+    def test_never_exceed_total(self):
+        with ThreadPool(8) as p:
+            granted = p.map(self.use_cores, [1, 2, 3, 4, 1, 2, 3, 4])
+        self.assertListEqual([1, 2, 3, 4, 1, 2, 3, 4], granted)
+        self.assertLessEqual(self.max_in_use, 4)
+        self.assertEqual(0, self.allocator.used)
+
+    def test_request_more_than_total(self):
+        self.assertEqual(4, self.use_cores(cores=16))
+
+    def test_nested_reservation(self):
+        with self.allocator.reserve(cores=3) as outer:
+            with self.allocator.reserve(cores=1) as inner:
+                self.assertEqual(1, inner)
+                self.assertEqual(3, self.allocator.used)
+        self.assertEqual(3, outer)
+        self.assertEqual(0, self.allocator.used)
+
+    def reserve_in_group(self, group: str) -> int:
+        with self.allocator.reserve(cores=4, group=group) as granted:
+            return granted
+
+    def test_fair_share_among_groups(self):
+        with self.allocator.reserve(cores=2, group='sample-1') as first:
+            with ThreadPool(1) as p:
+                second = p.apply(self.reserve_in_group, ('sample-2',))
+        self.assertEqual(2, first)
+        self.assertEqual(2, second)  # half of the cores, while sample-1 is active
+        self.assertEqual(4, self.reserve_in_group(group='sample-2'))
+
+
+class TestMemoryAllocator(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.allocator = MemoryAllocator(capacity_gb=10.)
+        self.lock = threading.Lock()
+        self.in_use = 0.
+        self.max_in_use = 0.
+
+    def tearDown(self):
+        self.tear_down()
+
+    def use_memory(self, gb: float) -> float:
+        with self.allocator.reserve(gb=gb) as reserved:
+            with self.lock:
+                self.in_use += reserved
+                self.max_in_use = max(self.max_in_use, self.in_use)
+            time.sleep(0.05)
+            with self.lock:
+                self.in_use -= reserved
+        return reserved
+
+    def test_admission(self):
+        with ThreadPool(6) as p:
+            p.map(self.use_memory, [6., 6., 4., 4., 2., 8.])
+        self.assertLessEqual(self.max_in_use, 10.)
+        self.assertEqual(0., self.allocator.used_gb)
+
+    def test_larger_than_capacity(self):
+        self.assertEqual(10., self.use_memory(gb=64.))
+
+    def test_estimate(self):
+        self.assertEqual(MemoryAllocator.DEFAULT_ESTIMATE_GB, self.allocator.estimate(tool='macs2 callpeak', declared_gb=None))
+        self.allocator.learn(tool='macs2 callpeak', peak_gb=3.)
+        self.assertEqual(3., self.allocator.estimate(tool='macs2 callpeak', declared_gb=None))
+        self.assertEqual(5., self.allocator.estimate(tool='macs2 callpeak', declared_gb=5.))
+
+
+class TestFunctions(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_get_tool_name(self):
+        for cmd, expected in [
+            ('samtools sort -@ 4 -o out.bam -', 'samtools sort'),
+            ('gatk --java-options "-Xmx7g" MarkDuplicates', 'gatk'),
+            ('bowtie2 \\\n  -x index', 'bowtie2'),
+            ('Rscript ./workdir/covplot.R', 'Rscript'),
+        ]:
+            self.assertEqual(expected, get_tool_name(cmd))
@@ -1,4 +1,4 @@
-from chip_seq_pipeline.trimming import Trimming
+from chip_seq_pipeline.trimming import Trimming, TrimGalore, merge_trimming_reports
 from .setup import TestCase
 
 
@@ -26,3 +26,45 @@ class TestTrimming(TestCase):
             (f'{self.workdir}/test_ATO_0_KEAP1_S4_R2_001_val_2.fq.gz', control_fq2),
         ]:
             self.assertFileExists(expected, actual)
+
+    def test_uncompressed(self):
+        fq1, fq2 = TrimGalore(self.settings).main(
+            fq1=f'{self.indir}/test_ATO_0_Input_S1_R1_001.fastq.gz',
+            fq2=f'{self.indir}/test_ATO_0_Input_S1_R2_001.fastq.gz',
+            base_quality_cutoff=20,
+            min_read_length=20,
+            compress=False
+        )
+        self.assertFileExists(f'{self.workdir}/test_ATO_0_Input_S1_R1_001_val_1.fq', fq1)
+        self.assertFileExists(f'{self.workdir}/test_ATO_0_Input_S1_R2_001_val_2.fq', fq2)
+
+    def test_merge_trimming_reports(self):
+        reports = []
+        for i, (reads, removed) in enumerate([(1000, 10), (2000, 5)]):
+            report = f'{self.workdir}/chunk-{i + 1}_R2.fq.gz_trimming_report.txt'
+            with open(report, 'w') as fh:
+                fh.write(f'''Quality Phred score cutoff: 20
+
+=== Summary ===
+
+Total reads processed:                   {reads:,}
+Reads with adapters:                       100 (10.0%)
+Quality-trimmed:                         1,500 bp (0.5%)
+
+=== Adapter 1 ===
+
+Sequence: AGATCGGAAGAGC; Type: regular 3'; Length: 13; Trimmed: 100 times
+Number of sequence pairs removed because at least one read was shorter than the length cutoff (20 bp): {removed} (1.00%)
+''')
+            reports.append(report)
+
+        output = f'{self.workdir}/merged_trimming_report.txt'
+        merge_trimming_reports(reports=reports, output=output, title='Merged')
+
+        with open(output) as fh:
+            summary = fh.read().split('=== Chunk report')[0]
+        self.assertIn('Total reads processed: 3,000\n', summary)
+        self.assertIn('Reads with adapters: 200\n', summary)
+        self.assertIn('Quality-trimmed: 3,000 bp\n', summary)
+        self.assertIn('(20 bp): 15\n', summary)
+        self.assertNotIn('cutoff: 40', summary)